@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def install_query_timer(sender, connection, **kwargs):
+    from .metrics import time_queries
+
+    # The wrapper list outlives reconnects of the same connection object.
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.core'
+
+    def ready(self):
+        connection_created.connect(install_query_timer)
@@ -0,0 +1,191 @@
+"""
+CompressedJSONField: JSON stored as a compressed BLOB, decoded lazily.
+
+Stored layout is a one-byte codec tag followed by the body:
+
+    0x00  plain UTF-8 JSON (values below COMPRESSED_JSON_MIN_SIZE)
+    0x01  zlib
+    0x02  zstd
+    0x03  zstd with a trained dictionary (4-byte big-endian dict id follows)
+
+zstd needs the ``zstandard`` package (in requirements.txt); an install
+without it writes zlib and can't read zstd rows. Rows written by the old
+JSONField (plain JSON text) are still read transparently.
+
+Loading a row keeps the stored bytes; they are only decompressed + parsed
+the first time the attribute is read, and saving an unread value writes the
+stored bytes back unchanged. Note that ``values()``/``values_list()`` return
+the undecoded ``CompressedValue`` — call ``.decode()`` on it.
+"""
+import json
+import struct
+import threading
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:  # listed in requirements.txt; zlib only without it
+    zstandard = None
+
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+ZSTD_DICT = 3
+
+_local = threading.local()
+_dict_lock = threading.Lock()
+_zstd_dict = None
+
+
+def _load_zstd_dict():
+    """The trained dictionary from COMPRESSED_JSON_ZSTD_DICT, or None."""
+    global _zstd_dict
+    path = settings.COMPRESSED_JSON_ZSTD_DICT
+    if not path or zstandard is None:
+        return None
+    if _zstd_dict is None:
+        with _dict_lock:
+            if _zstd_dict is None:
+                with open(path, "rb") as f:
+                    _zstd_dict = zstandard.ZstdCompressionDict(f.read())
+    return _zstd_dict
+
+
+def _zstd_compressor(dictionary):
+    # Compressor objects aren't thread-safe; keep one per thread.
+    key = ("c", dictionary.dict_id() if dictionary else None)
+    cache = _local.__dict__.setdefault("zstd", {})
+    if key not in cache:
+        cache[key] = zstandard.ZstdCompressor(level=settings.COMPRESSED_JSON_LEVEL, dict_data=dictionary)
+    return cache[key]
+
+
+def _zstd_decompressor(dictionary):
+    key = ("d", dictionary.dict_id() if dictionary else None)
+    cache = _local.__dict__.setdefault("zstd", {})
+    if key not in cache:
+        cache[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return cache[key]
+
+
+def compress(data, codec=None):
+    """Compress UTF-8 JSON bytes into the tagged storage format."""
+    if len(data) < settings.COMPRESSED_JSON_MIN_SIZE:
+        return bytes([RAW]) + data
+
+    codec = codec or settings.COMPRESSED_JSON_CODEC
+    if codec == "zstd" and zstandard is not None:
+        dictionary = _load_zstd_dict()
+        body = _zstd_compressor(dictionary).compress(data)
+        if dictionary:
+            return bytes([ZSTD_DICT]) + struct.pack(">I", dictionary.dict_id()) + body
+        return bytes([ZSTD]) + body
+
+    return bytes([ZLIB]) + zlib.compress(data, settings.COMPRESSED_JSON_LEVEL)
+
+
+def decompress(blob):
+    """Inverse of compress(); returns the UTF-8 JSON bytes."""
+    blob = bytes(blob)
+    tag, body = blob[0], blob[1:]
+
+    if tag == RAW:
+        return body
+    if tag == ZLIB:
+        return zlib.decompress(body)
+    if tag in (ZSTD, ZSTD_DICT):
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed value but the 'zstandard' package is not installed.")
+        dictionary = None
+        if tag == ZSTD_DICT:
+            (dict_id,), body = struct.unpack(">I", body[:4]), body[4:]
+            dictionary = _load_zstd_dict()
+            if dictionary is None or dictionary.dict_id() != dict_id:
+                raise RuntimeError(f"zstd dictionary {dict_id} is required to read this value.")
+        return _zstd_decompressor(dictionary).decompress(body)
+
+    raise ValueError(f"Unknown compression tag {tag}")
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class CompressedValue:
+    """Stored (still compressed) form of a CompressedJSONField value."""
+    __slots__ = ("raw",)
+
+    def __init__(self, raw):
+        # bytes in the tagged format, or str for legacy uncompressed JSON text
+        self.raw = raw
+
+    @property
+    def is_legacy(self):
+        return isinstance(self.raw, str)
+
+    def decode(self):
+        if self.is_legacy:
+            return json.loads(self.raw)
+        return json.loads(decompress(self.raw))
+
+    def encoded(self):
+        if self.is_legacy:
+            return compress(self.raw.encode())
+        return bytes(self.raw)
+
+    def __repr__(self):
+        return f"<CompressedValue {len(self.raw)} bytes>"
+
+
+class CompressedJSONAttribute(DeferredAttribute):
+    """
+    Decodes the stored value on first access and caches the result.
+
+    Defines __set__ so it's a data descriptor: otherwise the loaded value
+    in the instance __dict__ would shadow it and never be decoded.
+    """
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedValue):
+            value = value.decode()
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
+class CompressedJSONField(models.BinaryField):
+    descriptor_class = CompressedJSONAttribute
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return CompressedValue(value if isinstance(value, str) else bytes(value))
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        # Read the raw slot so saving doesn't force a decode.
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, CompressedValue):
+            return value.encoded()
+        return compress(dumps(value))
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
+
@@ -0,0 +1,208 @@
+"""
+Shared outbound HTTP transport for the Salla and FunnerLife clients.
+
+One ``requests.Session`` is reused process-wide so that calls to the same
+host (api.salla.dev, accounts.salla.sa, api.funnerlife.id) go through a
+keep-alive connection pool instead of paying a TCP+TLS handshake each time.
+
+The async views use ``AsyncHTTPTransport`` instead: an ``aiohttp`` session
+per event loop, so hundreds of calls can wait on upstreams without holding a
+thread each (aiohttp is in requirements.txt; without it this falls back to
+running the sync transport in worker threads).
+"""
+import asyncio
+import json
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    import aiohttp
+except ImportError:  # async views then use the sync transport in threads
+    aiohttp = None
+
+
+def never_sent(error):
+    """
+    Whether ``error``, raised by a transport, means the request never left:
+    no connection could be opened (refused, DNS, connect timeout).
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0] if error.args else None, "reason", None)
+        return isinstance(reason, urllib3.exceptions.ConnectTimeoutError)  # incl. NewConnectionError
+    if aiohttp is not None:
+        return isinstance(error, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+    return False
+
+
+class HTTPTransport:
+    """Pooled ``requests`` session with per-host connection reuse counters."""
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, connect_timeout=None, read_timeout=None):
+        self.pool_connections = pool_connections or settings.HTTP_POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or settings.HTTP_POOL_MAXSIZE
+        self.connect_timeout = connect_timeout or settings.HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.HTTP_READ_TIMEOUT
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=False,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._requests = {}
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send a request through the pool.
+
+        ``timeout`` is the read timeout in seconds (a ``(connect, read)``
+        tuple is passed through unchanged); the connect timeout always
+        comes from settings.
+        """
+        if timeout is None:
+            timeout = self.read_timeout
+        if not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """
+        Per-host counters: requests sent, connections opened and how many
+        requests were served on an already-open (reused) connection.
+        """
+        result = {}
+        pools = self.session.get_adapter("https://").poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = key.key_host if key.key_port in (None, 80, 443) else f"{key.key_host}:{key.key_port}"
+            entry = result.setdefault(host, {"requests": 0, "connections": 0, "reused": 0})
+            entry["connections"] += pool.num_connections
+            entry["reused"] += max(pool.num_requests - pool.num_connections, 0)
+
+        with self._lock:
+            for host, count in self._requests.items():
+                result.setdefault(host, {"requests": 0, "connections": 0, "reused": 0})["requests"] = count
+
+        return result
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport()
+    return _transport
+
+
+class AsyncResponse:
+    """The parts of a ``requests`` response the clients use."""
+
+    def __init__(self, status_code, content, encoding="utf-8", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHTTPTransport:
+    """Pooled ``aiohttp`` session with the same timeout rules as HTTPTransport."""
+
+    def __init__(self, max_connections=None, connect_timeout=None, read_timeout=None):
+        self.max_connections = max_connections or settings.HTTP_ASYNC_MAX_CONNECTIONS
+        self.connect_timeout = connect_timeout or settings.HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.HTTP_READ_TIMEOUT
+        self._requests = {}
+
+        self.session = None
+        if aiohttp is not None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send a request and read the whole body; takes the ``requests``
+        keyword arguments the clients use (params, headers, data, json).
+        """
+        if self.session is None:
+            return await sync_to_async(get_transport().request, thread_sensitive=False)(
+                method, url, timeout=timeout, **kwargs
+            )
+
+        if timeout is None:
+            timeout = self.read_timeout
+        host = urlsplit(url).netloc
+        self._requests[host] = self._requests.get(host, 0) + 1
+
+        client_timeout = aiohttp.ClientTimeout(sock_connect=min(self.connect_timeout, timeout), sock_read=timeout)
+        async with self.session.request(method, url, timeout=client_timeout, **kwargs) as response:
+            content = await response.read()
+            return AsyncResponse(response.status, content, response.charset or "utf-8", response.headers)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self):
+        return {host: {"requests": count} for host, count in self._requests.items()}
+
+    async def aclose(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# An aiohttp session's connections belong to the loop that opened them.
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport():
+    """Return the async transport of the running event loop."""
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = _async_transports[loop] = AsyncHTTPTransport()
+    return transport
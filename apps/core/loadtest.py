@@ -0,0 +1,149 @@
+"""
+Load generator and report for `manage.py loadtest`.
+
+WebhookGenerator sends signed Salla webhooks to a running server at a fixed
+rate. Sending is open loop: request i is due at ``start + i / rate``
+whether or not earlier ones have answered. Latency is measured from that
+due time, so a server that falls behind shows up in p95/p99 instead of
+quietly slowing the generator down.
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from apps.salla.synthetic import sample_order, sample_webhook
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (0 when empty)."""
+    if not sorted_values:
+        return 0
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def webhook_bodies(count, items_for, payload_items=1.0, update_ratio=0.0, seed=1, first_order_id=1):
+    """
+    ``count`` webhook bodies for paid orders.
+
+    ``items_for(order_id)`` gives an order's items (the stub's, so a later
+    orders/items fetch agrees). A ``payload_items`` share of the bodies
+    carry them, and the rest make the pipeline fetch them. An
+    ``update_ratio`` share are order.updated for an order already sent;
+    those must not charge again.
+    """
+    rng = random.Random(seed)
+    bodies, sent = [], []
+    for _ in range(count):
+        if sent and rng.random() < update_ratio:
+            event, order_id = "order.updated", rng.choice(sent)
+        else:
+            event, order_id = "order.created", first_order_id + len(sent)
+            sent.append(order_id)
+
+        order = sample_order(order_id=order_id, items=0, status="paid", rng=random.Random(order_id))
+        if rng.random() < payload_items:
+            order["items"] = items_for(order_id)
+        else:
+            order.pop("items")
+        bodies.append(json.dumps(sample_webhook(event=event, order=order)).encode())
+    return bodies
+
+
+class WebhookGenerator:
+    def __init__(self, url, secret=None, rate=20, concurrency=64, timeout=60):
+        self.url = url
+        self.secret = secret
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def headers(self, body):
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            headers["x-salla-signature"] = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        return headers
+
+    def _send(self, body, due):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        try:
+            status = self._local.session.post(self.url, data=body, headers=self.headers(body), timeout=self.timeout).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return time.perf_counter() - due, status
+
+    def run(self, bodies):
+        """Send ``bodies`` at ``rate``/s; returns (latencies, statuses, elapsed seconds)."""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="loadgen") as pool:
+            started = time.perf_counter()
+            futures = []
+            for i, body in enumerate(bodies):
+                due = started + i / self.rate
+                pause = due - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+                futures.append(pool.submit(self._send, body, due))
+            results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+
+        return [r[0] for r in results], [r[1] for r in results], elapsed
+
+
+def build_report(latencies, statuses, send_elapsed, processing_elapsed, events, charges, upstream, db_growth):
+    """The loadtest numbers as one flat-ish dict (also what --save writes)."""
+    ok = sorted(latency for latency, status in zip(latencies, statuses) if status == 200)
+    errors = {}
+    for status in statuses:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+
+    return {
+        "webhooks": len(statuses),
+        "ok": len(ok),
+        "errors": errors,
+        "throughput": round(len(ok) / send_elapsed, 2) if send_elapsed else 0,
+        "latency_ms": {
+            name: round(percentile(ok, p) * 1000, 1)
+            for name, p in [("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)]
+        },
+        "events": events,
+        "charges": charges,
+        "charges_per_second": round(charges / processing_elapsed, 2) if processing_elapsed else 0,
+        "processing_seconds": round(processing_elapsed, 2),
+        "upstream_calls": upstream,
+        "db_growth_bytes": db_growth,
+        "db_bytes_per_webhook": round(db_growth / len(statuses)) if statuses else 0,
+    }
+
+
+# Report values where bigger is worse / better, for --baseline.
+HIGHER_IS_WORSE = [("latency_ms", "p50"), ("latency_ms", "p95"), ("latency_ms", "p99"), ("db_bytes_per_webhook",)]
+LOWER_IS_WORSE = [("throughput",), ("charges_per_second",)]
+
+
+def _value(report, path):
+    for key in path:
+        report = report.get(key, {}) if isinstance(report, dict) else {}
+    return report if isinstance(report, (int, float)) else None
+
+
+def regressions(report, baseline, tolerance=0.2):
+    """Values more than ``tolerance`` (a fraction) worse than ``baseline``."""
+    found = []
+    for paths, worse in [(HIGHER_IS_WORSE, 1), (LOWER_IS_WORSE, -1)]:
+        for path in paths:
+            now, before = _value(report, path), _value(baseline, path)
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            if change * worse > tolerance:
+                found.append(f"{'.'.join(path)}: {before} -> {now} ({change:+.0%})")
+    return found
@@ -0,0 +1,120 @@
+"""
+Structured JSON logs with a correlation ID.
+
+A correlation ID is set per request by CorrelationMiddleware (or taken from
+an incoming X-Correlation-ID header) and lives in a contextvar. The webhook
+stores it on the WebhookEvent, the queue worker and the charge calls run
+under it, each FunnerlifeTransaction keeps it, and the FunnerLife callback
+adopts the transaction's ID. So one ID ties the webhook, the Salla fetch,
+the charge and the callback of an order together.
+
+BufferedJSONHandler only puts records on an in-memory queue; a background
+thread formats and writes them. Logging never waits on stderr. When the
+queue is full, records are dropped and counted instead of blocking.
+"""
+import json
+import logging
+import queue
+import sys
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+_correlation_id = ContextVar("correlation_id", default=None)
+
+# LogRecord attributes that aren't ``extra={...}`` fields.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+def set_correlation_id(correlation_id):
+    """Set the ID for the rest of this context; returns a token for reset_correlation_id()."""
+    return _correlation_id.set(correlation_id)
+
+
+def reset_correlation_id(token):
+    _correlation_id.reset(token)
+
+
+@contextmanager
+def correlation(correlation_id=None):
+    """Run the block under ``correlation_id`` (a new one when empty)."""
+    token = _correlation_id.set(correlation_id or new_correlation_id())
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, correlation_id and any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BufferedJSONHandler(QueueHandler):
+    """
+    Queue records from the calling thread; a QueueListener thread writes them
+    as JSON lines to ``stream``. At most ``capacity`` records wait; beyond
+    that new records are dropped (see ``dropped``).
+    """
+
+    def __init__(self, stream=None, capacity=10000):
+        super().__init__(queue.Queue(maxsize=capacity))
+        self.dropped = 0
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, target, respect_handler_level=False)
+        self.listener.start()
+        self._listening = True
+
+    def prepare(self, record):
+        # Runs on the caller's thread: capture the context and render the
+        # message and traceback now, leaving only JSON encoding and the write
+        # to the listener.
+        record = logging.makeLogRecord(vars(record))
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = get_correlation_id()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        # logging.shutdown() closes handlers at exit: write out what's queued first.
+        if self._listening:
+            self._listening = False
+            self.listener.stop()
+        super().close()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.core.http import get_async_transport
+from apps.core.stubs import StubConfig, StubProcess
+from apps.salla.synthetic import sample_order, sample_webhook
+
+SKUS = ["1001", "1002", "1003", "1004", "1005"]
+
+
+class ThreadPeak:
+    """The most threads alive at once while the block runs (sampled every ``interval`` s)."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            # Not counting the sampler itself.
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._sampler.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare webhook throughput of the sync views (WSGI-style, one thread per "
+        "request) and the async views (ASGI, one event loop) against local stub "
+        "Salla/FunnerLife upstreams with a fixed latency. Runs in a throwaway database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["wsgi", "asgi"],
+                            help="Run one mode in this process (default: both, each in a subprocess).")
+        parser.add_argument("--requests", type=int, default=200, help="Webhooks sent per mode.")
+        parser.add_argument("--items", type=int, default=2, help="Chargeable items per order.")
+        parser.add_argument("--latency-ms", type=float, default=500, help="Stub upstream latency per call.")
+        parser.add_argument("--threads", type=int, default=8,
+                            help="WSGI: request threads (gunicorn workers x threads).")
+        parser.add_argument("--concurrency", type=int, default=100, help="ASGI: requests in flight.")
+        parser.add_argument("--charge-concurrency", type=int, default=100,
+                            help="CHARGE_MAX_CONCURRENCY / FunnerLife cap during the run.")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options["mode"]:
+            return self.run_mode(options)
+
+        # Each mode gets a fresh process: the URLconf picks the views from
+        # ASYNC_VIEWS at import time.
+        argv = [sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_asgi"]
+        for name in ["requests", "items", "latency_ms", "threads", "concurrency", "charge_concurrency", "seed"]:
+            argv += [f"--{name.replace('_', '-')}", str(options[name])]
+        for mode in ["wsgi", "asgi"]:
+            # Per-webhook INFO logs would interleave with the results.
+            env = dict(os.environ, ASYNC_VIEWS="True" if mode == "asgi" else "False", LOG_LEVEL="WARNING")
+            result = subprocess.run(argv + ["--mode", mode], env=env, capture_output=True, text=True)
+            self.stdout.write(result.stdout.rstrip())
+            if result.returncode:
+                self.stderr.write(result.stderr)
+
+    def run_mode(self, options):
+        stub = StubProcess(StubConfig(
+            latency=options["latency_ms"] / 1000,
+            items_per_order=options["items"],
+            skus=SKUS,
+        ))
+
+        # Point the clients at the stub for this process only.
+        from apps.salla import client as salla_client
+        from apps.funnerlife import client as funnerlife_client
+        salla_client.BASE_URL = f"{stub.url}/admin/v2/"
+        funnerlife_client.ORDER_URL = f"{stub.url}/order"
+
+        test_db = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False).name
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = test_db
+        if connection.vendor == "sqlite":
+            # Concurrent WSGI threads would otherwise fail upgrading read
+            # transactions to writes ("database is locked").
+            connection.settings_dict.setdefault("OPTIONS", {})["transaction_mode"] = "IMMEDIATE"
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        limit = options["charge_concurrency"]
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                SALLA_WEBHOOK_MODE="inline",
+                CHARGE_MAX_CONCURRENCY=limit,
+                CHARGE_PROVIDER_CONCURRENCY={"funnerlife": limit},
+                # Measure the views, not the Salla rate limit.
+                RATE_LIMITS={"salla": {"capacity": 10 ** 9, "per_second": 10 ** 9}},
+            ):
+                self.seed()
+                bodies = self.webhook_bodies(options)
+                started = time.perf_counter()
+                with ThreadPeak() as threads:
+                    if options["mode"] == "wsgi":
+                        latencies, errors = self.run_wsgi(bodies, options["threads"])
+                        width = f"{options['threads']} request threads"
+                    else:
+                        latencies, errors = asyncio.run(self.run_asgi(bodies, options["concurrency"]))
+                        width = f"{options['concurrency']} in flight"
+                elapsed = time.perf_counter() - started
+                upstream = ", ".join(f"{k} {v}" for k, v in sorted(stub.stats().items()))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            stub.stop()
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0
+        self.stdout.write(
+            f"{options['mode'].upper()} ({width}, peak {threads.peak} threads in the process): "
+            f"{len(bodies)} webhooks in {elapsed:.2f}s = {len(bodies) / elapsed:.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000 if latencies else 0:.0f} ms, "
+            f"p95 {p95 * 1000:.0f} ms, errors {errors}; upstream calls: {upstream}"
+        )
+
+    def seed(self):
+        from apps.funnerlife.models import FunnerLifeService
+        from apps.salla.models import IntegrationToken
+
+        IntegrationToken.objects.create(
+            provider="SALLA", access_token="stub-token", refresh_token="stub-refresh",
+            expires_at=timezone.now() + timedelta(days=14),
+        )
+        FunnerLifeService.objects.bulk_create([
+            FunnerLifeService(service_id=sku, name=f"Bench {sku}", category="Free Fire", price=10, status="Aktif")
+            for sku in SKUS
+        ])
+
+    def webhook_bodies(self, options):
+        """Paid orders without items in the body: one orders/items fetch + one charge per item."""
+        rng = random.Random(options["seed"])
+        bodies = []
+        for order_id in range(1, options["requests"] + 1):
+            order = sample_order(order_id=order_id, items=0, status="paid", rng=rng)
+            order.pop("items")
+            bodies.append(json.dumps(sample_webhook(event="order.created", order=order)).encode())
+        return bodies
+
+    def headers(self, body):
+        secret = os.getenv("SALLA_WEBHOOK_SECRET")
+        if not secret:
+            return {}
+        return {"x-salla-signature": hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()}
+
+    def run_wsgi(self, bodies, threads):
+        local = threading.local()
+
+        def send(body):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.post(
+                "/api/salla/webhook/", body, content_type="application/json", headers=self.headers(body)
+            )
+            connection.close()
+            return time.perf_counter() - started, response.status_code != 200
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(send, bodies))
+        return [r[0] for r in results], sum(r[1] for r in results)
+
+    async def run_asgi(self, bodies, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def send(body):
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/api/salla/webhook/", body, content_type="application/json", headers=self.headers(body)
+                )
+                return time.perf_counter() - started, response.status_code != 200
+
+        results = await asyncio.gather(*(send(body) for body in bodies))
+        await get_async_transport().aclose()
+        return [r[0] for r in results], sum(r[1] for r in results)
@@ -0,0 +1,89 @@
+import json
+import random
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from apps.core.fields import dumps, zstandard
+from apps.salla.synthetic import sample_order, sample_webhook
+
+
+class Command(BaseCommand):
+    help = "Compare stored size and encode/decode cost of payload codecs on Salla-shaped JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=1000, help="Payloads per codec.")
+        parser.add_argument("--items", type=int, default=3, help="Line items per synthetic order.")
+        parser.add_argument("--from-db", action="store_true",
+                            help="Use stored WebhookEvent/SallaOrder payloads instead of synthetic ones.")
+        parser.add_argument("--dict-size", type=int, default=16 * 1024, help="zstd dictionary size in bytes.")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        payloads = self.load_payloads(options)
+        if len(payloads) < 20:
+            self.stderr.write("Need at least 20 payloads.")
+            return
+
+        # Dictionaries are trained on one half and measured on the other.
+        rng = random.Random(options["seed"])
+        rng.shuffle(payloads)
+        half = len(payloads) // 2
+        training, samples = payloads[:half], payloads[half:]
+        encoded = [dumps(p) for p in samples]
+
+        codecs = [
+            ("json (uncompressed)", lambda b: b, lambda b: b),
+            ("zlib-1", lambda b: zlib.compress(b, 1), zlib.decompress),
+            ("zlib-6", lambda b: zlib.compress(b, 6), zlib.decompress),
+        ]
+        if zstandard is not None:
+            for level in (3, 9):
+                c, d = zstandard.ZstdCompressor(level=level), zstandard.ZstdDecompressor()
+                codecs.append((f"zstd-{level}", c.compress, d.decompress))
+
+            dictionary = zstandard.train_dictionary(options["dict_size"], [dumps(p) for p in training])
+            for level in (3, 9):
+                c = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+                d = zstandard.ZstdDecompressor(dict_data=dictionary)
+                codecs.append((f"zstd-{level}+dict", c.compress, d.decompress))
+        else:
+            self.stdout.write("zstandard not installed: zstd codecs skipped.")
+
+        raw_total = sum(len(b) for b in encoded)
+        self.stdout.write(
+            f"{len(samples)} payloads, avg {raw_total / len(samples):.0f} bytes of JSON\n"
+        )
+        self.stdout.write(f"{'codec':<22}{'avg bytes':>10}{'ratio':>8}{'write us':>10}{'read us':>10}")
+
+        for name, compress, decompress in codecs:
+            t = time.perf_counter()
+            blobs = [compress(dumps(p)) for p in samples]
+            write_us = (time.perf_counter() - t) / len(samples) * 1e6
+
+            t = time.perf_counter()
+            for blob in blobs:
+                json.loads(decompress(blob))
+            read_us = (time.perf_counter() - t) / len(samples) * 1e6
+
+            size = sum(len(b) for b in blobs)
+            self.stdout.write(
+                f"{name:<22}{size / len(blobs):>10.0f}{raw_total / size:>8.2f}{write_us:>10.1f}{read_us:>10.1f}"
+            )
+
+    def load_payloads(self, options):
+        if options["from_db"]:
+            from apps.salla.models import WebhookEvent, SallaOrder
+
+            payloads = [e.payload for e in WebhookEvent.objects.order_by("-id")[:options["samples"]]]
+            payloads += [o.full_payload for o in SallaOrder.objects.order_by("-id")[:options["samples"]]]
+            return payloads
+
+        rng = random.Random(options["seed"])
+        payloads = []
+        for i in range(options["samples"]):
+            order = sample_order(items=rng.randint(1, options["items"]), rng=rng)
+            # Half raw webhooks, half stored order snapshots, like the two tables.
+            payloads.append(sample_webhook(order=order) if i % 2 else order)
+        return payloads
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from apps.core.loadtest import WebhookGenerator, build_report, regressions, webhook_bodies
+from apps.core.stubs import StubConfig, StubProcess
+
+SKUS = ["1001", "1002", "1003", "1004", "1005"]
+SECRET = "loadtest-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end load test on this machine: starts stub Salla/FunnerLife servers, "
+        "the app server (and queue worker) on a throwaway database, sends signed order "
+        "webhooks at a fixed rate and reports latency percentiles, throughput, charges "
+        "per second and DB growth. Needs no network access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rate", type=float, default=20, help="Webhooks per second.")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds of sending.")
+        parser.add_argument("--requests", type=int,
+                            help="Webhooks to send (default: --rate x --duration).")
+        parser.add_argument("--concurrency", type=int, default=64, help="Max webhooks in flight.")
+        parser.add_argument("--items", type=int, default=2, help="Chargeable items per order.")
+        parser.add_argument("--payload-items", type=float, default=0.8,
+                            help="Share of webhooks that carry their items (the rest fetch orders/items).")
+        parser.add_argument("--update-ratio", type=float, default=0.2,
+                            help="Share of webhooks that are order.updated for an order already sent.")
+        parser.add_argument("--latency-ms", type=float, default=100, help="Stub latency per upstream call.")
+        parser.add_argument("--jitter-ms", type=float, default=50, help="Extra random stub latency, up to.")
+        parser.add_argument("--salla-error-rate", type=float, default=0.0,
+                            help="Share of Salla stub calls answered with --error-status.")
+        parser.add_argument("--funnerlife-error-rate", type=float, default=0.0,
+                            help="Share of FunnerLife stub calls answered with --error-status.")
+        parser.add_argument("--error-status", type=int, default=503)
+        parser.add_argument("--webhook-mode", choices=["inline", "queue"], default="inline",
+                            help="SALLA_WEBHOOK_MODE of the server; queue also starts process_webhooks.")
+        parser.add_argument("--workers", type=int, default=8, help="process_webhooks --workers (queue mode).")
+        parser.add_argument("--server-cmd",
+                            default=f"{shlex.quote(sys.executable)} manage.py runserver 127.0.0.1:{{port}} --noreload",
+                            help="Command that serves the app on {port}, e.g. "
+                                 "'gunicorn config.wsgi -w 4 --threads 8 -b 127.0.0.1:{port}'.")
+        parser.add_argument("--drain-timeout", type=float, default=300,
+                            help="Seconds to wait for the queue to empty after sending (queue mode).")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--save", help="Write the report as JSON to this file.")
+        parser.add_argument("--baseline", help="Fail if worse than this saved report by more than --tolerance.")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs --baseline (0.2 = 20%%).")
+        parser.add_argument("--keep", action="store_true", help="Keep the database and server logs afterwards.")
+
+    def handle(self, *args, **options):
+        logging.getLogger("apps").setLevel(logging.WARNING)  # keep the report readable
+        workdir = Path(tempfile.mkdtemp(prefix="loadtest-"))
+        db_path = workdir / "db.sqlite3"
+        stub_config = StubConfig(
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            items_per_order=options["items"],
+            skus=SKUS,
+            error_rates={"salla": options["salla_error_rate"], "funnerlife": options["funnerlife_error_rate"]},
+            error_status=options["error_status"],
+        )
+        stub = StubProcess(stub_config)
+        port = free_port()
+        env = dict(
+            os.environ,
+            SQLITE_PATH=str(db_path),
+            SQLITE_TRANSACTION_MODE="IMMEDIATE",
+            SALLA_API_BASE=f"{stub.url}/admin/v2/",
+            SALLA_TOKEN_URL=f"{stub.url}/oauth2/token",
+            FUNNERLIFE_API_BASE=f"{stub.url}/",
+            FUNNERLIFE_ORDER_URL=f"{stub.url}/order",
+            FUNNERLIFE_CALLBACK_URL=f"http://127.0.0.1:{port}/api/funnerlife/callback/",
+            SALLA_WEBHOOK_SECRET=SECRET,
+            SALLA_WEBHOOK_MODE=options["webhook_mode"],
+            # The stubs don't rate-limit; the shared bucket would only measure itself.
+            SALLA_RATE_LIMIT_BURST="1000000",
+            SALLA_RATE_LIMIT_PER_SECOND="1000000",
+            ALLOWED_HOSTS="127.0.0.1,localhost",
+            DJANGO_DEBUG="False",
+            LOG_LEVEL="WARNING",
+        )
+        processes = []
+        try:
+            self.prepare_database(db_path, stub.url)
+            db_before = self.db_size(db_path)
+
+            processes.append(self.start(options["server_cmd"].format(port=port), env, workdir / "server.log"))
+            self.wait_for_port(port, processes[0])
+            if options["webhook_mode"] == "queue":
+                processes.append(self.start(
+                    f"{shlex.quote(sys.executable)} manage.py process_webhooks --workers {options['workers']} "
+                    f"--poll-interval 0.2 --coalesce-window 0",
+                    env, workdir / "worker.log",
+                ))
+
+            count = options["requests"] or max(int(options["rate"] * options["duration"]), 1)
+            bodies = webhook_bodies(
+                count, stub_config.items, options["payload_items"], options["update_ratio"], options["seed"],
+            )
+            self.stdout.write(
+                f"Sending {count} webhooks at {options['rate']:g}/s to 127.0.0.1:{port} "
+                f"({options['webhook_mode']} mode)..."
+            )
+            generator = WebhookGenerator(
+                f"http://127.0.0.1:{port}/api/salla/webhook/", SECRET, options["rate"], options["concurrency"],
+            )
+            started = time.perf_counter()
+            latencies, statuses, send_elapsed = generator.run(bodies)
+            if options["webhook_mode"] == "queue":
+                self.wait_for_queue(options["drain_timeout"])
+            processing_elapsed = time.perf_counter() - started
+
+            report = build_report(
+                latencies, statuses, send_elapsed, processing_elapsed,
+                events=self.event_counts(),
+                charges=self.charge_count(),
+                upstream=stub.stats(),
+                db_growth=self.db_size(db_path) - db_before,
+            )
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+            stub.stop()
+            connection.close()
+            if options["keep"]:
+                self.stdout.write(f"Database and logs kept in {workdir}")
+            else:
+                for path in workdir.iterdir():
+                    path.unlink()
+                workdir.rmdir()
+
+        self.print_report(report)
+        if options["save"]:
+            Path(options["save"]).write_text(json.dumps(report, indent=2))
+        if options["baseline"]:
+            found = regressions(report, json.loads(Path(options["baseline"]).read_text()), options["tolerance"])
+            if found:
+                raise CommandError("Regressions vs baseline:\n  " + "\n  ".join(found))
+            self.stdout.write(f"Within {options['tolerance']:.0%} of {options['baseline']}.")
+
+    def prepare_database(self, db_path, stub_url):
+        """Migrate the throwaway DB and seed a Salla token and the FunnerLife catalog (via the stub)."""
+        from apps.funnerlife.client import FunnerLifeAPIClient
+        from apps.funnerlife.services import refresh_services
+        from apps.salla.models import IntegrationToken
+
+        # This process reads the same file afterwards for the report.
+        connection.close()
+        connection.settings_dict["NAME"] = str(db_path)
+        call_command("migrate", verbosity=0)
+
+        IntegrationToken.objects.create(
+            provider="SALLA", access_token="stub-token", refresh_token="stub-refresh",
+            expires_at=timezone.now() + timedelta(days=14),
+        )
+        FunnerLifeAPIClient.BASE_URL = f"{stub_url}/"
+        if refresh_services() is None:
+            raise CommandError("Could not load the FunnerLife catalog from the stub.")
+        connection.close()
+
+    def start(self, command, env, log_path):
+        log = open(log_path, "w")
+        return subprocess.Popen(
+            shlex.split(command), env=env, cwd=settings.BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_for_port(self, port, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("The app server exited during startup (see --keep for its log).")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"The app server did not listen on port {port} within {timeout}s.")
+
+    def wait_for_queue(self, timeout):
+        from apps.salla.models import WebhookEvent
+
+        deadline = time.monotonic() + timeout
+        while WebhookEvent.objects.filter(status=WebhookEvent.Status.RECEIVED).exists():
+            if time.monotonic() >= deadline:
+                self.stderr.write(f"Queue not drained after {timeout:g}s; reporting what was processed.")
+                return
+            time.sleep(0.2)
+
+    def event_counts(self):
+        from django.db.models import Count
+        from apps.salla.models import WebhookEvent
+
+        rows = WebhookEvent.objects.values("status").annotate(n=Count("id"))
+        return {row["status"]: row["n"] for row in rows}
+
+    def charge_count(self):
+        from apps.funnerlife.models import FunnerlifeTransaction
+
+        return FunnerlifeTransaction.objects.count()
+
+    def db_size(self, db_path):
+        return sum(
+            os.path.getsize(path) for path in [db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-journal")]
+            if os.path.exists(path)
+        )
+
+    def print_report(self, report):
+        latency = report["latency_ms"]
+        errors = ", ".join(f"{status}: {n}" for status, n in sorted(report["errors"].items())) or "none"
+        upstream = ", ".join(f"{k} {v}" for k, v in sorted(report["upstream_calls"].items()))
+        events = ", ".join(f"{k} {v}" for k, v in sorted(report["events"].items()))
+        self.stdout.write(
+            f"Webhooks:   {report['ok']}/{report['webhooks']} ok at {report['throughput']} req/s (errors: {errors})\n"
+            f"Latency:    p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+            f"max {latency['max']} ms\n"
+            f"Events:     {events}\n"
+            f"Charges:    {report['charges']} in {report['processing_seconds']}s = "
+            f"{report['charges_per_second']}/s\n"
+            f"Upstream:   {upstream}\n"
+            f"DB growth:  {report['db_growth_bytes'] / 1024:.0f} KiB "
+            f"({report['db_bytes_per_webhook']} bytes per webhook)"
+        )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core.fields import dumps, zstandard
+
+
+class Command(BaseCommand):
+    help = (
+        "Train a zstd dictionary on stored Salla payloads. Point "
+        "COMPRESSED_JSON_ZSTD_DICT at the output file to use it for new rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the dictionary file to write.")
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Dictionary size in bytes.")
+        parser.add_argument("--samples", type=int, default=5000, help="Max payloads read per table.")
+
+    def handle(self, *args, **options):
+        if zstandard is None:
+            raise CommandError("The 'zstandard' package is required to train a dictionary.")
+
+        from apps.salla.models import WebhookEvent, SallaOrder
+
+        samples = [dumps(e.payload) for e in WebhookEvent.objects.order_by("-id")[:options["samples"]]]
+        samples += [dumps(o.full_payload) for o in SallaOrder.objects.order_by("-id")[:options["samples"]]]
+        if len(samples) < 100:
+            raise CommandError(f"Only {len(samples)} payloads stored; need at least 100 to train.")
+
+        dictionary = zstandard.train_dictionary(options["size"], samples)
+        with open(options["output"], "wb") as f:
+            f.write(dictionary.as_bytes())
+
+        self.stdout.write(
+            f"Wrote dictionary {dictionary.dict_id()} ({len(dictionary.as_bytes())} bytes) "
+            f"trained on {len(samples)} payloads to {options['output']}. Keep every dictionary "
+            f"that has been used: rows compressed with it need it to be read."
+        )
@@ -0,0 +1,392 @@
+"""
+Counters, gauges and histograms for the integration pipeline, rendered in the
+Prometheus text format at ``/metrics``.
+
+Counters and histograms live in the memory of the process that records them:
+each web worker reports its own (Prometheus sums them per job), and the
+``process_webhooks`` worker serves its own with ``--metrics-port``. Gauges
+for shared state (queue depth, token age, rate-limit buckets) are read from
+the DB when scraped, so every process reports the same value.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cached DB hit up to a Salla call that used its whole retry budget.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the ``with`` block; ``labels`` may be updated inside it."""
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float("inf")], counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def collector(fn):
+    """Register ``fn`` to refresh gauges right before each scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    for fn in _collectors:
+        try:
+            fn()
+        except Exception as e:
+            SCRAPE_ERRORS.inc(collector=fn.__name__)
+            logger.warning("Metrics collector %s failed: %s", fn.__name__, e)
+
+    lines = []
+    for metric in _registry:
+        lines += metric.header()
+        lines += metric.samples()
+    return "\n".join(lines) + "\n"
+
+
+# === REQUESTS ===
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time to answer an HTTP request, by view.", ["view", "method", "status"],
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in DB queries per HTTP request, by view.", ["view"],
+)
+HTTP_REQUEST_DB_QUERIES = Counter(
+    "http_request_db_queries_total", "DB queries run by HTTP requests, by view.", ["view"],
+)
+
+# === SALLA WEBHOOKS ===
+WEBHOOK_EVENTS = Counter(
+    "salla_webhook_events_total", "Salla webhooks accepted (signature checked), by event type.", ["event_type"],
+)
+WEBHOOK_DUPLICATES = Counter(
+    "salla_webhook_duplicates_total",
+    "Redelivered Salla webhooks answered without processing, by where they were caught (memory, db, archive).",
+    ["stage"],
+)
+WEBHOOK_PROCESSING_SECONDS = Histogram(
+    "salla_webhook_processing_seconds",
+    "Time to run a webhook (or coalesced burst) through the pipeline, inline or in the worker.",
+    ["fetch_path", "outcome"],
+)
+WEBHOOK_DELAY_SECONDS = Histogram(
+    "salla_webhook_delay_seconds", "Time from a webhook's arrival until it was processed.", ["outcome"],
+)
+
+# === OUTBOUND CALLS ===
+OUTBOUND_SECONDS = Histogram(
+    "integration_outbound_seconds",
+    "Outbound Salla/FunnerLife calls including retries, backoff and rate-limit waits, by endpoint.",
+    ["endpoint", "outcome"],
+)
+OUTBOUND_ATTEMPTS = Counter(
+    "integration_outbound_attempts_total", "HTTP attempts made by outbound calls, by endpoint.", ["endpoint"],
+)
+HTTP_CONNECTIONS = Gauge(
+    "integration_http_connections", "Connections opened by this process's outbound pool, by host.", ["host"],
+)
+HTTP_CONNECTION_REUSE = Gauge(
+    "integration_http_reused_requests", "Outbound requests served on an already-open connection, by host.",
+    ["host"],
+)
+CIRCUIT_OPEN = Gauge(
+    "integration_circuit_open", "1 while this process's circuit breaker for the host is open or half open.",
+    ["host"],
+)
+RATE_LIMIT_TOKENS = Gauge(
+    "integration_rate_limit_tokens", "Tokens left in a shared rate-limit bucket (as last written).", ["bucket"],
+)
+
+# === FUNNERLIFE ===
+CHARGES = Counter(
+    "funnerlife_charges_total",
+    "FunnerLife charge calls, by result: accepted, rejected (answered with status false "
+    "or an HTTP error), error (no answer) or not_sent (circuit open, rate limited or "
+    "connection refused; retried with the event).",
+    ["result"],
+)
+CALLBACKS = Counter(
+    "funnerlife_callbacks_total", "FunnerLife callbacks received, by result.", ["result"],
+)
+
+# === SHARED STATE ===
+WEBHOOK_QUEUE_DEPTH = Gauge(
+    "salla_webhook_queue_depth", "Webhook events waiting for the worker (status RECEIVED).",
+)
+WEBHOOK_QUEUE_OLDEST_SECONDS = Gauge(
+    "salla_webhook_queue_oldest_seconds", "Age of the oldest webhook event waiting for the worker.",
+)
+PENDING_CHARGES = Gauge(
+    "funnerlife_pending_transactions", "FunnerLife transactions still waiting for their final callback.",
+)
+PENDING_CHARGES_OLDEST_SECONDS = Gauge(
+    "funnerlife_pending_oldest_seconds", "Age of the oldest FunnerLife transaction still PENDING.",
+)
+TOKEN_AGE_SECONDS = Gauge(
+    "salla_token_age_seconds", "Seconds since the Salla access token was last saved.",
+)
+TOKEN_EXPIRES_IN_SECONDS = Gauge(
+    "salla_token_expires_in_seconds", "Seconds until the Salla access token expires (negative once expired).",
+)
+LOG_RECORDS_DROPPED = Gauge(
+    "log_records_dropped", "Log records dropped by this process because the log buffer was full.",
+)
+SCRAPE_ERRORS = Counter(
+    "metrics_collector_errors_total", "Collectors that failed while rendering /metrics.", ["collector"],
+)
+
+
+# === SCRAPE-TIME COLLECTORS ===
+@collector
+def collect_outbound():
+    from .http import get_transport
+    from .resilience import breaker_states
+
+    for host, stats in get_transport().stats().items():
+        HTTP_CONNECTIONS.set(stats["connections"], host=host)
+        HTTP_CONNECTION_REUSE.set(stats["reused"], host=host)
+    for breaker in breaker_states():
+        CIRCUIT_OPEN.set(int(breaker["state"] != "closed"), host=breaker["host"])
+
+
+@collector
+def collect_rate_limits():
+    from .models import RateLimitBucket
+
+    for name, tokens in RateLimitBucket.objects.values_list("name", "tokens"):
+        RATE_LIMIT_TOKENS.set(round(tokens, 3), bucket=name)
+
+
+@collector
+def collect_webhook_queue():
+    from django.db.models import Count, Min
+    from apps.salla.models import WebhookEvent
+
+    queue = WebhookEvent.objects.filter(status=WebhookEvent.Status.RECEIVED).aggregate(
+        depth=Count("id"), oldest=Min("received_at"),
+    )
+    WEBHOOK_QUEUE_DEPTH.set(queue["depth"])
+    oldest = queue["oldest"]
+    WEBHOOK_QUEUE_OLDEST_SECONDS.set(round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0)
+
+
+@collector
+def collect_pending_charges():
+    from django.db.models import Count, Min
+    from apps.funnerlife.models import FunnerlifeTransaction
+
+    # A range of the (status, created_at) index.
+    pending = FunnerlifeTransaction.objects.filter(status=FunnerlifeTransaction.Status.PENDING).aggregate(
+        count=Count("id"), oldest=Min("created_at"),
+    )
+    PENDING_CHARGES.set(pending["count"])
+    oldest = pending["oldest"]
+    PENDING_CHARGES_OLDEST_SECONDS.set(round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0)
+
+
+@collector
+def collect_token():
+    from apps.salla.models import IntegrationToken
+
+    token = IntegrationToken.objects.filter(provider="SALLA").values("updated_at", "expires_at").first()
+    if token is None:
+        return
+    now = timezone.now()
+    TOKEN_AGE_SECONDS.set(round((now - token["updated_at"]).total_seconds(), 3))
+    if token["expires_at"]:
+        TOKEN_EXPIRES_IN_SECONDS.set(round((token["expires_at"] - now).total_seconds(), 3))
+
+
+@collector
+def collect_logging():
+    from .logs import BufferedJSONHandler
+
+    handlers = [h for h in logging.getLogger().handlers if isinstance(h, BufferedJSONHandler)]
+    LOG_RECORDS_DROPPED.set(sum(h.dropped for h in handlers))
+
+
+# === DB TIME PER REQUEST ===
+def time_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every DB connection (see CoreConfig.ready);
+    adds each query's time to the request's timer, if one is running.
+    """
+    timer = _db_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.add(time.perf_counter() - started)
+
+
+class QueryTimer:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        # sync_to_async threads and the Salla fetch pool share the request's timer.
+        with self._lock:
+            self.seconds += seconds
+            self.queries += 1
+
+
+_db_timer = contextvars.ContextVar("db_timer", default=None)
+
+
+@contextmanager
+def timing_queries():
+    """Collect the time of every query run in this context (and threads that copy it)."""
+    timer = QueryTimer()
+    token = _db_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _db_timer.reset(token)
+
+
+# === STANDALONE ENDPOINT (for processes without a web server) ===
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = render().encode()
+        finally:
+            connection.close()  # collectors ran on this handler thread
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port, host=""):
+    """Serve GET /metrics on ``port`` from a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,89 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .logs import get_correlation_id, new_correlation_id, reset_correlation_id, set_correlation_id
+from .metrics import HTTP_REQUEST_DB_QUERIES, HTTP_REQUEST_DB_SECONDS, HTTP_REQUEST_SECONDS, timing_queries
+
+
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+class MetricsMiddleware:
+    """Request latency and DB time per request, labelled by URL route (see apps/core/metrics.py)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with timing_queries() as queries:
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with timing_queries() as queries:
+            response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def observe(self, request, response, seconds, queries):
+        match = getattr(request, "resolver_match", None)
+        # The route pattern, not the path: one series per endpoint, not per order id.
+        view = f"/{match.route}" if match else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(seconds, view=view, method=request.method if request.method in METHODS else "other", status=response.status_code)
+        HTTP_REQUEST_DB_SECONDS.observe(queries.seconds, view=view)
+        HTTP_REQUEST_DB_QUERIES.inc(queries.queries, view=view)
+
+
+class CorrelationMiddleware:
+    """
+    Run each request under a correlation ID (see apps/core/logs.py): the
+    caller's X-Correlation-ID if it sent one, else a new ID. The ID in effect
+    when the view returns (a callback adopts its transaction's) is sent back
+    in the same header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = set_correlation_id(self.incoming(request))
+        try:
+            response = self.get_response(request)
+            response["X-Correlation-ID"] = get_correlation_id()
+        finally:
+            reset_correlation_id(token)
+        return response
+
+    async def __acall__(self, request):
+        token = set_correlation_id(self.incoming(request))
+        try:
+            response = await self.get_response(request)
+            response["X-Correlation-ID"] = get_correlation_id()
+        finally:
+            reset_correlation_id(token)
+        return response
+
+    def incoming(self, request):
+        given = request.headers.get("X-Correlation-ID", "")
+        # Only IDs that are safe to put in logs and a DB column.
+        if 0 < len(given) <= 64 and given.replace("-", "").isalnum():
+            return given
+        return new_correlation_id()
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('capacity', models.FloatField()),
+                ('refill_rate', models.FloatField()),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField()),
+                ('blocked_until', models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -1,3 +1,17 @@
 from django.db import models
 
-# Create your models here.
+
+class RateLimitBucket(models.Model):
+    """
+    Token bucket for one upstream API, shared by every process through the
+    DB (see apps/core/ratelimit.py). Times are unix seconds.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    capacity = models.FloatField()
+    refill_rate = models.FloatField()  # tokens per second
+    tokens = models.FloatField()
+    updated_at = models.FloatField()  # when `tokens` was last refilled
+    blocked_until = models.FloatField(default=0)  # from a 429 / Remaining: 0
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f}/{self.capacity:.0f}"
@@ -0,0 +1,59 @@
+"""
+Keyset (cursor) pagination over a ``(timestamp, id)`` ordering.
+
+Pages are fetched with ``WHERE (ts, id) < (last_ts, last_id)`` instead of
+OFFSET, so every page costs the same index range scan however deep it is.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(ts, pk):
+    raw = json.dumps([ts.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return ``(datetime, id)``; raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, pk = json.loads(raw)
+        return datetime.fromisoformat(ts), int(pk)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def page_size(params):
+    try:
+        size = int(params.get("limit", DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(queryset, ts_field, cursor=None, size=DEFAULT_PAGE_SIZE):
+    """
+    Return ``(rows, next_cursor)`` for one newest-first page.
+
+    ``queryset`` should be a ``.values(...)`` queryset that includes
+    ``ts_field`` and ``id``; ``next_cursor`` is None on the last page.
+    """
+    if cursor:
+        ts, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f"{ts_field}__lt": ts}) | Q(**{ts_field: ts, "id__lt": pk}))
+
+    rows = list(queryset.order_by(f"-{ts_field}", "-id")[:size + 1])
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[ts_field], last["id"])
+
+    return rows, next_cursor
@@ -0,0 +1,228 @@
+"""
+Client-side rate limiting for upstream APIs.
+
+Each upstream has a token bucket row (RateLimitBucket) shared by all web
+and worker processes. Taking tokens is a single conditional UPDATE
+(refill + check + take), so concurrent callers can't overdraw it. When no
+token is available the caller waits instead of failing.
+
+A process leases RATE_LIMIT_LEASE_SIZE tokens per UPDATE and hands them out
+from memory, so busy callers write the shared row once per lease instead of
+once per call. Tokens still unused after RATE_LIMIT_LEASE_SECONDS are
+credited back to the bucket by the next UPDATE.
+
+Upstream rate-limit headers (X-RateLimit-Remaining / X-RateLimit-Reset,
+Retry-After) are folded back into the bucket, so the limiter follows the
+upstream's own accounting.
+
+Priority comes from a context variable: BACKGROUND callers (retries,
+replays, reconciliation) can't take the last RATE_LIMIT_LIVE_RESERVE of the
+bucket and give up later, so LIVE webhooks get served first.
+"""
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest, Least
+
+from .models import RateLimitBucket
+from .resilience import UpstreamError
+
+LIVE = "live"
+BACKGROUND = "background"
+
+_priority = contextvars.ContextVar("rate_limit_priority", default=LIVE)
+_known_buckets = set()
+
+# (bucket, priority) -> [tokens, taken_at]: tokens this process already took.
+# Per priority, so background calls never use tokens taken from the live reserve.
+_leases = {}
+_leases_lock = threading.Lock()
+
+
+class RateLimitError(UpstreamError):
+    """No token became available within the caller's max wait."""
+
+    outcome = "rate_limited"
+    sent = False
+
+
+@contextmanager
+def rate_priority(priority):
+    """Run the block's upstream calls at ``priority`` (LIVE or BACKGROUND)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def _ensure_bucket(name):
+    if name in _known_buckets:
+        return
+    config = settings.RATE_LIMITS[name]
+    RateLimitBucket.objects.get_or_create(
+        name=name,
+        defaults={
+            "capacity": config["capacity"],
+            "refill_rate": config["per_second"],
+            "tokens": config["capacity"],
+            "updated_at": time.time(),
+        },
+    )
+    _known_buckets.add(name)
+
+
+def _available(now, returned=0):
+    return Least(
+        F("capacity"),
+        F("tokens") + (Value(now) - F("updated_at")) * F("refill_rate") + Value(float(returned)),
+        output_field=FloatField(),
+    )
+
+
+def _take(name, count, reserve, now, returned):
+    """Take ``count`` tokens (giving back ``returned``) in one conditional UPDATE; True if taken."""
+    return bool(
+        RateLimitBucket.objects
+        .alias(available=_available(now, returned))
+        .filter(name=name, blocked_until__lte=now, available__gte=Value(float(count)) + F("capacity") * reserve)
+        .update(tokens=_available(now, returned) - count, updated_at=now)
+    )
+
+
+def _refill_lease(name, priority, tokens, now):
+    with _leases_lock:
+        lease = _leases.setdefault((name, priority), [0, now])
+        lease[0] += tokens
+        lease[1] = now
+
+
+def drop_leases(name):
+    """Forget this process's leased tokens for ``name`` (the upstream said stop)."""
+    with _leases_lock:
+        for key in [key for key in _leases if key[0] == name]:
+            del _leases[key]
+
+
+def try_acquire(name, priority=None):
+    """
+    Take one token if the bucket has one for ``priority``; returns 0 on
+    success, else the seconds to wait before trying again.
+    """
+    priority = priority or current_priority()
+    now = time.time()
+
+    with _leases_lock:
+        lease = _leases.setdefault((name, priority), [0, now])
+        if lease[0] >= 1 and now - lease[1] < settings.RATE_LIMIT_LEASE_SECONDS:
+            lease[0] -= 1
+            return 0
+        # Leftovers of an old lease go back to the bucket with the next take.
+        returned, lease[0] = lease[0], 0
+
+    _ensure_bucket(name)
+    # Background calls must leave the live reserve in the bucket.
+    reserve = settings.RATE_LIMIT_LIVE_RESERVE if priority == BACKGROUND else 0
+    size = settings.RATE_LIMIT_LEASE_SIZE
+    for count in ([size, 1] if size > 1 else [1]):
+        if _take(name, count, reserve, now, returned):
+            _refill_lease(name, priority, count - 1, now)
+            return 0
+    if returned:
+        # Nothing to take, so nothing was given back: the old lease is still ours.
+        _refill_lease(name, priority, returned - 1, now)
+        return 0
+
+    bucket = RateLimitBucket.objects.filter(name=name).first()
+    if bucket is None:
+        # Row deleted since this process created it (admin, DB reset): recreate.
+        _known_buckets.discard(name)
+        return try_acquire(name, priority)
+    available = min(bucket.capacity, bucket.tokens + (now - bucket.updated_at) * bucket.refill_rate)
+    needed = 1 + bucket.capacity * reserve - available
+    return max(bucket.blocked_until - now, needed / bucket.refill_rate, 0.01)
+
+
+def _max_wait(priority):
+    return settings.RATE_LIMIT_MAX_WAIT[priority]
+
+
+def acquire(name, priority=None):
+    """Block until a token is taken; RateLimitError after the priority's max wait."""
+    priority = priority or current_priority()
+    deadline = time.monotonic() + _max_wait(priority)
+    while True:
+        wait = try_acquire(name, priority)
+        if not wait:
+            return
+        wait *= random.uniform(1, 1.2)  # don't wake every waiter at once
+        if time.monotonic() + wait > deadline:
+            raise RateLimitError(f"{name}: no rate-limit token within {_max_wait(priority)}s ({priority})", name)
+        time.sleep(wait)
+
+
+async def aacquire(name, priority=None):
+    """acquire() for async callers."""
+    priority = priority or current_priority()
+    deadline = time.monotonic() + _max_wait(priority)
+    while True:
+        wait = await sync_to_async(try_acquire)(name, priority)
+        if not wait:
+            return
+        wait *= random.uniform(1, 1.2)
+        if time.monotonic() + wait > deadline:
+            raise RateLimitError(f"{name}: no rate-limit token within {_max_wait(priority)}s ({priority})", name)
+        await asyncio.sleep(wait)
+
+
+def _header(headers, key):
+    try:
+        return float(headers.get(key))
+    except (TypeError, ValueError):
+        return None
+
+
+def observe(name, response):
+    """Fold the upstream's rate-limit headers from ``response`` into the bucket."""
+    headers = getattr(response, "headers", None) or {}
+    remaining = _header(headers, "X-RateLimit-Remaining")
+    reset = _header(headers, "X-RateLimit-Reset")
+    retry_after = _header(headers, "Retry-After")
+    now = time.time()
+
+    updates = {}
+    if remaining is not None:
+        updates["tokens"] = Least(F("tokens"), Value(remaining), output_field=FloatField())
+
+    blocked_until = None
+    if response.status_code == 429 or remaining == 0:
+        if retry_after is not None:
+            blocked_until = now + retry_after
+        elif reset is not None:
+            # Unix time of the window reset, or seconds until it.
+            blocked_until = reset if reset > 10 ** 9 else now + reset
+        else:
+            blocked_until = now + 1
+    if blocked_until is not None:
+        updates["blocked_until"] = Greatest(F("blocked_until"), Value(blocked_until), output_field=FloatField())
+
+    if updates:
+        _ensure_bucket(name)
+        RateLimitBucket.objects.filter(name=name).update(**updates)
+    if blocked_until is not None:
+        drop_leases(name)
+
+
+async def aobserve(name, response):
+    await sync_to_async(observe)(name, response)
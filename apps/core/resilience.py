@@ -0,0 +1,295 @@
+"""
+Retries and circuit breakers for outbound Salla / FunnerLife calls.
+
+Every call names an endpoint ("salla.order", "funnerlife.charge", ...) whose
+retry budget (attempts + total seconds) comes from RETRY_POLICIES. Failed
+attempts back off exponentially with full jitter, so callers that failed
+together don't retry together.
+
+Each upstream host has a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD
+consecutive failures it opens and calls fail immediately with
+CircuitOpenError for CIRCUIT_RESET_TIMEOUT seconds; then a single probe is
+let through and its outcome closes or re-opens the circuit.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .http import never_sent
+from .metrics import OUTBOUND_ATTEMPTS, OUTBOUND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 429 means the upstream is alive but throttling: retried, but for the
+# breaker it counts as the host answering.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """An outbound call failed after its retries (or was not attempted)."""
+
+    outcome = "error"  # metrics label
+    # False when no attempt can have reached the upstream (circuit open, rate
+    # limited, connection refused): a non-idempotent call is safe to repeat.
+    sent = True
+
+    def __init__(self, message, endpoint=None, status_code=None):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.status_code = status_code
+
+
+class CircuitOpenError(UpstreamError):
+    """The upstream's circuit is open; the call was not attempted."""
+
+    outcome = "circuit_open"
+    sent = False
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, host, failure_threshold=None, reset_timeout=None):
+        self.host = host
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.CIRCUIT_RESET_TIMEOUT
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self, endpoint=None):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True  # exactly one probe
+                return
+            raise CircuitOpenError(f"{self.host} circuit is open", endpoint=endpoint)
+
+    def release(self):
+        """The call was let through but never sent (e.g. rate limited): free the probe slot."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit for %s closed", self.host, extra={"host": self.host})
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "Circuit for %s opened after %s consecutive failures", self.host, self.failures,
+                        extra={"host": self.host, "reset_timeout": self.reset_timeout},
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(self.reset_timeout - (time.monotonic() - self.opened_at), 0), 1)
+            return {
+                "host": self.host,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": retry_in,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host):
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in sorted(breakers, key=lambda b: b.host)]
+
+
+def _policy(endpoint):
+    policy = settings.RETRY_POLICIES.get(endpoint, {})
+    return policy.get("attempts", 1), policy.get("budget", settings.HTTP_READ_TIMEOUT)
+
+
+def backoff_delay(attempt):
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(settings.RETRY_BACKOFF_MAX, settings.RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+def _check(response, endpoint):
+    """Return an UpstreamError for a retryable response, else None."""
+    if response.status_code in RETRY_STATUSES:
+        return UpstreamError(f"{endpoint}: HTTP {response.status_code}", endpoint, response.status_code)
+    return None
+
+
+def _next_delay(attempt, attempts, started, budget):
+    """Seconds to wait before the next attempt, or None when the budget is spent."""
+    if attempt + 1 >= attempts:
+        return None
+    delay = backoff_delay(attempt)
+    if time.monotonic() - started + delay >= budget:
+        return None
+    return delay
+
+
+@contextmanager
+def _timed(endpoint):
+    """Observe the whole call (attempts, backoff, rate-limit waits) in OUTBOUND_SECONDS."""
+    with OUTBOUND_SECONDS.time(endpoint=endpoint, outcome="ok") as labels:
+        try:
+            yield labels
+        except Exception as e:
+            labels["outcome"] = getattr(e, "outcome", "error")
+            raise
+
+
+def _outcome(response):
+    return "ok" if response.status_code < 400 else "client_error"
+
+
+def _log_retry(endpoint, attempt, delay, error):
+    logger.warning(
+        "%s failed, retrying in %.2fs: %s", endpoint, delay, error,
+        extra={"endpoint": endpoint, "attempt": attempt + 1, "status_code": error.status_code},
+    )
+
+
+def call(endpoint, url, send):
+    """
+    Run ``send()`` (one HTTP attempt returning a response) under the
+    endpoint's retry policy and the host's breaker.
+
+    Returns the first response that isn't a 429/5xx; 4xx responses are
+    returned for the caller to handle. Raises UpstreamError (or
+    CircuitOpenError) when no such response was obtained.
+    """
+    with _timed(endpoint) as labels:
+        response = _call(endpoint, url, send)
+        labels["outcome"] = _outcome(response)
+        return response
+
+
+class _Attempts:
+    """
+    The retry and breaker decisions of one call(), shared by the sync and
+    async loops, which only send the attempts and sleep.
+    """
+
+    def __init__(self, endpoint, url):
+        self.endpoint = endpoint
+        self.attempts, self.budget = _policy(endpoint)
+        self.breaker = get_breaker(urlsplit(url).netloc)
+        self.started = time.monotonic()
+        self.attempt = 0
+        self.sent = False  # whether any attempt may have reached the upstream
+
+    def begin(self):
+        """Raise CircuitOpenError unless the next attempt may go out."""
+        try:
+            self.breaker.before_call(self.endpoint)
+        except CircuitOpenError as e:
+            e.sent = self.sent
+            raise
+        OUTBOUND_ATTEMPTS.inc(endpoint=self.endpoint)
+
+    def answered(self, response):
+        """Seconds to wait before retrying ``response``, or None when it is the result."""
+        self.sent = True
+        error = _check(response, self.endpoint)
+        if error is None:
+            self.breaker.record_success()
+            return None
+        return self._retry(error)
+
+    def raised(self, error):
+        """Seconds to wait before retrying after ``send()`` raised ``error``."""
+        if isinstance(error, UpstreamError):
+            # Raised before this attempt was sent (e.g. rate limited).
+            self.breaker.release()
+            error.sent = error.sent or self.sent
+            raise error
+        self.sent = self.sent or not never_sent(error)
+        return self._retry(UpstreamError(f"{self.endpoint}: {type(error).__name__}: {error}", self.endpoint))
+
+    def _retry(self, error):
+        if error.status_code == 429:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        delay = _next_delay(self.attempt, self.attempts, self.started, self.budget)
+        if delay is None:
+            error.sent = self.sent
+            raise error
+        _log_retry(self.endpoint, self.attempt, delay, error)
+        self.attempt += 1
+        return delay
+
+
+def _call(endpoint, url, send):
+    attempts = _Attempts(endpoint, url)
+    while True:
+        attempts.begin()
+        try:
+            response = send()
+        except Exception as e:
+            delay = attempts.raised(e)
+        else:
+            delay = attempts.answered(response)
+            if delay is None:
+                return response
+        time.sleep(delay)
+
+
+async def acall(endpoint, url, send):
+    """call() for coroutine ``send``; backs off with asyncio.sleep."""
+    with _timed(endpoint) as labels:
+        response = await _acall(endpoint, url, send)
+        labels["outcome"] = _outcome(response)
+        return response
+
+
+async def _acall(endpoint, url, send):
+    attempts = _Attempts(endpoint, url)
+    while True:
+        attempts.begin()
+        try:
+            response = await send()
+        except Exception as e:
+            delay = attempts.raised(e)
+        else:
+            delay = attempts.answered(response)
+            if delay is None:
+                return response
+        await asyncio.sleep(delay)
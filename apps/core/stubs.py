@@ -0,0 +1,198 @@
+"""
+Local stand-ins for the Salla Admin API and the FunnerLife API.
+
+Used by benchmarks and load tests to put a known latency (and, if asked,
+a share of failing answers) behind the outbound clients; never by the
+request path. Responses are shaped like the real ones (see
+apps/salla/synthetic.py) and derived from the order id, so every request
+for the same order sees the same items.
+
+Run the stub with StubProcess so its threads don't compete with the code
+under test for the GIL.
+"""
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+from apps.salla.synthetic import sample_item, sample_order
+
+
+class StubConfig:
+    """
+    ``latency`` (+ up to ``jitter``) seconds per call. ``error_rates`` maps
+    "salla" / "funnerlife" to the share of calls answered with
+    ``error_status`` instead.
+    """
+
+    def __init__(self, latency=0.05, items_per_order=2, skus=("1001",), status="paid",
+                 jitter=0.0, error_rates=None, error_status=503):
+        self.latency = latency
+        self.items_per_order = items_per_order
+        self.skus = list(skus)
+        self.status = status
+        self.jitter = jitter
+        self.error_rates = error_rates or {}
+        self.error_status = error_status
+
+    def delay(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def fails(self, upstream):
+        return random.random() < self.error_rates.get(upstream, 0)
+
+    def items(self, order_id):
+        rng = random.Random(order_id)
+        return [
+            sample_item(rng, sku=self.skus[i % len(self.skus)])
+            for i in range(self.items_per_order)
+        ]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _fail(self, upstream):
+        """Answer with the configured error (and count it) if this call is picked to fail."""
+        config = self.server.config
+        if not config.fails(upstream):
+            return False
+        self.server.count(f"{upstream}_errors")
+        self._send(config.error_status, {"status": config.error_status, "success": False, "error": "injected"})
+        return True
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            return self._send(200, self.server.requests)
+
+        config = self.server.config
+        config.delay()
+        url = urlsplit(self.path)
+        self.server.count("salla")
+        if self._fail("salla"):
+            return
+
+        if url.path.endswith("/orders/items"):
+            order_id = int(parse_qs(url.query).get("order_id", ["0"])[0])
+            return self._send(200, {"status": 200, "success": True, "data": config.items(order_id)})
+
+        if "/orders/" in url.path:
+            order_id = int(url.path.rstrip("/").rsplit("/", 1)[1])
+            order = sample_order(order_id=order_id, items=0, status=config.status, rng=random.Random(order_id))
+            order.pop("items")
+            return self._send(200, {"status": 200, "success": True, "data": order})
+
+        self._send(404, {"status": 404, "success": False})
+
+    def do_POST(self):
+        config = self.server.config
+        body = self._read_body()
+        config.delay()
+        url = urlsplit(self.path)
+
+        if url.path.endswith("/order"):
+            self.server.count("funnerlife")
+            if self._fail("funnerlife"):
+                return
+            form = parse_qs(body.decode())
+            idtrx = form.get("idtrx", [""])[0]
+            return self._send(200, {"status": True, "msg": "Order diproses", "data": {"idtrx": idtrx, "status": "Pending"}})
+
+        if url.path.endswith("/service"):
+            self.server.count("funnerlife")
+            if self._fail("funnerlife"):
+                return
+            return self._send(200, {"status": True, "msg": "OK", "data": [
+                {"id": sku, "nama_layanan": f"Stub {sku}", "kategori": "Free Fire", "harga": 10000, "status": "Aktif"}
+                for sku in config.skus
+            ]})
+
+        if url.path.endswith("/oauth2/token"):
+            self.server.count("salla")
+            if self._fail("salla"):
+                return
+            return self._send(200, {"access_token": "stub-token", "refresh_token": "stub-refresh", "expires_in": 1209600})
+
+        self._send(404, {"status": False, "msg": "not found"})
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub on 127.0.0.1; ``url`` is its base URL once started."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config=None, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.config = config or StubConfig()
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # Clients that time out and hang up are expected (timeout tests, overload).
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, upstream):
+        with self._lock:
+            self.requests[upstream] = self.requests.get(upstream, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(config, port, conn):
+    server = StubServer(config, port)
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+class StubProcess:
+    """A StubServer in a child process; ``stats()`` returns its request counts."""
+
+    def __init__(self, config=None, port=0):
+        context = multiprocessing.get_context("spawn")
+        parent, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(config or StubConfig(), port, child), daemon=True)
+        self.process.start()
+        self.url = f"http://127.0.0.1:{parent.recv()}"
+
+    def stats(self):
+        with urlopen(f"{self.url}/_stats") as response:
+            return json.loads(response.read())
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
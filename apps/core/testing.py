@@ -0,0 +1,185 @@
+"""
+Helpers for the query / HTTP-call / wall-time budget tests in apps/*/tests.py.
+
+Budgets are maxima: a change that adds a query per item (N+1) or an extra
+upstream call fails the test that covers it. Wall times are compared against
+apps/core/perf_baselines.json with a generous PERF_TOLERANCE (default 3x,
+plus PERF_SLACK_MS, default 20 ms, so millisecond-sized timings don't flake)
+because they depend on the machine; run the tests with PERF_RECORD=1 to
+write the current timings as the new baselines.
+"""
+import io
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.core import http
+from apps.core.logs import BufferedJSONHandler
+
+BASELINES_PATH = Path(__file__).with_name("perf_baselines.json")
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body if body is not None else {}
+        self.headers = headers or {}
+        self.text = json.dumps(self._body)
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class FakeTransport:
+    """
+    Stands in for the process-wide HTTPTransport (see use_fake_transport()).
+    ``routes`` maps a URL path suffix to ``fn(method, url, kwargs) -> FakeResponse``;
+    every request is recorded in ``calls``.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self._lock:
+            self.calls.append((method, url))
+        path = urlsplit(url).path
+        for suffix, fn in self.routes.items():
+            if path.endswith(suffix):
+                return fn(method, url, kwargs)
+        return FakeResponse(404, {"status": 404, "success": False})
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def count(self, suffix=None):
+        with self._lock:
+            return sum(1 for _, url in self.calls if suffix is None or urlsplit(url).path.endswith(suffix))
+
+
+class FakeAsyncTransport:
+    """The get_async_transport() side of a FakeTransport: same routes, same ``calls``."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def request(self, method, url, **kwargs):
+        return self.transport.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+class _EveryLoop(dict):
+    """Stands in for http._async_transports: every event loop gets ``transport``."""
+
+    def __init__(self, transport):
+        super().__init__()
+        self.transport = transport
+
+    def get(self, loop, default=None):
+        return self.transport
+
+
+@contextmanager
+def use_fake_transport(transport):
+    """Route every outbound call (get_transport() and get_async_transport()) through ``transport``."""
+    previous = http._transport, http._async_transports
+    http._transport = transport
+    http._async_transports = _EveryLoop(FakeAsyncTransport(transport))
+    try:
+        yield transport
+    finally:
+        http._transport, http._async_transports = previous
+
+
+@contextmanager
+def capture_logs(name="apps", level=logging.INFO):
+    """
+    Collect what ``name``'s records write through a BufferedJSONHandler, as
+    in production. The yielded list gets the parsed JSON lines when the
+    block exits (the handler is closed, so every queued record is in).
+    """
+    stream = io.StringIO()
+    handler = BufferedJSONHandler(stream)
+    logger = logging.getLogger(name)
+    previous = logger.level
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    lines = []
+    try:
+        yield lines
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(previous)
+        handler.close()
+        lines.extend(json.loads(line) for line in stream.getvalue().splitlines())
+
+
+class BudgetTestMixin:
+    """assertMaxQueries() and assertWallTime() for TestCase subclasses."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        queries = len(captured.captured_queries)
+        if queries > budget:
+            listing = "\n".join(f"{i}. {q['sql']}" for i, q in enumerate(captured.captured_queries, 1))
+            self.fail(f"{queries} queries, budget {budget}:\n{listing}")
+
+    def assertWallTime(self, name, fn, repeat=3):
+        """Run ``fn`` ``repeat`` times; the fastest run must be within PERF_TOLERANCE x the baseline + PERF_SLACK_MS."""
+        seconds = min(_timed(fn) for _ in range(repeat))
+        if os.getenv("PERF_RECORD"):
+            _record(name, seconds)
+            return seconds
+
+        baseline = _baselines().get(name)
+        if baseline is not None:
+            tolerance = float(os.getenv("PERF_TOLERANCE", "3"))
+            slack = float(os.getenv("PERF_SLACK_MS", "20")) / 1000
+            self.assertLessEqual(
+                seconds, baseline * tolerance + slack,
+                f"{name}: {seconds * 1000:.1f} ms, baseline {baseline * 1000:.1f} ms "
+                f"(x{tolerance:g} + {slack * 1000:g} ms allowed)",
+            )
+        return seconds
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def _baselines():
+    if not BASELINES_PATH.exists():
+        return {}
+    return json.loads(BASELINES_PATH.read_text())
+
+
+def _record(name, seconds):
+    baselines = _baselines()
+    baselines[name] = round(seconds, 4)
+    BASELINES_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
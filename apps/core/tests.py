@@ -1,3 +1,498 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.core import fields, http, metrics
+from apps.core.http import AsyncHTTPTransport, HTTPTransport, get_transport, never_sent
+from apps.core.logs import BufferedJSONHandler, correlation
+from apps.core.models import RateLimitBucket
+from apps.core.ratelimit import BACKGROUND, LIVE, RateLimitError, acquire, drop_leases, observe, try_acquire
+from apps.core.resilience import CircuitBreaker, CircuitOpenError, UpstreamError, acall, call, get_breaker
+from apps.core.stubs import StubConfig, StubServer
+from apps.core.testing import FakeResponse
+from apps.funnerlife.models import FunnerlifeTransaction
+from apps.salla.models import SallaOrder, WebhookEvent
+
+
+class MetricsAccessTests(TestCase):
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=True)
+    def test_open_in_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="s3cret", DEBUG=False)
+    def test_requires_the_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer nope"}).status_code, 401)
+
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"salla_webhook_queue_depth", response.content)
+
+
+class MetricsTests(TestCase):
+    def metric(self, cls, *args, **kwargs):
+        metric = cls(*args, **kwargs)
+        self.addCleanup(metrics._registry.remove, metric)
+        return metric
+
+    def test_histogram_samples(self):
+        histogram = self.metric(metrics.Histogram, "test_seconds", "Test.", ["path"], buckets=(0.01, 1))
+        for seconds in [0.003, 0.2, 0.5, 100]:
+            histogram.observe(seconds, path='a"b')
+
+        self.assertEqual(histogram.samples(), [
+            'test_seconds_bucket{path="a\\"b",le="0.01"} 1',
+            'test_seconds_bucket{path="a\\"b",le="1"} 3',
+            'test_seconds_bucket{path="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{path="a\\"b"} 100.703',
+            'test_seconds_count{path="a\\"b"} 4',
+        ])
+
+    def test_labels_must_match(self):
+        counter = self.metric(metrics.Counter, "test_total", "Test.", ["result"])
+        with self.assertRaises(ValueError):
+            counter.inc(outcome="ok")
+
+    def test_gauges_are_read_from_the_db_when_rendered(self):
+        for i in range(2):
+            WebhookEvent.objects.create(event_id=f"evt-{i}", event_type="order.created", payload={})
+        order = SallaOrder.objects.create(order_id=1, full_payload={})
+        FunnerlifeTransaction.objects.create(idtrx="trx-1", order=order, sku="1001", target="123")
+
+        lines = metrics.render().splitlines()
+        self.assertIn("salla_webhook_queue_depth 2", lines)
+        self.assertIn("funnerlife_pending_transactions 1", lines)
+
+    def test_failing_collector_does_not_break_the_scrape(self):
+        def broken():
+            raise RuntimeError("boom")
+
+        metrics._collectors.append(broken)
+        self.addCleanup(metrics._collectors.remove, broken)
+        with self.assertLogs("apps.core.metrics", "WARNING"):
+            output = metrics.render()
+        self.assertIn('metrics_collector_errors_total{collector="broken"}', output)
+        self.assertIn("salla_webhook_queue_depth", output)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=True)
+    def test_requests_are_timed_by_route(self):
+        with self.assertLogs("django.request", "WARNING"):  # unauthenticated: 403
+            self.client.get("/api/salla/orders/")
+        output = self.client.get("/metrics").content.decode()
+        self.assertIn('http_request_seconds_count{view="/api/salla/orders/",method="GET",status="', output)
+        self.assertIn('http_request_db_queries_total{view="/api/salla/orders/"}', output)
+
+
+@override_settings(
+    RETRY_POLICIES={"test.call": {"attempts": 3, "budget": 5}}, RETRY_BACKOFF_BASE=0.001, CIRCUIT_FAILURE_THRESHOLD=5,
+)
+class RetryTests(TestCase):
+    def setUp(self):
+        self.addCleanup(get_breaker("retry.test").record_success)
+
+    def responses(self, *statuses):
+        """A send() returning one response per status, in order; counts the attempts."""
+        self.attempts = 0
+        remaining = list(statuses)
+
+        def send():
+            self.attempts += 1
+            return FakeResponse(remaining.pop(0))
+
+        return send
+
+    def test_retries_until_a_good_response(self):
+        response = call("test.call", "http://retry.test/", self.responses(503, 429, 200))
+        self.assertEqual((response.status_code, self.attempts), (200, 3))
+        self.assertEqual(get_breaker("retry.test").failures, 0)
+
+    def test_client_errors_are_not_retried(self):
+        response = call("test.call", "http://retry.test/", self.responses(404, 200))
+        self.assertEqual((response.status_code, self.attempts), (404, 1))
+
+    def test_gives_up_after_the_last_attempt(self):
+        with self.assertRaises(UpstreamError) as raised:
+            call("test.call", "http://retry.test/", self.responses(502, 502, 502, 200))
+        self.assertEqual((raised.exception.status_code, self.attempts), (502, 3))
+        self.assertEqual(get_breaker("retry.test").failures, 3)
+
+    def test_throttling_does_not_count_against_the_breaker(self):
+        with self.assertRaises(UpstreamError):
+            call("test.call", "http://retry.test/", self.responses(429, 429, 429))
+        self.assertEqual(get_breaker("retry.test").failures, 0)
+
+    def test_async_retries(self):
+        send = self.responses(503, 200)
+
+        async def asend():
+            return send()
+
+        response = asyncio.run(acall("test.call", "http://retry.test/", asend))
+        self.assertEqual((response.status_code, self.attempts), (200, 2))
+
+    def test_async_gives_up_after_the_last_attempt(self):
+        send = self.responses(502, 502, 502, 200)
+
+        async def asend():
+            return send()
+
+        with self.assertRaises(UpstreamError) as raised:
+            asyncio.run(acall("test.call", "http://retry.test/", asend))
+        self.assertEqual((raised.exception.status_code, self.attempts), (502, 3))
+        self.assertEqual(get_breaker("retry.test").failures, 3)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("breaker.test", failure_threshold=2, reset_timeout=0.05)
+
+    def open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.before_call()  # a success in between resets the count
+
+        self.breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_one_probe_after_the_reset_timeout(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.before_call()  # the probe
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_probe_reopens(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_released_probe_slot(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.breaker.release()  # not sent (rate limited): another caller may probe
+        self.breaker.before_call()
+
+
+@override_settings(
+    RETRY_POLICIES={"test.call": {"attempts": 2, "budget": 5}}, RETRY_BACKOFF_BASE=0.001, CIRCUIT_FAILURE_THRESHOLD=1,
+)
+class SentFlagTests(TestCase):
+    """UpstreamError.sent: could any attempt of the call have reached the upstream?"""
+
+    def closed_port_url(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        return f"http://127.0.0.1:{port}/"
+
+    def test_connection_refused_was_not_sent(self):
+        url = self.closed_port_url()
+        self.addCleanup(get_breaker(url.split("/")[2]).record_success)
+        with self.assertRaises(UpstreamError) as raised:
+            call("test.call", url, lambda: get_transport().get(url, timeout=1))
+        self.assertFalse(raised.exception.sent)
+
+    async def test_async_connection_refused_was_not_sent(self):
+        url = self.closed_port_url()
+        self.addCleanup(get_breaker(url.split("/")[2]).record_success)
+        transport = AsyncHTTPTransport()
+        try:
+            with self.assertRaises(UpstreamError) as raised:
+                await acall("test.call", url, lambda: transport.get(url, timeout=1))
+        finally:
+            await transport.aclose()
+        self.assertFalse(raised.exception.sent)
+
+    def test_error_responses_were_sent(self):
+        url = "http://sent-5xx.test/"
+        self.addCleanup(get_breaker("sent-5xx.test").record_success)
+        with self.assertRaises(UpstreamError) as raised:
+            call("test.call", url, lambda: FakeResponse(503))
+        # The 503 opened the circuit; the retry that it blocked doesn't undo the first attempt.
+        self.assertIsInstance(raised.exception, CircuitOpenError)
+        self.assertTrue(raised.exception.sent)
+
+    def test_open_circuit_was_not_sent(self):
+        breaker = get_breaker("sent-open.test")
+        self.addCleanup(breaker.record_success)
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError) as raised:
+            call("test.call", "http://sent-open.test/", lambda: FakeResponse(200))
+        self.assertFalse(raised.exception.sent)
+
+
+class TransportTests(SimpleTestCase):
+    """HTTPTransport: one pooled session per process, its stats, and never_sent()."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubServer(StubConfig(latency=0)).start()
+        cls.addClassCleanup(cls.stub.stop)
+        cls.host = cls.stub.url.split("/")[2]
+
+    def transport(self, **kwargs):
+        transport = HTTPTransport(**kwargs)
+        self.addCleanup(transport.close)
+        return transport
+
+    def fetch_items(self, transport, order_id=7):
+        return transport.get(f"{self.stub.url}/admin/v2/orders/items", params={"order_id": order_id}, timeout=5)
+
+    def test_one_transport_per_process(self):
+        with mock.patch.object(http, "_transport", None):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                transports = set(pool.map(lambda _: get_transport(), range(32)))
+            self.assertEqual(len(transports), 1)
+            self.assertIs(transports.pop(), get_transport())
+
+    def test_connections_are_reused(self):
+        transport = self.transport()
+        for order_id in range(5):
+            self.assertEqual(self.fetch_items(transport, order_id).status_code, 200)
+        self.assertEqual(transport.stats(), {self.host: {"requests": 5, "connections": 1, "reused": 4}})
+
+    def test_parallel_requests_share_the_pool(self):
+        transport = self.transport(pool_maxsize=3)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            responses = list(pool.map(lambda i: self.fetch_items(transport, i), range(12)))
+        self.assertEqual({response.status_code for response in responses}, {200})
+        stats = transport.stats()[self.host]
+        self.assertEqual(stats["requests"], 12)
+        self.assertLessEqual(stats["connections"], 3)
+        self.assertEqual(stats["reused"], 12 - stats["connections"])
+
+    def test_never_sent(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            closed = f"http://127.0.0.1:{s.getsockname()[1]}/"
+        with self.assertRaises(Exception) as refused:
+            self.transport().get(closed, timeout=1)
+        self.assertTrue(never_sent(refused.exception))
+
+        slow = StubServer(StubConfig(latency=0.5)).start()
+        self.addCleanup(slow.stop)
+        with self.assertRaises(Exception) as timed_out:
+            self.transport().get(f"{slow.url}/admin/v2/orders/1", timeout=0.1)
+        self.assertFalse(never_sent(timed_out.exception))  # connected: the request may have been read
+
+        self.assertFalse(never_sent(ValueError("not a transport error")))
+
+
+class AsyncTransportTests(SimpleTestCase):
+    """AsyncHTTPTransport against a local stub, with aiohttp and without it."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubServer(StubConfig(latency=0)).start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    async def fetch_items(self, transport):
+        try:
+            return await transport.get(f"{self.stub.url}/admin/v2/orders/items", params={"order_id": 7}, timeout=5)
+        finally:
+            await transport.aclose()
+
+    async def test_aiohttp_session(self):
+        transport = AsyncHTTPTransport()
+        self.assertIsNotNone(transport.session)
+        response = await self.fetch_items(transport)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]), 2)
+        self.assertEqual(transport.stats(), {self.stub.url.split("/")[2]: {"requests": 1}})
+
+    async def test_falls_back_to_the_sync_transport(self):
+        with mock.patch.object(http, "aiohttp", None):
+            transport = AsyncHTTPTransport()
+            self.assertIsNone(transport.session)
+            response = await self.fetch_items(transport)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]), 2)
+
+
+class BufferedJSONHandlerTests(SimpleTestCase):
+    """Records are written by the listener thread as they come, all of them at close, and dropped when full."""
+
+    def handler(self, **kwargs):
+        stream = io.StringIO()
+        handler = BufferedJSONHandler(stream, **kwargs)
+        self.addCleanup(handler.close)
+        logger = logging.getLogger("test.buffered")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger, handler, stream
+
+    def lines(self, stream):
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_records_are_written_without_closing(self):
+        logger, handler, stream = self.handler()
+        with correlation("corr-1"):
+            logger.info("charged %s", "1001", extra={"sku": "1001"})
+
+        deadline = time.monotonic() + 2
+        while not stream.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        [line] = self.lines(stream)
+        self.assertEqual((line["msg"], line["sku"], line["correlation_id"]), ("charged 1001", "1001", "corr-1"))
+
+    def test_close_writes_everything_queued(self):
+        logger, handler, stream = self.handler()
+        for i in range(500):
+            logger.info("record %d", i)
+        handler.close()
+        self.assertEqual([line["msg"] for line in self.lines(stream)], [f"record {i}" for i in range(500)])
+
+    def test_correlation_id_is_taken_on_the_logging_thread(self):
+        logger, handler, stream = self.handler()
+        with correlation("corr-2"):
+            thread = threading.Thread(target=logger.info, args=("plain thread",))
+            thread.start()
+            thread.join()
+        handler.close()
+        # A thread that isn't run in a copy of the context doesn't inherit the ID.
+        self.assertEqual(self.lines(stream)[0]["correlation_id"], None)
+
+    def test_full_queue_drops_records(self):
+        logger, handler, stream = self.handler(capacity=2)
+        handler.listener.stop()  # nothing drains the queue
+        for i in range(5):
+            logger.info("record %d", i)
+        self.assertEqual(handler.dropped, 3)
+
+        handler.listener.start()
+        handler.close()
+        self.assertEqual([line["msg"] for line in self.lines(stream)], ["record 0", "record 1"])
+
+
+@override_settings(
+    RATE_LIMITS={"test": {"capacity": 10, "per_second": 0.0001}}, RATE_LIMIT_LIVE_RESERVE=0.2,
+    RATE_LIMIT_LEASE_SIZE=5, RATE_LIMIT_LEASE_SECONDS=60,
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        drop_leases("test")
+        self.addCleanup(drop_leases, "test")
+        RateLimitBucket.objects.create(name="test", capacity=10, refill_rate=0.0001, tokens=10, updated_at=time.time())
+
+    def tokens(self):
+        return RateLimitBucket.objects.get(name="test").tokens
+
+    def test_one_update_per_lease(self):
+        self.assertEqual(try_acquire("test", LIVE), 0)  # lets the bucket lookup happen outside the count
+        with self.assertNumQueries(0):
+            for _ in range(4):
+                self.assertEqual(try_acquire("test", LIVE), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(try_acquire("test", LIVE), 0)
+        self.assertAlmostEqual(self.tokens(), 0, places=2)
+
+    def test_expired_lease_goes_back_to_the_bucket(self):
+        try_acquire("test", LIVE)
+        self.assertAlmostEqual(self.tokens(), 5, places=2)
+        with override_settings(RATE_LIMIT_LEASE_SECONDS=0):
+            try_acquire("test", LIVE)
+        # 4 leftovers returned, a fresh lease of 5 taken.
+        self.assertAlmostEqual(self.tokens(), 4, places=2)
+
+    def test_last_tokens_are_taken_one_by_one(self):
+        RateLimitBucket.objects.filter(name="test").update(tokens=2)
+        self.assertEqual(try_acquire("test", LIVE), 0)
+        self.assertEqual(try_acquire("test", LIVE), 0)
+        self.assertGreater(try_acquire("test", LIVE), 0)
+
+    def test_background_leaves_the_live_reserve(self):
+        RateLimitBucket.objects.filter(name="test").update(tokens=3)
+        # A second background token would leave less than 20% of 10 in the bucket.
+        self.assertEqual(try_acquire("test", BACKGROUND), 0)
+        self.assertGreater(try_acquire("test", BACKGROUND), 0)
+        self.assertEqual(try_acquire("test", LIVE), 0)
+
+    def test_remaining_header_caps_the_bucket(self):
+        observe("test", FakeResponse(200, headers={"X-RateLimit-Remaining": "3"}))
+        self.assertEqual(self.tokens(), 3)
+        observe("test", FakeResponse(200, headers={"X-RateLimit-Remaining": "8"}))
+        self.assertEqual(self.tokens(), 3)  # never raised above the local count
+
+    @override_settings(RATE_LIMIT_MAX_WAIT={"live": 0.05, "background": 0.05})
+    def test_gives_up_after_the_max_wait(self):
+        RateLimitBucket.objects.filter(name="test").update(tokens=0)
+        with self.assertRaises(RateLimitError) as raised:
+            acquire("test", LIVE)
+        self.assertFalse(raised.exception.sent)
+
+    def test_429_drops_the_lease(self):
+        try_acquire("test", LIVE)
+        observe("test", FakeResponse(429, headers={"Retry-After": "30"}))
+        wait = try_acquire("test", LIVE)
+        self.assertGreater(wait, 25)
+
+
+class CompressionTests(SimpleTestCase):
+    data = fields.dumps({"items": [{"sku": str(i), "name": "Diamonds"} for i in range(50)]})
+
+    def test_codecs_round_trip(self):
+        for codec, tag in [("zlib", fields.ZLIB), ("zstd", fields.ZSTD)]:
+            with self.subTest(codec=codec):
+                blob = fields.compress(self.data, codec)
+                self.assertEqual(blob[0], tag)
+                self.assertLess(len(blob), len(self.data))
+                self.assertEqual(fields.decompress(blob), self.data)
+
+    @override_settings(COMPRESSED_JSON_MIN_SIZE=128)
+    def test_small_values_are_stored_raw(self):
+        blob = fields.compress(b"{}")
+        self.assertEqual(blob, bytes([fields.RAW]) + b"{}")
+        self.assertEqual(fields.decompress(blob), b"{}")
+
+    def test_unknown_tag(self):
+        with self.assertRaises(ValueError):
+            fields.decompress(b"\x09{}")
+
+
+class LoadtestSmokeTests(SimpleTestCase):
+    """manage.py loadtest end to end, on two webhooks (its own processes and throwaway database)."""
+
+    def test_two_webhooks(self):
+        result = subprocess.run(
+            [sys.executable, "manage.py", "loadtest", "--requests", "2", "--rate", "20", "--latency-ms", "0", "--jitter-ms", "0"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Sending 2 webhooks", result.stdout)
+        self.assertIn("Webhooks:   2/2 ok", result.stdout)
+        self.assertIn("Events:     PROCESSED 2", result.stdout)
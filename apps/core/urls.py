@@ -1,9 +1,11 @@
 from django.urls import path
-from .views import AdminLoginView, AdminLogoutView
+from .views import AdminLoginView, AdminLogoutView, IntegrationStatusView, MetricsView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
     path('auth/login/', AdminLoginView.as_view(), name='admin-login'),
     path('auth/logout/', AdminLogoutView.as_view(), name='admin-logout'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('integrations/status/', IntegrationStatusView.as_view(), name='integrations-status'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
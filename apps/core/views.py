@@ -1,3 +1,7 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,6 +10,9 @@ from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from datetime import datetime
 
+from .metrics import CONTENT_TYPE, render
+from .resilience import breaker_states
+
 class AdminLoginView(APIView):
     permission_classes = [AllowAny]
 
@@ -80,3 +87,35 @@ class AdminLogoutView(APIView):
             {"detail": "Logged out successfully."},
             status=status.HTTP_200_OK,
         )
+
+
+class IntegrationStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """Circuit breaker state per upstream host (this process only)."""
+        breakers = breaker_states()
+        return Response(
+            {
+                "healthy": all(b["state"] == "closed" for b in breakers),
+                "breakers": breakers,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class MetricsView(APIView):
+    # Scrapers send METRICS_TOKEN, not an admin JWT. Without a token the
+    # endpoint only exists with DEBUG on.
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Prometheus metrics of this process, plus queue/token gauges from the DB."""
+        if settings.METRICS_TOKEN:
+            given = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not hmac.compare_digest(given, settings.METRICS_TOKEN):
+                return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        elif not settings.DEBUG:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.dashboard.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the dashboard's hourly/daily rollups from the orders, webhook events and "
+        "FunnerLife transactions in the DB (after a restore, a bug or a DASHBOARD_SKETCH_ACCURACY change)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.WEBHOOK_RETENTION_DAYS,
+                            help="Rebuild this many days back (older webhook events may be archived).")
+
+    def handle(self, *args, **options):
+        written = rebuild(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(f"Rebuilt {written} dashboard rollups for the last {options['days']} days.")
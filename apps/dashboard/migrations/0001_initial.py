@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=8)),
+                ('bucket', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('webhooks_processed', models.PositiveIntegerField(default=0)),
+                ('webhooks_failed', models.PositiveIntegerField(default=0)),
+                ('charges', models.PositiveIntegerField(default=0)),
+                ('charges_succeeded', models.PositiveIntegerField(default=0)),
+                ('charges_failed', models.PositiveIntegerField(default=0)),
+                ('charges_refunded', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket'), name='uniq_dashboard_rollup_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LatencyBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('webhook', 'Webhook'), ('charge', 'Charge')], max_length=20)),
+                ('index', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('rollup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='latency_buckets', to='dashboard.rollup')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('rollup', 'metric', 'index'), name='uniq_dashboard_latency_bucket')],
+            },
+        ),
+    ]
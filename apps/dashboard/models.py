@@ -1,3 +1,51 @@
 from django.db import models
 
-# Create your models here.
+
+class Rollup(models.Model):
+    """
+    Dashboard counters for one hour or one day, incremented as webhooks,
+    charges and callbacks are written (see apps/dashboard/rollups.py).
+    """
+    class Period(models.TextChoices):
+        HOUR = "hour"
+        DAY = "day"
+
+    period = models.CharField(max_length=8, choices=Period.choices)
+    # Start of the hour / day, in TIME_ZONE.
+    bucket = models.DateTimeField()
+    orders = models.PositiveIntegerField(default=0)              # new Salla orders
+    webhooks_processed = models.PositiveIntegerField(default=0)
+    webhooks_failed = models.PositiveIntegerField(default=0)     # gave up after WEBHOOK_MAX_RETRIES
+    charges = models.PositiveIntegerField(default=0)             # FunnerLife transactions claimed
+    charges_succeeded = models.PositiveIntegerField(default=0)
+    charges_failed = models.PositiveIntegerField(default=0)
+    charges_refunded = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "bucket"], name="uniq_dashboard_rollup_bucket"),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:%M}"
+
+
+class LatencyBucket(models.Model):
+    """
+    One bucket of a rollup's latency sketch: how many observations of
+    ``metric`` fell into log bucket ``index`` (see apps/dashboard/sketch.py).
+    Sketches merge by adding counts of the same index.
+    """
+    class Metric(models.TextChoices):
+        WEBHOOK = "webhook"  # webhook received -> processed
+        CHARGE = "charge"    # charge -> final callback
+
+    rollup = models.ForeignKey(Rollup, on_delete=models.CASCADE, related_name="latency_buckets")
+    metric = models.CharField(max_length=20, choices=Metric.choices)
+    index = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["rollup", "metric", "index"], name="uniq_dashboard_latency_bucket"),
+        ]
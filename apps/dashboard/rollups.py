@@ -0,0 +1,246 @@
+"""
+Incremental dashboard rollups.
+
+record() is called where the facts are written (new Salla order, webhook
+processed / failed, charge claimed, transaction status changed) and adds to
+the hour and the day Rollup rows containing that moment. Counters and
+latency buckets are bumped with ``UPDATE ... SET n = n + k``, which is safe
+with several processes writing. Reading a period is then a fixed number of
+rows, however much traffic it had.
+
+Inside batched() (one webhook run), record() only collects, and the whole
+run is written at the end: one counter UPDATE and one per latency bucket
+instead of one per fact. That write also happens when the run fails (its
+failure is counted too); an error in it is logged, never raised over the
+run's own outcome.
+
+`manage.py rebuild_dashboard_rollups` recomputes them from the source tables.
+"""
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.utils import timezone
+
+from .models import LatencyBucket, Rollup
+from .sketch import bucket_index
+
+# (period, bucket) -> Rollup id and (rollup id, metric, index) rows known to
+# exist, so the steady state is UPDATEs only. Reset when they grow: only the
+# current hour and day are written to.
+_known_rollups = {}
+_known_buckets = set()
+_MAX_KNOWN = 1000
+
+# record() calls collected by the enclosing batched() block.
+_batch = ContextVar("dashboard_rollup_batch", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_starts(when):
+    """Start of the hour and of the day containing ``when``, in TIME_ZONE."""
+    local = timezone.localtime(when)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    return hour, hour.replace(hour=0)
+
+
+def _rollup_ids(when):
+    ids = []
+    for period, bucket in zip([Rollup.Period.HOUR, Rollup.Period.DAY], bucket_starts(when)):
+        key = (period, bucket)
+        if key not in _known_rollups:
+            if len(_known_rollups) >= _MAX_KNOWN:
+                _known_rollups.clear()
+            _known_rollups[key] = Rollup.objects.get_or_create(period=period, bucket=bucket)[0].pk
+        ids.append(_known_rollups[key])
+    return ids
+
+
+def _ensure_latency_buckets(rollup_ids, metric, index):
+    missing = [rollup_id for rollup_id in rollup_ids if (rollup_id, metric, index) not in _known_buckets]
+    if not missing:
+        return
+    if len(_known_buckets) >= _MAX_KNOWN:
+        _known_buckets.clear()
+    LatencyBucket.objects.bulk_create(
+        [LatencyBucket(rollup_id=rollup_id, metric=metric, index=index) for rollup_id in missing],
+        ignore_conflicts=True,
+    )
+    _known_buckets.update((rollup_id, metric, index) for rollup_id in missing)
+
+
+def record(when=None, latencies=None, **counts):
+    """
+    Add ``counts`` (Rollup field -> increment) and ``latencies``
+    ({metric: [ms, ...]}) to the rollups of ``when`` (default now).
+    """
+    counts = {field: n for field, n in counts.items() if n}
+    latencies = {metric: values for metric, values in (latencies or {}).items() if values}
+    if not counts and not latencies:
+        return
+
+    when = when or timezone.now()
+    batch = _batch.get()
+    if batch is not None:
+        batch.append((when, counts, latencies))
+        return
+    _write(when, counts, latencies)
+
+
+@contextmanager
+def batched():
+    """Write the block's record() calls together when it ends (also on errors)."""
+    if _batch.get() is not None:
+        yield
+        return
+    batch = []
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+        flush_logged(batch)
+
+
+@asynccontextmanager
+async def abatched():
+    """batched() for async code; the calls may come from sync_to_async threads."""
+    if _batch.get() is not None:
+        yield
+        return
+    batch = []
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+        await sync_to_async(flush_logged)(batch)
+
+
+def flush_logged(batch):
+    """flush() for the end of a batched() block: a failure is logged instead of replacing the block's outcome."""
+    try:
+        flush(batch)
+    except Exception:
+        logger.exception("Dashboard rollups not written", extra={"records": len(batch)})
+
+
+def flush(batch):
+    """Write collected record() calls, merged per hour."""
+    merged = {}
+    for when, counts, latencies in batch:
+        hour = bucket_starts(when)[0]
+        _, total_counts, total_latencies = merged.setdefault(hour, (when, {}, {}))
+        for field, n in counts.items():
+            total_counts[field] = total_counts.get(field, 0) + n
+        for metric, values in latencies.items():
+            total_latencies.setdefault(metric, []).extend(values)
+    for when, counts, latencies in merged.values():
+        _write(when, counts, latencies)
+
+
+def _write(when, counts, latencies):
+    rollup_ids = _rollup_ids(when)
+    updates = {field: F(field) + n for field, n in counts.items()}
+    rollups = Rollup.objects.filter(pk__in=rollup_ids)
+    if (rollups.update(**updates) if updates else rollups.count()) < len(rollup_ids):
+        # A cached row is gone (rebuild, DB reset); latency buckets go with it.
+        reset_cache()
+        rollup_ids = _rollup_ids(when)
+        if updates:
+            Rollup.objects.filter(pk__in=rollup_ids).update(**updates)
+
+    for metric, values in latencies.items():
+        per_index = {}
+        for ms in values:
+            index = bucket_index(ms)
+            per_index[index] = per_index.get(index, 0) + 1
+        for index, n in per_index.items():
+            _ensure_latency_buckets(rollup_ids, metric, index)
+            LatencyBucket.objects.filter(rollup_id__in=rollup_ids, metric=metric, index=index).update(
+                count=F("count") + n,
+            )
+
+
+def reset_cache():
+    """Forget which rows exist (after rollups were deleted or rebuilt)."""
+    _known_rollups.clear()
+    _known_buckets.clear()
+
+
+def milliseconds(delta):
+    return max(delta / timedelta(milliseconds=1), 0)
+
+
+def rebuild(since):
+    """
+    Recompute the rollups from ``since`` (rounded down to its day) from the
+    source tables; returns the number of Rollup rows written.
+
+    Only what is still in the DB counts: webhook events already archived are
+    missing, and a refunded charge counts as refunded only (its earlier
+    success isn't stored anywhere).
+    """
+    from django.db import transaction
+    from apps.funnerlife.models import FunnerlifeTransaction
+    from apps.salla.models import SallaOrder, WebhookEvent
+
+    start = bucket_starts(since)[1]
+    counters = {}
+    sketches = {}
+
+    def add(when, field=None, metric=None, ms=None):
+        for key in zip([Rollup.Period.HOUR, Rollup.Period.DAY], bucket_starts(when)):
+            if field:
+                counters.setdefault(key, {}).setdefault(field, 0)
+                counters[key][field] += 1
+            if metric:
+                index = bucket_index(ms)
+                sketches.setdefault((key, metric, index), 0)
+                sketches[(key, metric, index)] += 1
+
+    for created_at in SallaOrder.objects.filter(created_at__gte=start).values_list("created_at", flat=True).iterator():
+        add(created_at, "orders")
+
+    events = WebhookEvent.objects.filter(
+        processed_at__gte=start, status__in=[WebhookEvent.Status.PROCESSED, WebhookEvent.Status.FAILED],
+    ).values_list("status", "received_at", "processed_at")
+    for status, received_at, processed_at in events.iterator():
+        if status == WebhookEvent.Status.PROCESSED:
+            add(processed_at, "webhooks_processed", LatencyBucket.Metric.WEBHOOK, milliseconds(processed_at - received_at))
+        else:
+            add(processed_at, "webhooks_failed")
+
+    Status = FunnerlifeTransaction.Status
+    fields = {Status.SUCCESS: "charges_succeeded", Status.FAILED: "charges_failed", Status.REFUNDED: "charges_refunded"}
+    for created_at in FunnerlifeTransaction.objects.filter(created_at__gte=start).values_list("created_at", flat=True).iterator():
+        add(created_at, "charges")
+    finished = FunnerlifeTransaction.objects.filter(updated_at__gte=start).exclude(status=Status.PENDING).values_list(
+        "status", "updated_at", "latency_ms",
+    )
+    for status, updated_at, latency_ms in finished.iterator():
+        add(updated_at, fields[status])
+        if latency_ms is not None and status != Status.REFUNDED:
+            add(updated_at, metric=LatencyBucket.Metric.CHARGE, ms=latency_ms)
+
+    keys = set(counters) | {key for key, _, _ in sketches}
+    with transaction.atomic():
+        Rollup.objects.filter(bucket__gte=start).delete()
+        rollups = Rollup.objects.bulk_create(
+            [Rollup(period=period, bucket=bucket, **counters.get((period, bucket), {})) for period, bucket in keys],
+            batch_size=500,
+        )
+        ids = {(r.period, r.bucket): r.pk for r in Rollup.objects.filter(bucket__gte=start)}
+        LatencyBucket.objects.bulk_create(
+            [
+                LatencyBucket(rollup_id=ids[key], metric=metric, index=index, count=count)
+                for (key, metric, index), count in sketches.items()
+            ],
+            batch_size=500,
+        )
+    reset_cache()
+    return len(rollups)
@@ -0,0 +1,55 @@
+"""
+Log-bucket latency sketch (the DDSketch idea).
+
+A latency in milliseconds goes to bucket ``ceil(log_gamma(ms))``; every value
+in a bucket is within ``DASHBOARD_SKETCH_ACCURACY`` (relative) of the
+bucket's representative value. A sketch is just {index: count}, so two
+sketches merge by adding counts, and its size depends only on the range of
+latencies (about 150 buckets from 1 ms to 1 hour at 5%), not on how many
+were observed.
+"""
+import math
+
+from django.conf import settings
+
+
+def _gamma():
+    accuracy = settings.DASHBOARD_SKETCH_ACCURACY
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def bucket_index(ms):
+    """Bucket of a latency; everything up to 1 ms shares bucket 0."""
+    if ms <= 1:
+        return 0
+    return math.ceil(math.log(ms) / math.log(_gamma()))
+
+
+def bucket_value(index):
+    """Representative latency of a bucket (the relative-error midpoint)."""
+    if index <= 0:
+        return 1.0
+    gamma = _gamma()
+    return 2 * gamma ** index / (gamma + 1)
+
+
+def merge(*sketches):
+    merged = {}
+    for sketch in sketches:
+        for index, count in sketch.items():
+            merged[index] = merged.get(index, 0) + count
+    return merged
+
+
+def quantile(sketch, q):
+    """Latency (ms) at quantile ``q`` (0..1) of a {index: count} sketch; None when empty."""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index in sorted(sketch):
+        seen += sketch[index]
+        if seen > rank:
+            return round(bucket_value(index), 1)
+    return round(bucket_value(max(sketch)), 1)
@@ -1,3 +1,132 @@
+import random
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import OperationalError
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.core.testing import BudgetTestMixin
+from apps.dashboard import rollups, sketch
+from apps.dashboard.models import LatencyBucket, Rollup
+from apps.dashboard.views import COUNTER_FIELDS
+from apps.funnerlife.models import FunnerlifeTransaction
+from apps.funnerlife.services import claim_charges, transition
+from apps.salla.models import SallaOrder, WebhookEvent
+from apps.salla.webhooks import record_success
+
+# The rollup row and its latency buckets, whatever the traffic.
+SUMMARY_QUERY_BUDGET = 2
+SERIES_QUERY_BUDGET = 2
+
+
+class SketchTests(TestCase):
+    def test_quantiles_within_accuracy(self):
+        rng = random.Random(1)
+        values = sorted(rng.lognormvariate(5, 1) for _ in range(20_000))
+        counts = {}
+        for ms in values:
+            index = sketch.bucket_index(ms)
+            counts[index] = counts.get(index, 0) + 1
+
+        for q in [0.5, 0.95, 0.99]:
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(counts, q), exact, delta=exact * 0.06)
+
+        halves = [{}, {}]
+        for i, ms in enumerate(values):
+            index = sketch.bucket_index(ms)
+            halves[i % 2][index] = halves[i % 2].get(index, 0) + 1
+        self.assertEqual(sketch.merge(*halves), counts)
+
+
+class DashboardTests(BudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        rollups.reset_cache()
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+
+    def charge_order(self, order_id, outcomes):
+        order = SallaOrder.objects.create(order_id=order_id, full_payload={}, standard_status="paid")
+        rollups.record(orders=1)
+        trxs = claim_charges(order, {f"sku-{i}": "123" for i in range(len(outcomes))})
+        for trx, status in zip(trxs.values(), outcomes):
+            if status:
+                transition([trx], status)
+
+        event = WebhookEvent.objects.create(event_id=f"evt-{order_id}", event_type="order.created", payload={})
+        record_success([event], {"fetch_path": "payload"})
+
+    def test_rollups_follow_the_writes(self):
+        Status = FunnerlifeTransaction.Status
+        self.charge_order(1, [Status.SUCCESS, Status.SUCCESS, Status.FAILED])
+        self.charge_order(2, [Status.SUCCESS, None])
+
+        with self.assertMaxQueries(SUMMARY_QUERY_BUDGET):
+            body = self.api.get("/api/dashboard/summary/").json()
+        self.assertEqual(body["orders"], 2)
+        self.assertEqual(body["webhooks_processed"], 2)
+        self.assertEqual(body["charges"], 5)
+        self.assertEqual((body["charges_succeeded"], body["charges_failed"]), (3, 1))
+        self.assertEqual(body["charge_success_rate"], 0.75)
+        self.assertIsNotNone(body["charge_latency_ms"]["p95"])
+        self.assertIsNotNone(body["webhook_latency_ms"]["p50"])
+
+        with self.assertMaxQueries(SERIES_QUERY_BUDGET):
+            series = self.api.get("/api/dashboard/series/?period=hour&limit=48").json()
+        self.assertEqual(len(series["buckets"]), 48)
+        self.assertEqual(series["buckets"][0]["charges"], 5)
+        self.assertEqual(series["buckets"][1]["charges"], 0)
+
+        # Rebuilding from the source tables gives the same counters.
+        fields = ["period", "bucket", *COUNTER_FIELDS]
+        incremental = list(Rollup.objects.order_by("period").values(*fields))
+        sketches = sorted(LatencyBucket.objects.filter(metric="charge").values_list("rollup__period", "index", "count"))
+        rollups.rebuild(timezone.now() - timedelta(days=1))
+        self.assertEqual(list(Rollup.objects.order_by("period").values(*fields)), incremental)
+        self.assertEqual(
+            sorted(LatencyBucket.objects.filter(metric="charge").values_list("rollup__period", "index", "count")),
+            sketches,
+        )
+
+    def test_summary_of_an_empty_day(self):
+        body = self.api.get("/api/dashboard/summary/?date=2020-01-01").json()
+        self.assertEqual(body["orders"], 0)
+        self.assertIsNone(body["charge_success_rate"])
+        self.assertEqual(self.api.get("/api/dashboard/summary/?date=yesterday").status_code, 400)
+
+
+class RollupBatchTests(TestCase):
+    """batched() writes its records when the block ends, even a failing one, and never masks its error."""
+
+    def setUp(self):
+        rollups.reset_cache()
+
+    def test_failing_block_is_still_counted(self):
+        with self.assertRaisesMessage(ValueError, "upstream down"):
+            with rollups.batched():
+                rollups.record(webhooks_failed=1)
+                raise ValueError("upstream down")
+        self.assertEqual(Rollup.objects.get(period="day").webhooks_failed, 1)
+
+    def test_flush_error_does_not_replace_the_blocks_error(self):
+        with mock.patch.object(rollups, "_write", side_effect=OperationalError("database is locked")):
+            with self.assertLogs("apps.dashboard.rollups", "ERROR") as logs:
+                with self.assertRaisesMessage(ValueError, "upstream down"):
+                    with rollups.batched():
+                        rollups.record(webhooks_failed=1)
+                        raise ValueError("upstream down")
+        self.assertIn("database is locked", logs.output[0])
 
-# Create your tests here.
+    def test_flush_error_does_not_fail_a_successful_block(self):
+        with mock.patch.object(rollups, "_write", side_effect=OperationalError("database is locked")):
+            with self.assertLogs("apps.dashboard.rollups", "ERROR"):
+                with rollups.batched():
+                    rollups.record(orders=1)
+        self.assertFalse(Rollup.objects.exists())
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("summary/", views.summary, name="dashboard-summary"),
+    path("series/", views.series, name="dashboard-series"),
+]
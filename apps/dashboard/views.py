@@ -1,3 +1,97 @@
-from django.shortcuts import render
+from datetime import datetime, time, timedelta
 
-# Create your views here.
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from .models import LatencyBucket, Rollup
+from .rollups import bucket_starts
+from .sketch import quantile
+
+COUNTER_FIELDS = [
+    "orders", "webhooks_processed", "webhooks_failed",
+    "charges", "charges_succeeded", "charges_failed", "charges_refunded",
+]
+# How far back /series/ goes, per period.
+MAX_BUCKETS = {Rollup.Period.HOUR: 7 * 24, Rollup.Period.DAY: 90}
+
+
+def load_sketches(rollup_ids):
+    """{rollup id: {metric: {index: count}}} in one query."""
+    sketches = {}
+    rows = LatencyBucket.objects.filter(rollup_id__in=rollup_ids, count__gt=0).values_list(
+        "rollup_id", "metric", "index", "count",
+    )
+    for rollup_id, metric, index, count in rows:
+        sketches.setdefault(rollup_id, {}).setdefault(metric, {})[index] = count
+    return sketches
+
+
+def rollup_body(bucket, rollup, sketches):
+    counters = {field: getattr(rollup, field) if rollup else 0 for field in COUNTER_FIELDS}
+    finished = counters["charges_succeeded"] + counters["charges_failed"]
+    body = {"bucket": bucket.isoformat(), **counters}
+    body["charge_success_rate"] = round(counters["charges_succeeded"] / finished, 4) if finished else None
+    for metric in LatencyBucket.Metric.values:
+        sketch = sketches.get(metric, {})
+        body[f"{metric}_latency_ms"] = {"p50": quantile(sketch, 0.5), "p95": quantile(sketch, 0.95)}
+    return body
+
+
+@api_view(["GET"])
+def summary(request):
+    """
+    Dashboard tiles for one day (default today): orders, webhooks processed /
+    failed, charges and their success rate, median / p95 webhook and charge
+    latency. Reads the day's rollup, never the order or transaction tables.
+
+    Query params: date (YYYY-MM-DD).
+    """
+    day = bucket_starts(timezone.now())[1]
+    if request.GET.get("date"):
+        try:
+            date = datetime.strptime(request.GET["date"], "%Y-%m-%d")
+        except ValueError:
+            return Response({"error": "date must be YYYY-MM-DD"}, status=400)
+        day = timezone.make_aware(date)
+
+    rollup = Rollup.objects.filter(period=Rollup.Period.DAY, bucket=day).first()
+    sketches = load_sketches([rollup.pk]).get(rollup.pk, {}) if rollup else {}
+    return Response(rollup_body(day, rollup, sketches))
+
+
+@api_view(["GET"])
+def series(request):
+    """
+    The last ``limit`` hours or days, newest first, with the same numbers as
+    summary(); buckets without traffic are zeros.
+
+    Query params: period (hour / day, default hour), limit (default 24).
+    """
+    period = request.GET.get("period", Rollup.Period.HOUR)
+    if period not in MAX_BUCKETS:
+        return Response({"error": "period must be hour or day"}, status=400)
+    try:
+        limit = min(max(int(request.GET.get("limit", 24)), 1), MAX_BUCKETS[period])
+    except ValueError:
+        return Response({"error": "limit must be a number"}, status=400)
+
+    hour, day = bucket_starts(timezone.now())
+    if period == Rollup.Period.HOUR:
+        buckets = [bucket_starts(hour - timedelta(hours=i))[0] for i in range(limit)]
+    else:
+        # By calendar date, so a DST change doesn't skip or repeat a day.
+        buckets = [
+            timezone.make_aware(datetime.combine(day.date() - timedelta(days=i), time()))
+            for i in range(limit)
+        ]
+
+    rollups = {r.bucket: r for r in Rollup.objects.filter(period=period, bucket__gte=buckets[-1])}
+    sketches = load_sketches([r.pk for r in rollups.values()])
+    return Response({
+        "period": period,
+        "buckets": [
+            rollup_body(bucket, rollups.get(bucket), sketches.get(rollups[bucket].pk, {}) if bucket in rollups else {})
+            for bucket in buckets
+        ],
+    })
@@ -1,10 +1,14 @@
+import logging
 import os
 import uuid
 
-import requests
 from django.conf import settings
+from apps.core.http import get_transport, get_async_transport
+from apps.core.resilience import call, acall
 from apps.salla.services import extract_player_id, build_target, extract_zone_id
 
+logger = logging.getLogger(__name__)
+
 
 class FunnerLifeAPIClient:
     BASE_URL = os.getenv("FUNNERLIFE_API_BASE")
@@ -16,30 +20,33 @@ class FunnerLifeAPIClient:
         payload = {"api_key": cls.API_KEY}
 
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = call("funnerlife.services", url, lambda: get_transport().post(url, json=payload, timeout=10))
             response.raise_for_status()
             data = response.json()
             if data.get("status") is True:
                 return data["data"]
             else:
-                print(f"FunnerLife API Error: {data.get('msg')}")
+                logger.warning("FunnerLife API error: %s", data.get("msg"))
                 return []
         except Exception as e:
-            print(f"Error fetching services: {e}")
+            logger.warning("Error fetching FunnerLife services: %s", e)
             return None
 
 
-def charge_funnerlife(item, funner_service):
+ORDER_URL = settings.FUNNERLIFE_ORDER_URL
+
+
+def _charge_payload(item, funner_service, idtrx=None):
     player_id = extract_player_id(item)
     zone_id = extract_zone_id(item)
 
-    target = build_target(player_id, zone_id)
+    target = build_target(player_id, zone_id, funner_service)
 
     service_id = item["sku"]
     kontak = settings.ADMIN_KONTAK
-    idtrx = str(uuid.uuid4())
+    idtrx = idtrx or str(uuid.uuid4())
 
-    payload = {
+    return {
         "api_key": settings.FUNNERLIFE_API_KEY,
         "service_id": service_id,
         "target": target,
@@ -48,16 +55,32 @@ def charge_funnerlife(item, funner_service):
         "callback": settings.FUNNERLIFE_CALLBACK_URL,
     }
 
-    response = requests.post("https://api.funnerlife.id/order", data=payload, timeout=20)
 
+def _charge_result(payload, response):
     try:
         resp_json = response.json()
     except Exception:
         resp_json = {"raw": response.text}
 
     return {
-        "idtrx": idtrx,
+        "idtrx": payload["idtrx"],
         "request_payload": payload,
         "response_payload": resp_json,
         "http_status": response.status_code,
     }
+
+
+def charge_funnerlife(item, funner_service, idtrx=None):
+    # Retries resend the same payload, so FunnerLife sees one idtrx per item
+    # however many attempts it took.
+    payload = _charge_payload(item, funner_service, idtrx)
+    response = call("funnerlife.charge", ORDER_URL, lambda: get_transport().post(ORDER_URL, data=payload, timeout=20))
+    return _charge_result(payload, response)
+
+
+async def acharge_funnerlife(item, funner_service, idtrx=None):
+    payload = _charge_payload(item, funner_service, idtrx)
+    response = await acall(
+        "funnerlife.charge", ORDER_URL, lambda: get_async_transport().post(ORDER_URL, data=payload, timeout=20)
+    )
+    return _charge_result(payload, response)
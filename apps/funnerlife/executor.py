@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class ChargeExecutor:
+    """
+    Runs outbound charge calls in parallel.
+
+    The thread pool size is the global cap (shared by every order processed
+    in this process); each provider additionally gets its own semaphore so
+    one upstream can't take all the slots.
+    """
+
+    def __init__(self, max_workers=None, provider_limits=None):
+        self.max_workers = max_workers or settings.CHARGE_MAX_CONCURRENCY
+        self.provider_limits = provider_limits or settings.CHARGE_PROVIDER_CONCURRENCY
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="charge")
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        # Same caps for coroutine calls, per event loop (asyncio primitives
+        # belong to one loop).
+        self._async_semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, provider):
+        with self._lock:
+            if provider not in self._semaphores:
+                limit = self.provider_limits.get(provider, self.max_workers)
+                self._semaphores[provider] = threading.BoundedSemaphore(limit)
+            return self._semaphores[provider]
+
+    def submit(self, provider, fn, *args, **kwargs):
+        """
+        Schedule one call. Blocks while ``provider`` is at its cap: the slot
+        is taken on the caller's thread, so calls waiting for a busy
+        provider never hold a pool thread (a global slot) meanwhile.
+        """
+        semaphore = self._semaphore(provider)
+        semaphore.acquire()
+        try:
+            # Charges log under the caller's correlation ID.
+            future = self.pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: semaphore.release())
+        return future
+
+    def run(self, provider, calls):
+        """
+        Run ``calls`` (a list of ``(fn, args, kwargs)``) and wait for all of
+        them. Returns ``(result, error)`` per call, in input order; a failing
+        call never affects the others.
+        """
+        futures = [self.submit(provider, fn, *args, **kwargs) for fn, args, kwargs in calls]
+
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    def _async_limits(self, provider):
+        limits = self._async_semaphores.setdefault(asyncio.get_running_loop(), {})
+        if None not in limits:
+            limits[None] = asyncio.Semaphore(self.max_workers)
+        if provider not in limits:
+            limits[provider] = asyncio.Semaphore(self.provider_limits.get(provider, self.max_workers))
+        return limits[None], limits[provider]
+
+    async def arun(self, provider, calls):
+        """run() for coroutine functions, awaited on the running event loop."""
+        total, per_provider = self._async_limits(provider)
+
+        async def call(fn, args, kwargs):
+            # Provider first: waiting for it must not hold a global slot.
+            async with per_provider, total:
+                return await fn(*args, **kwargs)
+
+        results = await asyncio.gather(
+            *(call(fn, args, kwargs) for fn, args, kwargs in calls), return_exceptions=True
+        )
+        return [(None, r) if isinstance(r, Exception) else (r, None) for r in results]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_charge_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ChargeExecutor()
+    return _executor
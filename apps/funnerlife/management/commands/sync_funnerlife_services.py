@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.funnerlife.services import catalog_is_stale, refresh_services
+
+
+class Command(BaseCommand):
+    help = "Refresh the FunnerLife service catalog (run from a scheduled task)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true",
+                            help="Sync even if the catalog is not stale yet.")
+
+    def handle(self, *args, **options):
+        if not options["force"] and not catalog_is_stale():
+            self.stdout.write("Catalog is fresh, nothing to do.")
+            return
+
+        run = refresh_services()
+        if run is None:
+            self.stderr.write("FunnerLife unreachable; kept the current catalog.")
+            return
+
+        self.stdout.write(
+            f"Synced: +{run.added} ~{run.updated} -{run.removed} "
+            f"({run.unchanged} unchanged), timings {run.timings_ms} ms"
+        )
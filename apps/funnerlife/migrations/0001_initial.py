@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('salla', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnerLifeService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_id', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('price_gold', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('price_silver', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('price_pro', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('status', models.CharField(max_length=20)),
+                ('last_synced_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FunnerlifeTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idtrx', models.CharField(max_length=255, unique=True)),
+                ('sku', models.CharField(max_length=255)),
+                ('target', models.CharField(max_length=255)),
+                ('response', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='salla.sallaorder')),
+            ],
+        ),
+    ]
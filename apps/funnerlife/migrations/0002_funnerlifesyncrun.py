@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('funnerlife', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnerLifeSyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('added', models.PositiveIntegerField(default=0)),
+                ('updated', models.PositiveIntegerField(default=0)),
+                ('removed', models.PositiveIntegerField(default=0)),
+                ('unchanged', models.PositiveIntegerField(default=0)),
+                ('timings_ms', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('funnerlife', '0002_funnerlifesyncrun'),
+        ('salla', '0002_webhookevent_queue_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='funnerlifetransaction',
+            name='response',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddConstraint(
+            model_name='funnerlifetransaction',
+            constraint=models.UniqueConstraint(fields=('order', 'sku'), name='uniq_funnerlife_trx_order_sku'),
+        ),
+    ]
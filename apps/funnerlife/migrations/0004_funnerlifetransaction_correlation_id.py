@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('funnerlife', '0003_funnerlifetransaction_order_sku_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='funnerlifetransaction',
+            name='correlation_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
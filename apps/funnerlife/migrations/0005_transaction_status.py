@@ -0,0 +1,108 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models, transaction
+
+# Callback "status" values (lowercased) -> transaction status, as at this migration.
+CALLBACK_STATUSES = {
+    "sukses": "SUCCESS", "success": "SUCCESS", "berhasil": "SUCCESS",
+    "gagal": "FAILED", "failed": "FAILED", "batal": "FAILED", "error": "FAILED",
+    "refund": "REFUNDED", "refunded": "REFUNDED",
+    "pending": "PENDING", "proses": "PENDING", "diproses": "PENDING", "process": "PENDING",
+}
+
+
+def callback_status(data):
+    return CALLBACK_STATUSES.get(str(data.get("status") or "").strip().lower(), "")
+
+
+def backfill_statuses(apps, schema_editor):
+    """
+    Move callbacks kept in response["callback"] to FunnerlifeCallback rows and
+    derive each transaction's status: the callback's, FAILED for a rejected
+    charge, else PENDING.
+    """
+    FunnerlifeTransaction = apps.get_model("funnerlife", "FunnerlifeTransaction")
+    FunnerlifeCallback = apps.get_model("funnerlife", "FunnerlifeCallback")
+    last_pk = 0
+    while True:
+        trxs = list(FunnerlifeTransaction.objects.filter(pk__gt=last_pk).order_by("pk")[:500])
+        if not trxs:
+            return
+        last_pk = trxs[-1].pk
+
+        with transaction.atomic():
+            for trx in trxs:
+                response = trx.response or {}
+                callback = response.pop("callback", None)
+                status = callback_status(callback) if isinstance(callback, dict) else ""
+                if not status and "status" in response and response["status"] is not True:
+                    status = "FAILED"
+                if isinstance(callback, dict):
+                    FunnerlifeCallback.objects.create(
+                        transaction=trx, payload=callback, status=status,
+                        applied=bool(status) and status != "PENDING", received_at=trx.created_at,
+                    )
+                FunnerlifeTransaction.objects.filter(pk=trx.pk).update(
+                    response=response, status=status or "PENDING", updated_at=trx.created_at,
+                )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('funnerlife', '0004_funnerlifetransaction_correlation_id'),
+        ('salla', '0007_webhookevent_correlation_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnerlifeCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(blank=True, choices=[('PENDING', 'Pending'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('REFUNDED', 'Refunded')], default='', max_length=20)),
+                ('applied', models.BooleanField(default=False)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='funnerlifetransaction',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='funnerlifetransaction',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('REFUNDED', 'Refunded')], default='PENDING', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='funnerlifetransaction',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='funnerlifetransaction',
+            index=models.Index(fields=['status', 'created_at'], name='funnerlife_trx_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='funnerlifetransaction',
+            index=models.Index(fields=['updated_at'], name='funnerlife_trx_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='funnerlifetransaction',
+            index=models.Index(fields=['status', 'latency_ms'], name='funnerlife_trx_latency_idx'),
+        ),
+        migrations.AddField(
+            model_name='funnerlifecallback',
+            name='transaction',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='callbacks', to='funnerlife.funnerlifetransaction'),
+        ),
+        migrations.AddIndex(
+            model_name='funnerlifecallback',
+            index=models.Index(fields=['transaction', 'received_at'], name='funnerlife_callback_trx_idx'),
+        ),
+        migrations.RunPython(backfill_statuses, migrations.RunPython.noop),
+    ]
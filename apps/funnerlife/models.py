@@ -16,10 +16,66 @@ class FunnerLifeService(models.Model):
     def __str__(self):
         return f"{self.name} ({self.category})"
 
+class FunnerLifeSyncRun(models.Model):
+    """One catalog sync: what it changed and how long each phase took."""
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    added = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    timings_ms = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Sync {self.started_at:%Y-%m-%d %H:%M} (+{self.added} ~{self.updated} -{self.removed})"
+
 class FunnerlifeTransaction(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "PENDING"    # claimed / charge accepted, waiting for the callback
+        SUCCESS = "SUCCESS"
+        FAILED = "FAILED"      # charge rejected, or the callback said so
+        REFUNDED = "REFUNDED"
+
     idtrx = models.CharField(max_length=255, unique=True)
     order = models.ForeignKey("salla.SallaOrder", on_delete=models.CASCADE)
     sku = models.CharField(max_length=255)
     target = models.CharField(max_length=255)
-    response = models.JSONField()
+    response = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Correlation ID of the webhook that caused the charge; adopted by its callback.
+    correlation_id = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    # Only ever changed by conditional UPDATEs (see apps/funnerlife/services.py).
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Charge to first final status (SUCCESS / FAILED / REFUNDED).
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # One charge per order line: the row is inserted as a claim before
+            # FunnerLife is called, so concurrent workers can't both charge.
+            models.UniqueConstraint(fields=["order", "sku"], name="uniq_funnerlife_trx_order_sku"),
+        ]
+        indexes = [
+            # Success rate per period and the oldest PENDING charge.
+            models.Index(fields=["status", "created_at"], name="funnerlife_trx_status_idx"),
+            models.Index(fields=["updated_at"], name="funnerlife_trx_updated_idx"),
+            # Latency percentiles per final status.
+            models.Index(fields=["status", "latency_ms"], name="funnerlife_trx_latency_idx"),
+        ]
+
+
+class FunnerlifeCallback(models.Model):
+    """A FunnerLife callback as received. Rows are only ever inserted."""
+    transaction = models.ForeignKey(FunnerlifeTransaction, on_delete=models.CASCADE, related_name="callbacks")
+    payload = models.JSONField()
+    # The transaction status the callback reported ("" if not recognised), and
+    # whether it moved the transaction there (False for repeats and late callbacks).
+    status = models.CharField(max_length=20, choices=FunnerlifeTransaction.Status.choices, blank=True, default="")
+    applied = models.BooleanField(default=False)
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction", "received_at"], name="funnerlife_callback_trx_idx"),
+        ]
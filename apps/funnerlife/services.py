@@ -1,8 +1,21 @@
+import logging
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.db import connection, transaction
 from django.utils import timezone
 from datetime import timedelta
-from .models import FunnerLifeService
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from .models import FunnerLifeService, FunnerLifeSyncRun, FunnerlifeTransaction, FunnerlifeCallback
 from .client import FunnerLifeAPIClient
 from django.conf import settings
+from apps.core.logs import get_correlation_id
+from apps.dashboard import rollups
+
+logger = logging.getLogger(__name__)
 
 
 ALLOWED_CATEGORIES = [
@@ -14,44 +27,283 @@ ALLOWED_CATEGORIES = [
     "Marvel Rivals",
 ]
 
+SYNC_FIELDS = ["name", "category", "price", "price_gold", "price_silver", "price_pro", "status"]
 
-def fetch_and_cache_services(force_refresh=False):
-    """Fetch services from FunnerLife and cache them for 5 days."""
 
-    # Check if data is recent enough
-    latest = FunnerLifeService.objects.order_by('-last_synced_at').first()
-    if latest and not force_refresh:
-        diff = timezone.now() - latest.last_synced_at
-        if diff.days < 5:
-            print(" Using cached FunnerLife services.")
-            return FunnerLifeService.objects.filter(category__in=ALLOWED_CATEGORIES)
+def _price(value):
+    if value is None or value == "":
+        return None
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def _service_fields(s):
+    """Map one FunnerLife /service entry onto FunnerLifeService fields."""
+    return {
+        "name": s["nama_layanan"],
+        "category": s["kategori"],
+        "price": _price(s["harga"]),
+        "price_gold": _price(s.get("harga_gold")),
+        "price_silver": _price(s.get("harga_silver")),
+        "price_pro": _price(s.get("harga_pro")),
+        "status": s["status"],
+    }
+
+
+def sync_services(services_data):
+    """
+    Apply a FunnerLife /service response to the local catalog.
+
+    Existing rows are loaded once and diffed in memory; the result is written
+    with one bulk insert, one bulk update and one delete inside a single
+    transaction. Returns the saved FunnerLifeSyncRun (counts + phase timings).
+    """
+    run = FunnerLifeSyncRun(started_at=timezone.now())
+    timings = {}
+    now = timezone.now()
+
+    t = time.perf_counter()
+    existing = {svc.service_id: svc for svc in FunnerLifeService.objects.all()}
+    timings["load"] = round((time.perf_counter() - t) * 1000, 2)
+
+    t = time.perf_counter()
+    incoming = {
+        str(s["id"]): _service_fields(s)
+        for s in services_data
+        if s["kategori"] in ALLOWED_CATEGORIES
+    }
+
+    to_create, to_update = [], []
+    for service_id, fields in incoming.items():
+        current = existing.get(service_id)
+        if current is None:
+            to_create.append(FunnerLifeService(service_id=service_id, last_synced_at=now, **fields))
+            continue
+
+        changed = False
+        for name, value in fields.items():
+            if getattr(current, name) != value:
+                setattr(current, name, value)
+                changed = True
+        if changed:
+            current.last_synced_at = now
+            to_update.append(current)
+
+    removed_ids = [service_id for service_id in existing if service_id not in incoming]
+    timings["diff"] = round((time.perf_counter() - t) * 1000, 2)
+
+    t = time.perf_counter()
+    with transaction.atomic():
+        FunnerLifeService.objects.bulk_create(to_create, batch_size=500)
+        FunnerLifeService.objects.bulk_update(to_update, SYNC_FIELDS + ["last_synced_at"], batch_size=500)
+        if removed_ids:
+            FunnerLifeService.objects.filter(service_id__in=removed_ids).delete()
+
+        run.added = len(to_create)
+        run.updated = len(to_update)
+        run.removed = len(removed_ids)
+        run.unchanged = len(incoming) - len(to_create) - len(to_update)
+        run.finished_at = timezone.now()
+        timings["apply"] = round((time.perf_counter() - t) * 1000, 2)
+        run.timings_ms = timings
+        run.save()
 
-    print("Fetching latest FunnerLife services...")
+    return run
+
+
+def refresh_services():
+    """
+    Pull /service from FunnerLife and sync it. Returns the FunnerLifeSyncRun,
+    or None when the upstream call failed (the current catalog is kept).
+    """
+    logger.info("Fetching latest FunnerLife services")
     services_data = FunnerLifeAPIClient.get_services()
 
-    filtered = [s for s in services_data if s["kategori"] in ALLOWED_CATEGORIES]
-    current_ids = list(FunnerLifeService.objects.values_list("service_id", flat=True))
-    new_ids = [s["id"] for s in filtered]
-
-    # Create or update
-    for s in filtered:
-        FunnerLifeService.objects.update_or_create(
-            service_id=s["id"],
-            defaults={
-                "name": s["nama_layanan"],
-                "category": s["kategori"],
-                "price": s["harga"],
-                "price_gold": s.get("harga_gold"),
-                "price_silver": s.get("harga_silver"),
-                "price_pro": s.get("harga_pro"),
-                "status": s["status"],
-                "last_synced_at": timezone.now(),
-            }
-        )
+    # None = request failed, [] = API error: never wipe the last good catalog.
+    if not services_data:
+        _catalog_state["failed_at"] = time.monotonic()
+        logger.warning("FunnerLife services unavailable, keeping the current catalog")
+        return None
+
+    run = sync_services(services_data)
+    _catalog_state["synced_at"] = run.finished_at
+    _catalog_state["checked_at"] = time.monotonic()
 
-    # Delete old ones not in the latest set
-    FunnerLifeService.objects.exclude(service_id__in=new_ids).delete()
+    logger.info(
+        "Synced FunnerLife services: +%s ~%s -%s (%s unchanged)", run.added, run.updated, run.removed, run.unchanged,
+        extra={"timings_ms": run.timings_ms},
+    )
+    return run
 
-    print(f" Synced {len(filtered)} services.")
+
+def get_cached_services():
+    """The local catalog (allowed categories only); never touches the network."""
     return FunnerLifeService.objects.filter(category__in=ALLOWED_CATEGORIES)
 
+
+def get_services_by_sku(skus):
+    """Resolve order item SKUs to catalog services in one query: {sku: service}."""
+    return FunnerLifeService.objects.in_bulk(set(skus), field_name="service_id")
+
+
+def get_charged_skus(salla_order):
+    """SKUs of this order that already have a FunnerLife transaction (one query)."""
+    return set(FunnerlifeTransaction.objects.filter(order=salla_order).values_list("sku", flat=True))
+
+
+def claim_charges(salla_order, targets):
+    """
+    Insert the transaction rows for an order's SKUs before FunnerLife is called.
+
+    ``targets`` maps sku -> target. Rows are inserted in one statement that
+    skips (order, sku) pairs already claimed by another worker; returns
+    {sku: FunnerlifeTransaction} for the claims this call won.
+    """
+    if not targets:
+        return {}
+
+    correlation_id = get_correlation_id() or ""
+    rows = [
+        FunnerlifeTransaction(
+            idtrx=str(uuid.uuid4()), order=salla_order, sku=sku, target=target, correlation_id=correlation_id,
+        )
+        for sku, target in targets.items()
+    ]
+    FunnerlifeTransaction.objects.bulk_create(rows, ignore_conflicts=True)
+
+    won = {trx.sku: trx for trx in FunnerlifeTransaction.objects.filter(idtrx__in=[row.idtrx for row in rows])}
+    rollups.record(charges=len(won))
+    return won
+
+
+Status = FunnerlifeTransaction.Status
+
+# Statuses a transaction may move to, and from which. SUCCESS / FAILED are
+# final except for a refund; a repeated or late callback changes nothing.
+TRANSITIONS = {
+    Status.SUCCESS: [Status.PENDING],
+    Status.FAILED: [Status.PENDING],
+    Status.REFUNDED: [Status.PENDING, Status.SUCCESS, Status.FAILED],
+}
+
+# Dashboard rollup counter per status reached.
+ROLLUP_FIELDS = {
+    Status.SUCCESS: "charges_succeeded",
+    Status.FAILED: "charges_failed",
+    Status.REFUNDED: "charges_refunded",
+}
+
+# Callback "status" values (lowercased) -> transaction status.
+CALLBACK_STATUSES = {
+    "sukses": Status.SUCCESS, "success": Status.SUCCESS, "berhasil": Status.SUCCESS,
+    "gagal": Status.FAILED, "failed": Status.FAILED, "batal": Status.FAILED, "error": Status.FAILED,
+    "refund": Status.REFUNDED, "refunded": Status.REFUNDED,
+    "pending": Status.PENDING, "proses": Status.PENDING, "diproses": Status.PENDING, "process": Status.PENDING,
+}
+
+
+def callback_status(data):
+    """The transaction status a callback reports, or "" when it isn't recognised."""
+    return CALLBACK_STATUSES.get(str(data.get("status") or "").strip().lower(), "")
+
+
+def transition(trxs, status, now=None):
+    """
+    Move ``trxs`` to ``status`` where TRANSITIONS allows it; returns the
+    number of rows changed.
+
+    One conditional UPDATE (``WHERE status IN <allowed sources>``): of two
+    racing callbacks only the first still finds the row in a source status,
+    so neither overwrites the other. ``latency_ms`` is set on the first move
+    out of PENDING and kept after that.
+    """
+    sources = TRANSITIONS.get(status)
+    if not sources or not trxs:
+        return 0
+    now = now or timezone.now()
+    # The rows of one order are claimed together, so they share created_at.
+    latency_ms = int(rollups.milliseconds(now - min(trx.created_at for trx in trxs)))
+    changed = FunnerlifeTransaction.objects.filter(pk__in=[trx.pk for trx in trxs], status__in=sources).update(
+        status=status, updated_at=now, latency_ms=Coalesce(F("latency_ms"), Value(latency_ms)),
+    )
+    # A refund keeps the latency of the status before it.
+    latencies = {"charge": [latency_ms] * changed} if status != Status.REFUNDED else None
+    rollups.record(now, latencies=latencies, **{ROLLUP_FIELDS[status]: changed})
+    return changed
+
+
+def record_callback(trx, data):
+    """Store a FunnerLife callback and apply the status it reports; returns the FunnerlifeCallback."""
+    status = callback_status(data)
+    now = timezone.now()
+    with transaction.atomic():
+        applied = bool(transition([trx], status, now)) if status else False
+        return FunnerlifeCallback.objects.create(
+            transaction=trx, payload=data, status=status, applied=applied, received_at=now,
+        )
+
+
+# Last known sync time, re-read from the DB every CATALOG_STALE_CHECK_INTERVAL
+# seconds so staleness checks don't cost a query per request.
+_catalog_state = {"synced_at": None, "checked_at": None, "failed_at": None}
+_refresh_lock = threading.Lock()
+
+
+def catalog_is_stale():
+    now = time.monotonic()
+    checked_at = _catalog_state["checked_at"]
+    if checked_at is None or now - checked_at >= settings.CATALOG_STALE_CHECK_INTERVAL:
+        latest = (
+            FunnerLifeSyncRun.objects.filter(finished_at__isnull=False)
+            .order_by("-finished_at").values_list("finished_at", flat=True).first()
+        )
+        _catalog_state["synced_at"] = latest
+        _catalog_state["checked_at"] = now
+
+    synced_at = _catalog_state["synced_at"]
+    return synced_at is None or timezone.now() - synced_at >= timedelta(days=settings.CATALOG_MAX_AGE_DAYS)
+
+
+def refresh_services_in_background():
+    """
+    Start a background catalog refresh if the catalog is stale.
+
+    Single-flight per process: while a refresh runs, further calls return
+    immediately. After an upstream failure, retries wait
+    CATALOG_RETRY_INTERVAL seconds. Returns True if a refresh was started.
+    """
+    if not catalog_is_stale():
+        return False
+
+    failed_at = _catalog_state["failed_at"]
+    if failed_at is not None and time.monotonic() - failed_at < settings.CATALOG_RETRY_INTERVAL:
+        return False
+
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            refresh_services()
+        except Exception:
+            _catalog_state["failed_at"] = time.monotonic()
+            logger.exception("Error refreshing FunnerLife services")
+        finally:
+            connection.close()
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name="funnerlife-catalog-refresh", daemon=True).start()
+    return True
+
+
+def fetch_and_cache_services(force_refresh=False):
+    """
+    Return the local catalog, refreshing it synchronously first when forced
+    or older than CATALOG_MAX_AGE_DAYS. Used by the scheduled sync command;
+    request handlers use get_cached_services() + refresh_services_in_background().
+    """
+    if force_refresh or catalog_is_stale():
+        refresh_services()
+    else:
+        logger.info("Using cached FunnerLife services")
+
+    return get_cached_services()
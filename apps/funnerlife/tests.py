@@ -1,3 +1,410 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.core.resilience import get_breaker
+from apps.core.testing import BudgetTestMixin, FakeResponse, FakeTransport, use_fake_transport
+from apps.funnerlife import views
+from apps.funnerlife.client import FunnerLifeAPIClient
+from apps.funnerlife.executor import ChargeExecutor
+from apps.funnerlife.models import FunnerLifeService, FunnerLifeSyncRun, FunnerlifeTransaction
+from apps.funnerlife.services import (
+    ALLOWED_CATEGORIES, _catalog_state, _refresh_lock, claim_charges, refresh_services,
+    refresh_services_in_background, sync_services,
+)
+from apps.dashboard import rollups
+from apps.salla.models import SallaOrder
+
+# The catalog freshness check, the services and, with counts=true, the
+# per-category counts. No upstream calls: a fresh catalog is served locally.
+SERVICE_LIST_QUERY_BUDGET = 3
+# Transaction lookup, savepoint pair, conditional UPDATE, callback INSERT and
+# the dashboard rollup writes (2, +1 when the latency lands in a new sketch bucket).
+CALLBACK_QUERY_BUDGET = 8
+# Load, savepoint pair, bulk insert, bulk update, delete and the sync run
+# INSERT (while each bulk write fits in one SQLite statement).
+SYNC_QUERY_BUDGET = 7
+
+
+def service_entry(i, price=1000, category="Free Fire", status="Aktif"):
+    """One entry of a FunnerLife /service response."""
+    return {
+        "id": 20_000 + i, "nama_layanan": f"Service {i}", "kategori": category,
+        "harga": price, "harga_gold": price - 10, "status": status,
+    }
+
+
+class ServiceListBudgetTests(BudgetTestMixin, TestCase):
+    """The service list is answered from the local catalog in a fixed number of queries."""
+
+    SERVICES = 5_000
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = ALLOWED_CATEGORIES[:5]
+        FunnerLifeService.objects.bulk_create(
+            [
+                FunnerLifeService(
+                    service_id=str(10_000 + i), name=f"Service {i}", category=categories[i % len(categories)],
+                    price=1000 + i, status="Aktif" if i % 10 else "Tidak Aktif",
+                )
+                for i in range(cls.SERVICES)
+            ],
+            batch_size=1000,
+        )
+        FunnerLifeSyncRun.objects.create(finished_at=timezone.now(), added=cls.SERVICES)
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        _catalog_state.update(checked_at=None, failed_at=None)
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+
+    def get(self, query=""):
+        response = self.api.get(f"/api/funnerlife/services/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_list_with_counts(self):
+        with use_fake_transport(FakeTransport({})) as transport:
+            with self.assertMaxQueries(SERVICE_LIST_QUERY_BUDGET):
+                body = self.get("?counts=true&sort=-price")
+
+        self.assertEqual(body["count"], self.SERVICES)
+        self.assertEqual(sum(c["total"] for c in body["category_counts"]), self.SERVICES)
+        self.assertEqual(transport.count(), 0)
+
+    def test_filtered_list(self):
+        with self.assertMaxQueries(SERVICE_LIST_QUERY_BUDGET):
+            body = self.get("?category=free%20fire&sort=name")
+        self.assertEqual(body["count"], self.SERVICES // 5)
+
+    def test_wall_time(self):
+        self.assertWallTime("funnerlife.service_list_5k", lambda: self.get("?counts=true"))
+
+
+class CatalogSyncTests(BudgetTestMixin, TestCase):
+    """A sync writes only the differences, in a fixed number of queries."""
+
+    def test_sync_applies_the_diff(self):
+        sync_services([service_entry(i) for i in range(10)])
+
+        incoming = [service_entry(i) for i in range(2, 10)]  # 0 and 1 are gone
+        incoming[0]["harga"] = 1500  # service 2: new price
+        incoming[1]["status"] = "Tidak Aktif"  # service 3: disabled
+        incoming += [service_entry(10), service_entry(11, category="Valorant")]  # one new, one not sold
+        run = sync_services(incoming)
+
+        self.assertEqual((run.added, run.updated, run.removed, run.unchanged), (1, 2, 2, 6))
+        self.assertEqual(FunnerLifeService.objects.count(), 9)
+        self.assertEqual(FunnerLifeService.objects.get(service_id="20002").price, 1500)
+        self.assertEqual(FunnerLifeService.objects.get(service_id="20003").status, "Tidak Aktif")
+        self.assertFalse(FunnerLifeService.objects.filter(service_id__in=["20000", "20001", "20011"]).exists())
+        self.assertEqual(set(run.timings_ms), {"load", "diff", "apply"})
+
+    def test_unchanged_services_are_not_written(self):
+        sync_services([service_entry(i) for i in range(5)])
+        synced_at = FunnerLifeService.objects.get(service_id="20000").last_synced_at
+
+        run = sync_services([service_entry(i) for i in range(5)])
+        self.assertEqual((run.added, run.updated, run.removed, run.unchanged), (0, 0, 0, 5))
+        self.assertEqual(FunnerLifeService.objects.get(service_id="20000").last_synced_at, synced_at)
+
+    def test_query_count_does_not_grow_with_the_catalog(self):
+        for count in [10, 100]:
+            with self.subTest(services=count):
+                FunnerLifeService.objects.all().delete()
+                sync_services([service_entry(i) for i in range(count // 2)])
+                incoming = [service_entry(i, price=2000) for i in range(count // 4, count)]
+                with self.assertMaxQueries(SYNC_QUERY_BUDGET):
+                    sync_services(incoming)
+
+    def test_failed_fetch_keeps_the_catalog(self):
+        breaker = get_breaker(urlsplit(f"{FunnerLifeAPIClient.BASE_URL}service").netloc)
+        self.addCleanup(breaker.record_success)
+        sync_services([service_entry(i) for i in range(3)])
+        for response in [FakeResponse(200, {"status": False, "msg": "maintenance"}), FakeResponse(500)]:
+            transport = FakeTransport({"service": lambda *args: response})
+            with self.subTest(status=response.status_code), use_fake_transport(transport):
+                self.assertIsNone(refresh_services())
+                self.assertGreater(transport.count(), 0)
+        self.assertEqual(FunnerLifeService.objects.count(), 3)
+
+
+@override_settings(CATALOG_MAX_AGE_DAYS=1, CATALOG_RETRY_INTERVAL=300)
+class StaleCatalogTests(TransactionTestCase):
+    """A stale catalog is still served while one background refresh replaces it."""
+
+    def setUp(self):
+        sync_services([service_entry(i) for i in range(3)])
+        FunnerLifeSyncRun.objects.update(finished_at=timezone.now() - timedelta(days=2))
+        _catalog_state.update(synced_at=None, checked_at=None, failed_at=None)
+        self.addCleanup(_catalog_state.update, synced_at=None, checked_at=None, failed_at=None)
+        breaker = get_breaker(urlsplit(f"{FunnerLifeAPIClient.BASE_URL}service").netloc)
+        self.addCleanup(breaker.record_success)
+
+        self.api = APIClient()
+        self.api.force_authenticate(user=User.objects.create_user("admin", is_staff=True))
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def upstream(self, response):
+        def service(*args):
+            self.release.wait(5)  # the refresh stays in flight until the test lets it finish
+            return response
+
+        return FakeTransport({"service": service})
+
+    def wait_for_refresh(self):
+        self.release.set()
+        self.assertTrue(_refresh_lock.acquire(timeout=5))
+        _refresh_lock.release()
+
+    def test_stale_catalog_is_served_while_one_refresh_runs(self):
+        fresh = FakeResponse(200, {"status": True, "data": [service_entry(i, price=2000) for i in range(4)]})
+        with use_fake_transport(self.upstream(fresh)) as transport:
+            response = self.api.get("/api/funnerlife/services/")
+            self.assertEqual((response.status_code, response.json()["count"]), (200, 3))
+            self.assertEqual({s["base_price"] for s in response.json()["results"]}, {1000})
+            # Still in flight: later requests neither wait nor start another refresh.
+            self.assertEqual(self.api.get("/api/funnerlife/services/").json()["count"], 3)
+            self.assertFalse(refresh_services_in_background())
+            self.wait_for_refresh()
+
+        self.assertEqual(transport.count("service"), 1)
+        self.assertEqual(set(FunnerLifeService.objects.values_list("price", flat=True)), {2000})
+        self.assertFalse(refresh_services_in_background())  # fresh now
+
+    def test_failed_refresh_waits_before_retrying(self):
+        with use_fake_transport(self.upstream(FakeResponse(200, {"status": False, "msg": "maintenance"}))) as transport:
+            self.assertTrue(refresh_services_in_background())
+            self.wait_for_refresh()
+            self.assertFalse(refresh_services_in_background())
+
+        self.assertIsNotNone(_catalog_state["failed_at"])
+        self.assertEqual(transport.count("service"), 1)
+        self.assertEqual(FunnerLifeService.objects.count(), 3)
+
+
+class ClaimTests(TransactionTestCase):
+    """Each (order, sku) is claimed by exactly one caller, however many race for it."""
+
+    def setUp(self):
+        self.order = SallaOrder.objects.create(order_id=1, full_payload={}, standard_status="paid")
+
+    def test_claimed_sku_is_not_claimed_again(self):
+        first = claim_charges(self.order, {"1001": "123", "1002": "456"})
+        self.assertEqual(set(first), {"1001", "1002"})
+
+        again = claim_charges(self.order, {"1002": "456", "1003": "789"})
+        self.assertEqual(set(again), {"1003"})
+        self.assertEqual(FunnerlifeTransaction.objects.count(), 3)
+
+    def test_concurrent_claims(self):
+        targets = {f"{1000 + i}": "123" for i in range(10)}
+        won, errors = [], []
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        won.extend(claim_charges(self.order, targets))
+                        return
+                    except OperationalError as e:
+                        # The in-memory test DB fails a concurrent writer instead of
+                        # waiting for the lock like a file database does.
+                        if "locked" not in str(e):
+                            raise
+                        time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(won), sorted(targets))
+        self.assertEqual(FunnerlifeTransaction.objects.count(), len(targets))
+
+    def test_duplicate_row_is_rejected(self):
+        FunnerlifeTransaction.objects.create(idtrx="trx-1", order=self.order, sku="1001", target="123")
+        with self.assertRaises(IntegrityError):
+            FunnerlifeTransaction.objects.create(idtrx="trx-2", order=self.order, sku="1001", target="123")
+
+
+class ChargeExecutorTests(SimpleTestCase):
+    """Charges run in parallel within the global and per-provider caps."""
+
+    def setUp(self):
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def charge(self, value):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if value < 0:
+            raise ValueError(value)
+        return value * 10
+
+    def executor(self, max_workers, provider_limits):
+        executor = ChargeExecutor(max_workers=max_workers, provider_limits=provider_limits)
+        self.addCleanup(executor.pool.shutdown)
+        return executor
+
+    async def acharge(self, value):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.02)
+        self.running -= 1
+        if value < 0:
+            raise ValueError(value)
+        return value * 10
+
+    def test_provider_cap(self):
+        executor = self.executor(6, {"funnerlife": 2})
+        executor.run("funnerlife", [(self.charge, (i,), {}) for i in range(8)])
+        self.assertEqual(self.peak, 2)
+
+    def test_global_cap(self):
+        executor = self.executor(3, {"funnerlife": 10})
+        executor.run("funnerlife", [(self.charge, (i,), {}) for i in range(8)])
+        self.assertEqual(self.peak, 3)
+
+    def test_saturated_provider_does_not_block_another(self):
+        executor = self.executor(2, {"slow": 1})
+        release = threading.Event()
+        # More calls than both global slots, all waiting on one provider's single slot.
+        slow = threading.Thread(target=executor.run, args=("slow", [(release.wait, (5,), {})] * 3))
+        self.addCleanup(slow.join)
+        self.addCleanup(release.set)
+        slow.start()
+        time.sleep(0.05)
+
+        future = executor.submit("fast", self.charge, 1)
+        self.assertEqual(future.result(timeout=1), 10)
+        self.assertFalse(release.is_set())
+
+    async def test_async_saturated_provider_does_not_block_another(self):
+        executor = self.executor(2, {"slow": 1})
+        release = asyncio.Event()
+        slow = asyncio.ensure_future(executor.arun("slow", [(release.wait, (), {})] * 3))
+        await asyncio.sleep(0.01)
+
+        outcomes = await asyncio.wait_for(executor.arun("fast", [(self.acharge, (1,), {})]), 1)
+        self.assertEqual(outcomes, [(10, None)])
+        release.set()
+        await slow
+
+    def test_failing_call_does_not_affect_the_others(self):
+        executor = self.executor(4, {})
+        outcomes = executor.run("funnerlife", [(self.charge, (i,), {}) for i in [1, -2, 3]])
+
+        self.assertEqual([result for result, _ in outcomes], [10, None, 30])
+        self.assertIsInstance(outcomes[1][1], ValueError)
+        self.assertEqual((outcomes[0][1], outcomes[2][1]), (None, None))
+
+    def test_async_caps(self):
+        executor = self.executor(3, {"funnerlife": 2})
+        outcomes = asyncio.run(executor.arun("funnerlife", [(self.acharge, (i,), {}) for i in [1, -2, 3, 4, 5]]))
+
+        self.assertEqual(self.peak, 2)
+        self.assertEqual([result for result, _ in outcomes], [10, None, 30, 40, 50])
+        self.assertIsInstance(outcomes[1][1], ValueError)
+
+
+class CallbackTests(BudgetTestMixin, TestCase):
+    """Callbacks move the transaction status only along allowed transitions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        order = SallaOrder.objects.create(order_id=1, full_payload={}, standard_status="paid")
+        cls.trx = FunnerlifeTransaction.objects.create(
+            idtrx="trx-1", order=order, sku="1001", target="123", response={"status": True},
+        )
+
+    def setUp(self):
+        rollups.record(orders=0, latencies={"charge": [1]})  # this hour's rollup rows
+
+    def callback(self, status):
+        with self.assertMaxQueries(CALLBACK_QUERY_BUDGET):
+            response = self.client.post(
+                "/api/funnerlife/callback/", {"idtrx": "trx-1", "status": status}, content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.trx.refresh_from_db()
+        return self.trx.callbacks.latest("id")
+
+    def test_transitions(self):
+        Status = FunnerlifeTransaction.Status
+        callback = self.callback("Sukses")
+        self.assertEqual((self.trx.status, callback.status, callback.applied), (Status.SUCCESS, Status.SUCCESS, True))
+        latency_ms = self.trx.latency_ms
+        self.assertIsNotNone(latency_ms)
+
+        # A late "failed" doesn't overwrite the final status; it is still kept.
+        callback = self.callback("Gagal")
+        self.assertEqual((self.trx.status, callback.applied), (Status.SUCCESS, False))
+
+        callback = self.callback("Refund")
+        self.assertEqual((self.trx.status, callback.applied, self.trx.latency_ms), (Status.REFUNDED, True, latency_ms))
+
+        callback = self.callback("something new")
+        self.assertEqual((self.trx.status, callback.status, callback.applied), (Status.REFUNDED, "", False))
+        self.assertEqual(self.trx.callbacks.count(), 4)
+        self.assertEqual(self.trx.response, {"status": True})
+
+
+# The ASGI callback view, whatever ASYNC_VIEWS the test settings have.
+urlpatterns = [path("api/funnerlife/callback/", views.afunnerlife_callback)]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCallbackTests(TestCase):
+    """afunnerlife_callback() answers like the sync view, on the async ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        order = SallaOrder.objects.create(order_id=1, full_payload={}, standard_status="paid")
+        FunnerlifeTransaction.objects.create(idtrx="trx-1", order=order, sku="1001", target="123")
+
+    def setUp(self):
+        rollups.record(orders=0, latencies={"charge": [1]})
+
+    async def callback(self, body):
+        return await self.async_client.post("/api/funnerlife/callback/", body, content_type="application/json")
+
+    async def test_callback_moves_the_status(self):
+        response = await self.callback({"idtrx": "trx-1", "status": "Sukses"})
+        self.assertEqual((response.status_code, response.json()), (200, {"received": True}))
+        trx = await FunnerlifeTransaction.objects.aget(idtrx="trx-1")
+        self.assertEqual(trx.status, FunnerlifeTransaction.Status.SUCCESS)
+        self.assertEqual(await trx.callbacks.acount(), 1)
+
+    async def test_unknown_transaction(self):
+        response = await self.callback({"idtrx": "nope", "status": "Sukses"})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_invalid_callbacks(self):
+        self.assertEqual((await self.callback("{not json")).status_code, 400)
+        self.assertEqual((await self.callback({"status": "Sukses"})).status_code, 400)
+        self.assertEqual((await self.async_client.get("/api/funnerlife/callback/")).status_code, 405)
+        self.assertFalse(await FunnerlifeTransaction.objects.filter(status=FunnerlifeTransaction.Status.SUCCESS).aexists())
@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path("services/", views.get_services, name="funnerlife-services"),
-    path("callback/", views.funnerlife_callback, name="funnerlife-callback"),
+    path(
+        "callback/",
+        views.afunnerlife_callback if settings.ASYNC_VIEWS else views.funnerlife_callback,
+        name="funnerlife-callback",
+    ),
 ]
@@ -1,17 +1,26 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .services import fetch_and_cache_services
+from .services import get_cached_services, record_callback, refresh_services_in_background
 from .models import FunnerLifeService, FunnerlifeTransaction
 from .filters import FunnerLifeServiceFilter
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
+import logging
+
+from apps.core.logs import set_correlation_id
+from apps.core.metrics import CALLBACKS
+
+logger = logging.getLogger(__name__)
 
 
 @api_view(["GET"])
 def get_services(request):
     """Return filtered, sorted FunnerLife services with optional counts."""
-    services_qs = fetch_and_cache_services()
+    # Always answer from the local catalog; a stale one is refreshed off-request.
+    refresh_services_in_background()
+    services_qs = get_cached_services()
 
     # Apply filters and sorting
     filters = FunnerLifeServiceFilter(services_qs, request.GET)
@@ -46,31 +55,86 @@ def get_services(request):
     return Response(response)
 
 
-@csrf_exempt
-def funnerlife_callback(request):
+def read_callback(request):
+    """Parse a callback POST; returns (data, error_response)."""
     if request.method != "POST":
-        return JsonResponse({"error": "POST only"}, status=405)
+        return None, JsonResponse({"error": "POST only"}, status=405)
 
     try:
         data = json.loads(request.body)
     except:
-        return JsonResponse({"error": "invalid json"}, status=400)
+        return None, JsonResponse({"error": "invalid json"}, status=400)
+
+    if not data.get("idtrx"):
+        return None, JsonResponse({"error": "missing idtrx"}, status=400)
+
+    return data, None
+
+
+def adopt_correlation_id(trx):
+    """Continue the charge's correlation ID (the webhook's) for the rest of the callback."""
+    if trx.correlation_id:
+        set_correlation_id(trx.correlation_id)
+
+
+def rejected_callback(error):
+    CALLBACKS.inc(result="invalid")
+    logger.warning("FunnerLife callback rejected", extra={"http_status": error.status_code})
+    return error
+
+
+def unknown_transaction(data):
+    CALLBACKS.inc(result="unknown_transaction")
+    logger.warning("FunnerLife callback for unknown transaction", extra={"idtrx": data["idtrx"]})
+    return JsonResponse({"error": "transaction not found"}, status=404)
+
+
+def stored_callback(trx, callback):
+    CALLBACKS.inc(result="stored")
+    logger.info(
+        "FunnerLife callback received",
+        extra={
+            "idtrx": trx.idtrx, "sku": trx.sku, "callback_status": callback.payload.get("status"),
+            "status": callback.status, "applied": callback.applied,
+        },
+    )
+    return JsonResponse({"received": True})
+
 
-    idtrx = data.get("idtrx")
-    status_ = data.get("status")
-    keterangan = data.get("keterangan", "")
+# What a callback needs of its transaction (not the stored charge response).
+CALLBACK_TRX_FIELDS = ["id", "idtrx", "sku", "created_at", "correlation_id"]
 
-    if not idtrx:
-        return JsonResponse({"error": "missing idtrx"}, status=400)
+
+@csrf_exempt
+def funnerlife_callback(request):
+    data, error = read_callback(request)
+    if error is not None:
+        return rejected_callback(error)
 
     # Lookup your transaction
     try:
-        trx = FunnerlifeTransaction.objects.get(idtrx=idtrx)
+        trx = FunnerlifeTransaction.objects.only(*CALLBACK_TRX_FIELDS).get(idtrx=data["idtrx"])
     except FunnerlifeTransaction.DoesNotExist:
-        return JsonResponse({"error": "transaction not found"}, status=404)
+        return unknown_transaction(data)
 
-    # Store callback info in response JSON
-    trx.response["callback"] = data
-    trx.save()
+    adopt_correlation_id(trx)
 
-    return JsonResponse({"received": True})
+    # Append the callback and move the transaction's status (conditional UPDATE)
+    return stored_callback(trx, record_callback(trx, data))
+
+
+@csrf_exempt
+async def afunnerlife_callback(request):
+    """funnerlife_callback() for ASGI (ASYNC_VIEWS=True), on the async ORM."""
+    data, error = read_callback(request)
+    if error is not None:
+        return rejected_callback(error)
+
+    try:
+        trx = await FunnerlifeTransaction.objects.only(*CALLBACK_TRX_FIELDS).aget(idtrx=data["idtrx"])
+    except FunnerlifeTransaction.DoesNotExist:
+        return unknown_transaction(data)
+
+    adopt_correlation_id(trx)
+
+    return stored_callback(trx, await sync_to_async(record_callback)(trx, data))
@@ -1,4 +1,36 @@
+import json
+
 from django.contrib import admin
-from .models import IntegrationToken
+from django.utils.html import format_html
+
+from .models import IntegrationToken, SallaOrder, WebhookEvent
 
 admin.site.register(IntegrationToken)
+
+
+def decoded_json(value):
+    """A CompressedJSONField value for a read-only admin field (the stored BLOB isn't editable)."""
+    return format_html("<pre>{}</pre>", json.dumps(value, indent=2, ensure_ascii=False))
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ["event_id", "event_type", "order_id", "status", "retry_count", "received_at"]
+    list_filter = ["status", "event_type"]
+    search_fields = ["event_id", "correlation_id"]
+    readonly_fields = ["payload_decoded"]
+
+    @admin.display(description="Payload")
+    def payload_decoded(self, obj):
+        return decoded_json(obj.payload)
+
+
+@admin.register(SallaOrder)
+class SallaOrderAdmin(admin.ModelAdmin):
+    list_display = ["order_id", "standard_status", "last_event", "updated_at"]
+    list_filter = ["standard_status"]
+    readonly_fields = ["full_payload_decoded"]
+
+    @admin.display(description="Full payload")
+    def full_payload_decoded(self, obj):
+        return decoded_json(obj.full_payload)
@@ -0,0 +1,195 @@
+"""
+Cold storage for old WebhookEvent rows.
+
+Events are moved out of SQLite into append-only segment files under
+WEBHOOK_ARCHIVE_DIR:
+
+    <name>.jsonl.gz   one gzip member per event, so the whole file is plain
+                      JSONL to `zcat` and any record can be read on its own
+    <name>.idx        sorted fixed-width entries (key, offset, length) where
+                      key = first 8 bytes of sha1(event_id); binary-searched
+                      through mmap
+
+Files are written under a temporary name, fsynced and renamed, and the
+rows are deleted only after that, so a crash can at worst leave an event
+both archived and still in the table (the table wins on lookup). The
+event_id of a deleted row stays behind in ArchivedEventId, the dedup guard
+for late redeliveries.
+"""
+import bisect
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedEventId, WebhookEvent
+
+INDEX_ENTRY = struct.Struct(">QQI")  # key, offset, length
+ARCHIVABLE_STATUSES = [WebhookEvent.Status.PROCESSED, WebhookEvent.Status.FAILED]
+
+
+def _archive_dir():
+    path = Path(settings.WEBHOOK_ARCHIVE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _key(event_id):
+    return int.from_bytes(hashlib.sha1(event_id.encode()).digest()[:8], "big")
+
+
+def event_record(event):
+    return {
+        "event_id": event.event_id,
+        "event_type": event.event_type,
+        "payload": event.payload,
+        "signature_valid": event.signature_valid,
+        "received_at": event.received_at,
+        "order_id": event.order_id,
+        "status": event.status,
+        "retry_count": event.retry_count,
+        "next_attempt_at": event.next_attempt_at,
+        "last_error": event.last_error,
+        "fetch_path": event.fetch_path,
+        "correlation_id": event.correlation_id,
+        "processed_at": event.processed_at,
+    }
+
+
+class _IndexView:
+    """Sequence view over an mmapped index file, for bisect."""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __len__(self):
+        return len(self.buf) // INDEX_ENTRY.size
+
+    def __getitem__(self, i):
+        return INDEX_ENTRY.unpack_from(self.buf, i * INDEX_ENTRY.size)[0]
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.buf, i * INDEX_ENTRY.size)
+
+
+def _fsync_rename(tmp, final):
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, final)
+
+
+def write_segment(events):
+    """Write one segment + index for ``events``; returns the segment path."""
+    directory = _archive_dir()
+    name = f"events-{timezone.now():%Y%m%d%H%M%S%f}"
+    data_path = directory / f"{name}.jsonl.gz"
+    index_path = directory / f"{name}.idx"
+
+    entries = []
+    offset = 0
+    with open(f"{data_path}.tmp", "wb") as f:
+        for event in events:
+            line = json.dumps(event_record(event), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+            member = gzip.compress(line.encode(), compresslevel=6)
+            f.write(member)
+            entries.append((_key(event.event_id), offset, len(member)))
+            offset += len(member)
+
+    entries.sort()
+    with open(f"{index_path}.tmp", "wb") as f:
+        for entry in entries:
+            f.write(INDEX_ENTRY.pack(*entry))
+
+    # Data first: an index must never point into a missing file.
+    _fsync_rename(f"{data_path}.tmp", data_path)
+    _fsync_rename(f"{index_path}.tmp", index_path)
+    return data_path
+
+
+def archive_events(older_than_days, segment_size=20000, delete_batch=500):
+    """
+    Move finished events received more than ``older_than_days`` ago into
+    segment files. Returns the number of events archived.
+
+    Each archived event_id is kept in ArchivedEventId (in the transaction
+    that deletes the rows), so its redeliveries stay duplicates.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    qs = (
+        WebhookEvent.objects
+        .filter(received_at__lt=cutoff, status__in=ARCHIVABLE_STATUSES)
+        .order_by("id")
+    )
+
+    archived = 0
+    while True:
+        events = list(qs[:segment_size])
+        if not events:
+            return archived
+
+        write_segment(events)
+
+        ids = [e.pk for e in events]
+        with transaction.atomic():
+            # ignore_conflicts: an earlier run may have crashed after its tombstones.
+            ArchivedEventId.objects.bulk_create(
+                [ArchivedEventId(event_id=e.event_id) for e in events], batch_size=delete_batch, ignore_conflicts=True,
+            )
+            for i in range(0, len(ids), delete_batch):
+                WebhookEvent.objects.filter(pk__in=ids[i:i + delete_batch]).delete()
+        archived += len(events)
+
+
+def find_archived_event(event_id):
+    """Return the archived record dict for ``event_id``, or None."""
+    directory = Path(settings.WEBHOOK_ARCHIVE_DIR)
+    if not directory.exists():
+        return None
+
+    key = _key(event_id)
+    for index_path in sorted(directory.glob("*.idx"), reverse=True):
+        if index_path.stat().st_size == 0:
+            continue
+        with open(index_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            index = _IndexView(buf)
+            i = bisect.bisect_left(index, key)
+            candidates = []
+            while i < len(index) and index[i] == key:
+                candidates.append(index.entry(i))
+                i += 1
+
+        if not candidates:
+            continue
+
+        data_path = index_path.with_suffix(".jsonl.gz")
+        with open(data_path, "rb") as f:
+            for _, offset, length in candidates:
+                f.seek(offset)
+                record = json.loads(gzip.decompress(f.read(length)))
+                if record["event_id"] == event_id:  # guard against hash-prefix collisions
+                    return record
+
+    return None
+
+
+def get_event_record(event_id):
+    """An event as a dict, from the table or else from the archive."""
+    event = WebhookEvent.objects.filter(event_id=event_id).first()
+    if event is not None:
+        record = event_record(event)
+        record["archived"] = False
+        return record
+
+    record = find_archived_event(event_id)
+    if record is not None:
+        record["archived"] = True
+    return record
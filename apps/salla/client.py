@@ -1,17 +1,41 @@
 # salla/client.py
 
+import asyncio
+import contextvars
+import logging
 import os
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
 from django.utils import timezone
+from apps.core.http import get_transport, get_async_transport
+from apps.core.ratelimit import acquire, aacquire, observe, aobserve
+from apps.core.resilience import UpstreamError, call, acall
 from .models import IntegrationToken
 
-BASE_URL = "https://api.salla.dev/admin/v2/"
-TOKEN_URL = "https://accounts.salla.sa/oauth2/token"
+logger = logging.getLogger(__name__)
+
+BASE_URL = settings.SALLA_API_BASE
+TOKEN_URL = settings.SALLA_TOKEN_URL
 
 CLIENT_ID = os.getenv("SALLA_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SALLA_CLIENT_SECRET")
 
+# Runs the independent orders/{id} and orders/items calls side by side.
+_fetch_pool = ThreadPoolExecutor(max_workers=settings.SALLA_FETCH_WORKERS, thread_name_prefix="salla-fetch")
+
+
+def _in_fetch_pool(fn, *args):
+    """Run ``fn`` on a pool thread; its DB connection (rate-limit bucket) is closed like a request's."""
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
 
 def refresh_salla_token(token_obj: IntegrationToken):
 
@@ -25,7 +49,7 @@ def refresh_salla_token(token_obj: IntegrationToken):
         "client_secret": CLIENT_SECRET,
     }
 
-    res = requests.post(TOKEN_URL, data=data, timeout=10)
+    res = call("salla.token", TOKEN_URL, lambda: get_transport().post(TOKEN_URL, data=data, timeout=10))
     res.raise_for_status()
 
     payload = res.json()
@@ -38,63 +62,215 @@ def refresh_salla_token(token_obj: IntegrationToken):
     token_obj.refresh_token = payload.get("refresh_token", token_obj.refresh_token)
     token_obj.expires_at = expires_at
     token_obj.save()
+    logger.info("Salla access token refreshed", extra={"expires_at": expires_at})
 
     return token_obj
 
 
+# In-process token cache: (access_token, expires_at, loaded_at monotonic).
+# Replaced as a whole so the lock-free fast path never sees a torn value.
+_token_cache = None
+_token_lock = threading.Lock()
+
+
+def invalidate_salla_token_cache():
+    global _token_cache
+    with _token_lock:
+        _token_cache = None
+
+
+def _expires_soon(expires_at):
+    if not expires_at:
+        return False
+    margin = timedelta(seconds=settings.SALLA_TOKEN_REFRESH_MARGIN)
+    return timezone.now() + margin >= expires_at
+
+
+def _cached_token():
+    cached = _token_cache
+    if not cached:
+        return None
+    access_token, expires_at, loaded_at = cached
+    if time.monotonic() - loaded_at >= settings.SALLA_TOKEN_CACHE_TTL or _expires_soon(expires_at):
+        return None
+    return access_token
+
+
 def get_salla_access_token():
-    token = IntegrationToken.objects.filter(provider="SALLA").first()
-    if not token:
-        raise Exception("Salla token missing. Reinstall the app to receive app.store.authorize.")
+    """
+    Return a usable Salla access token.
 
-    if token.is_expired():
-        token = refresh_salla_token(token)
+    Served from memory while fresh; the DB row is re-read at most every
+    SALLA_TOKEN_CACHE_TTL seconds and refreshed SALLA_TOKEN_REFRESH_MARGIN
+    seconds before it expires. Only one thread per process refreshes.
+    """
+    global _token_cache
 
-    return token.access_token
+    access_token = _cached_token()
+    if access_token:
+        return access_token
 
-def fetch_order_items(order_id):
-    access_token = get_salla_access_token()
+    with _token_lock:
+        access_token = _cached_token()
+        if access_token:
+            return access_token
 
-    url = f"{BASE_URL}orders/items"
-    headers = {"Authorization": f"Bearer {access_token}"}
+        token = IntegrationToken.objects.filter(provider="SALLA").first()
+        if not token:
+            raise Exception("Salla token missing. Reinstall the app to receive app.store.authorize.")
 
-    try:
-        res = requests.get(url, headers=headers, params={"order_id": order_id}, timeout=15)
-        if res.status_code == 200:
-            return res.json().get("data", []) or []
-        else:
-            print("Error fetching items:", res.status_code, res.text)
-    except Exception as e:
-        print("Exception fetching items:", e)
+        if _expires_soon(token.expires_at):
+            try:
+                token = refresh_salla_token(token)
+            except Exception:
+                # Another process may have rotated the refresh token first;
+                # use its result instead of failing.
+                latest = IntegrationToken.objects.filter(pk=token.pk).first()
+                if not latest or latest.refresh_token == token.refresh_token or latest.is_expired():
+                    logger.exception("Salla token refresh failed")
+                    raise
+                token = latest
 
-    return []  # always safe fallback
+        _token_cache = (token.access_token, token.expires_at, time.monotonic())
+        return token.access_token
+
+def _salla_get(url, **kwargs):
+    """One Admin API request, through the shared "salla" rate limit."""
+    acquire("salla")
+    res = get_transport().get(url, **kwargs)
+    observe("salla", res)
+    return res
 
-def fetch_order_details_from_salla(order_id):
-    access_token = get_salla_access_token()
 
+async def _asalla_get(url, **kwargs):
+    await aacquire("salla")
+    res = await get_async_transport().get(url, **kwargs)
+    await aobserve("salla", res)
+    return res
+
+
+def _data(res, endpoint, order_id):
+    """The `data` of a Salla response; anything but a 200 is an error, never "no data"."""
+    if res.status_code != 200:
+        if res.status_code == 401:
+            invalidate_salla_token_cache()
+        raise UpstreamError(
+            f"{endpoint} for order {order_id}: HTTP {res.status_code} {res.text[:200]}",
+            endpoint, res.status_code,
+        )
+    return res.json().get("data")
+
+
+def _items_request(order_id, access_token, timeout):
+    """URL and request arguments of GET orders/items."""
+    url = f"{BASE_URL}orders/items"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    return url, {"headers": headers, "params": {"order_id": order_id}, "timeout": timeout}
+
+
+def _order_request(order_id, access_token, timeout):
+    """URL and request arguments of GET orders/{id}."""
     url = f"{BASE_URL}orders/{order_id}"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
+    return url, {"headers": headers, "timeout": timeout}
 
-    full = {}
 
-    try:
-        res = requests.get(url, headers=headers, timeout=15)
+def _fetch_timed_out(order_id):
+    return UpstreamError(f"Timed out fetching order {order_id} from Salla", "salla.order")
+
+
+def _with_items(order, items):
+    order["items"] = items
+    return order
+
+
+def fetch_order_items(order_id, access_token=None, timeout=15):
+    access_token = access_token or get_salla_access_token()
+    url, kwargs = _items_request(order_id, access_token, timeout)
+    res = call("salla.items", url, lambda: _salla_get(url, **kwargs))
+    return _data(res, "salla.items", order_id) or []
+
+def fetch_order(order_id, access_token=None, timeout=15):
+    access_token = access_token or get_salla_access_token()
+    url, kwargs = _order_request(order_id, access_token, timeout)
+    res = call("salla.order", url, lambda: _salla_get(url, **kwargs))
+    return _data(res, "salla.order", order_id) or {}
+
+def fetch_order_details_from_salla(order_id):
+    """
+    Fetch the order and its items (from the correct `orders/items` endpoint)
+    in parallel, both bounded by one SALLA_FETCH_DEADLINE. Raises
+    UpstreamError if either can't be fetched.
+
+    At the deadline a fetch still queued for a pool thread is cancelled. One
+    already running can't be interrupted and finishes in the background: no
+    new attempt starts once its retry budget (also SALLA_FETCH_DEADLINE) is
+    spent, so it holds its pool thread for at most about twice the deadline
+    and takes no rate-limit token after the budget.
+    """
+    access_token = get_salla_access_token()
+    deadline = settings.SALLA_FETCH_DEADLINE
+
+    # Each fetch runs in the caller's context (rate-limit priority).
+    order_future = _fetch_pool.submit(
+        contextvars.copy_context().run, _in_fetch_pool, fetch_order, order_id, access_token, deadline,
+    )
+    items_future = _fetch_pool.submit(
+        contextvars.copy_context().run, _in_fetch_pool, fetch_order_items, order_id, access_token, deadline,
+    )
+    done, pending = wait([order_future, items_future], timeout=deadline)
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise _fetch_timed_out(order_id)
+
+    return _with_items(order_future.result(), items_future.result())
+
+
+def fetch_items_from_salla(order_id):
+    """Only the order's items, for webhooks that already carry the order."""
+    return fetch_order_items(order_id, get_salla_access_token(), settings.SALLA_FETCH_DEADLINE)
+
+
+# === ASYNC VARIANTS (async views under ASGI) ===
+
+async def aget_salla_access_token():
+    # The cached token needs no I/O; only a DB read / refresh goes to a thread.
+    return _cached_token() or await sync_to_async(get_salla_access_token)()
+
+
+async def afetch_order_items(order_id, access_token=None, timeout=15):
+    access_token = access_token or await aget_salla_access_token()
+    url, kwargs = _items_request(order_id, access_token, timeout)
+    res = await acall("salla.items", url, lambda: _asalla_get(url, **kwargs))
+    return _data(res, "salla.items", order_id) or []
+
+
+async def afetch_order(order_id, access_token=None, timeout=15):
+    access_token = access_token or await aget_salla_access_token()
+    url, kwargs = _order_request(order_id, access_token, timeout)
+    res = await acall("salla.order", url, lambda: _asalla_get(url, **kwargs))
+    return _data(res, "salla.order", order_id) or {}
+
+
+async def afetch_order_details_from_salla(order_id):
+    """Async fetch_order_details_from_salla(): both calls on the event loop."""
+    access_token = await aget_salla_access_token()
+    deadline = settings.SALLA_FETCH_DEADLINE
 
-        if res.status_code != 200:
-            print("Error fetching order details:", res.status_code, res.text)
-            full = {}
-        else:
-            full = res.json().get("data", {}) or {}
+    order_task = asyncio.ensure_future(afetch_order(order_id, access_token, deadline))
+    items_task = asyncio.ensure_future(afetch_order_items(order_id, access_token, deadline))
+    done, pending = await asyncio.wait([order_task, items_task], timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        raise _fetch_timed_out(order_id)
 
-    except Exception as e:
-        print("Exception during order fetch:", e)
-        full = {}
+    return _with_items(order_task.result(), items_task.result())
 
-    # 🔥 ALWAYS fetch item details from correct endpoint
-    items = fetch_order_items(order_id)
-    full["items"] = items
 
-    return full
+async def afetch_items_from_salla(order_id):
+    return await afetch_order_items(order_id, await aget_salla_access_token(), settings.SALLA_FETCH_DEADLINE)
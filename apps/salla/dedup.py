@@ -0,0 +1,57 @@
+"""
+Recently handled webhooks, to answer Salla's redeliveries without work.
+
+Salla redelivers an event it isn't sure we got. The unique WebhookEvent.event_id
+is the real guard; this per-process LRU of event IDs and body digests lets the
+common case (same body again, shortly after) skip parsing and the database.
+Keys are only added once an event is handled (processed, or queued for the
+worker), so an event that failed is still retried when it is delivered again.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def body_digest(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def content_event_id(digest):
+    """event_id for a webhook that has none: identical bodies get the same one."""
+    return f"sha-{digest}"
+
+
+class RecentWebhooks:
+    """Thread-safe bounded LRU set."""
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def add(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+
+recent_webhooks = RecentWebhooks(settings.WEBHOOK_DEDUP_CACHE_SIZE)
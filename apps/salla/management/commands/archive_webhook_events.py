@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.salla.archive import archive_events, get_event_record
+
+
+class Command(BaseCommand):
+    help = "Move old processed/failed webhook events out of the DB into archive segment files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.WEBHOOK_RETENTION_DAYS,
+                            help="Archive events received more than this many days ago.")
+        parser.add_argument("--segment-size", type=int, default=20000,
+                            help="Max events per segment file.")
+        parser.add_argument("--show", metavar="EVENT_ID",
+                            help="Print one event (from the DB or the archive) instead of archiving.")
+
+    def handle(self, *args, **options):
+        if options["show"]:
+            record = get_event_record(options["show"])
+            if record is None:
+                self.stderr.write("Event not found.")
+                return
+            self.stdout.write(str(record))
+            return
+
+        archived = archive_events(options["days"], segment_size=options["segment_size"])
+        self.stdout.write(f"Archived {archived} webhook events older than {options['days']} days.")
@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q, Subquery
+from django.utils import timezone
+
+from apps.core.metrics import serve_metrics
+from apps.core.ratelimit import BACKGROUND, LIVE, rate_priority
+from apps.salla.models import WebhookEvent
+from apps.salla.webhooks import process_event, process_events, event_order_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain queued Salla webhook events (SALLA_WEBHOOK_MODE=queue). Run a single "
+        "instance: events are not claimed, so two workers would process the same ones. "
+        "Scale with --workers instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.WEBHOOK_WORKER_CONCURRENCY,
+                            help="Max orders processed concurrently.")
+        parser.add_argument("--batch-size", type=int, default=100,
+                            help="Events claimed per polling round.")
+        parser.add_argument("--max-retries", type=int, default=settings.WEBHOOK_MAX_RETRIES,
+                            help="Attempts before an event is marked FAILED.")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--coalesce-window", type=float, default=settings.WEBHOOK_COALESCE_WINDOW,
+                            help="Seconds an order must be quiet before its burst of events is "
+                                 "processed as one (0 = no waiting).")
+        parser.add_argument("--coalesce-max-wait", type=float, default=settings.WEBHOOK_COALESCE_MAX_WAIT,
+                            help="Seconds after which a burst is processed even if its order "
+                                 "is still receiving events.")
+        parser.add_argument("--priority", choices=[LIVE, BACKGROUND],
+                            help="Salla rate-limit priority for every event (default: live for first "
+                                 "attempts, background for retries). Use background for replays.")
+        parser.add_argument("--metrics-port", type=int,
+                            help="Serve this worker's metrics at http://0.0.0.0:<port>/metrics.")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the queue and exit (for scheduled tasks). Waits for bursts "
+                                 "that are still settling; retries not yet due are left for the next run.")
+
+    def handle(self, *args, **options):
+        self.max_retries = options["max_retries"]
+        self.coalesce_window = timedelta(seconds=options["coalesce_window"])
+        self.coalesce_max_wait = timedelta(seconds=options["coalesce_max_wait"])
+        self.priority = options["priority"]
+        if options["metrics_port"]:
+            serve_metrics(options["metrics_port"])
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                processed, settling = self.run_round(pool, options["batch_size"])
+                if processed:
+                    continue
+                if options["once"] and not settling:
+                    break
+                time.sleep(min(options["poll_interval"], self.coalesce_window.total_seconds()) if settling
+                           else options["poll_interval"])
+
+    def run_round(self, pool, batch_size):
+        """
+        Process one batch of due events; returns ``(succeeded, settling)``,
+        settling being the events left for their burst to settle.
+        """
+        now = timezone.now()
+        received = WebhookEvent.objects.filter(status=WebhookEvent.Status.RECEIVED)
+        # An order with an event still backing off waits for it, so newer
+        # events never overtake a failed one. Excluded in the query, so its
+        # waiting events can't fill every batch either.
+        backing_off = received.filter(next_attempt_at__gt=now, order_id__isnull=False).values("order_id")
+        events = list(
+            received.filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .filter(~Q(order_id__in=Subquery(backing_off)))
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        # Events of one order stay together, in delivery order, on a single
+        # thread; different orders run in parallel.
+        groups = OrderedDict()
+        for event in events:
+            groups.setdefault(event_order_key(event), []).append(event)
+
+        # Let an order's burst settle before handling it, so order.created,
+        # order.updated, order.status.updated ... cost one fetch + one charge run.
+        # A burst that never goes quiet is still handled after coalesce_max_wait.
+        quiet_before = now - self.coalesce_window
+        overdue_before = now - self.coalesce_max_wait
+        ready, settling = [], 0
+        for key, group in groups.items():
+            if (not key.startswith("order:") or group[-1].received_at <= quiet_before
+                    or group[0].received_at <= overdue_before):
+                ready.append(group)
+            else:
+                settling += len(group)
+        if not ready:
+            return 0, settling
+
+        done = sum(pool.map(self.process_group, ready))
+        self.stdout.write(f"Processed {done}/{len(events)} webhook events.")
+        return done, settling
+
+    def process_group(self, events):
+        # Retries are backlog: they yield Salla API capacity to fresh events.
+        priority = self.priority or (BACKGROUND if any(e.retry_count for e in events) else LIVE)
+        try:
+            with rate_priority(priority):
+                if len(events) > 1:
+                    process_events(events, max_retries=self.max_retries)
+                else:
+                    process_event(events[0], max_retries=self.max_retries)
+        except Exception as e:
+            # The whole burst is retried together next round, so later events
+            # of this order never overtake the failed ones.
+            self.stderr.write(
+                f"Webhooks {', '.join(e_.event_id for e_ in events)} failed "
+                f"(attempt {events[-1].retry_count}): {e}"
+            )
+            return 0
+        finally:
+            connection.close()
+        return len(events)
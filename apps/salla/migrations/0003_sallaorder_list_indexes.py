@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salla', '0002_webhookevent_queue_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sallaorder',
+            index=models.Index(fields=['updated_at', 'id'], name='salla_order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sallaorder',
+            index=models.Index(fields=['standard_status', 'updated_at', 'id'], name='salla_order_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sallaorder',
+            index=models.Index(fields=['last_event', 'updated_at', 'id'], name='salla_order_event_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:15
+
+import apps.core.fields
+from django.db import migrations, transaction
+
+
+def compress_legacy_rows(model, field_name, batch_size=500):
+    """
+    Rewrite rows still holding plain JSON text as compressed blobs.
+
+    Walks the table by primary key in batches, one transaction per batch, so
+    it can run on a live database. A legacy row loads as a CompressedValue
+    whose raw value is a str; saving it back writes the compressed form.
+    """
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", field_name)[:batch_size]
+        )
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+
+        legacy = [(pk, value) for pk, value in rows if isinstance(getattr(value, "raw", None), str)]
+        if legacy:
+            with transaction.atomic():
+                for pk, value in legacy:
+                    model.objects.filter(pk=pk).update(**{field_name: value})
+
+
+def compress_existing_rows(apps, schema_editor):
+    # Rows written by the old JSONField are plain JSON text; rewrite them in batches.
+    for model_name, field_name in [("WebhookEvent", "payload"), ("SallaOrder", "full_payload")]:
+        model = apps.get_model("salla", model_name)
+        compress_legacy_rows(model, field_name, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own so large tables don't hold one huge transaction.
+    atomic = False
+
+    dependencies = [
+        ('salla', '0003_sallaorder_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sallaorder',
+            name='full_payload',
+            field=apps.core.fields.CompressedJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='payload',
+            field=apps.core.fields.CompressedJSONField(),
+        ),
+        migrations.RunPython(compress_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:17
+
+from django.db import migrations, models, transaction
+
+
+def extract_event_order_id(event_type, data):
+    """Numeric order id of an order.* / invoice.* event, or None (as at this migration)."""
+    if not event_type.startswith(("order.", "invoice.")):
+        return None
+    try:
+        return int(data.get("id") or data.get("order_id") or data.get("checkout_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backfill_order_ids(apps, schema_editor):
+    WebhookEvent = apps.get_model("salla", "WebhookEvent")
+    last_pk = 0
+    while True:
+        events = list(WebhookEvent.objects.filter(pk__gt=last_pk).order_by("pk")[:500])
+        if not events:
+            return
+        last_pk = events[-1].pk
+
+        with transaction.atomic():
+            for event in events:
+                order_id = extract_event_order_id(event.event_type, (event.payload or {}).get("data") or {})
+                if order_id is not None:
+                    WebhookEvent.objects.filter(pk=event.pk).update(order_id=order_id)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('salla', '0004_compress_payloads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='order_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['received_at', 'id'], name='webhook_received_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['event_type', 'received_at', 'id'], name='webhook_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['order_id', 'received_at', 'id'], name='webhook_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['signature_valid', 'received_at', 'id'], name='webhook_signature_idx'),
+        ),
+        migrations.RunPython(backfill_order_ids, migrations.RunPython.noop),
+    ]
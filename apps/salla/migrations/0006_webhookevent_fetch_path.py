@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salla', '0005_webhookevent_order_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='fetch_path',
+            field=models.CharField(blank=True, choices=[('payload', 'Payload'), ('items', 'Items'), ('full', 'Full'), ('snapshot', 'Snapshot')], default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salla', '0006_webhookevent_fetch_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='correlation_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salla', '0007_webhookevent_correlation_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sallaorder',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salla', '0009_webhookevent_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEventId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=150, unique=True)),
+            ],
+        ),
+    ]
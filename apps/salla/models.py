@@ -3,27 +3,80 @@
 from django.db import models
 from django.utils import timezone
 
+from apps.core.fields import CompressedJSONField
+
 
 class WebhookEvent(models.Model):
+    class Status(models.TextChoices):
+        RECEIVED = "RECEIVED"
+        PROCESSED = "PROCESSED"
+        FAILED = "FAILED"
+
+    class FetchPath(models.TextChoices):
+        PAYLOAD = "payload"    # webhook body was complete, no Salla call
+        ITEMS = "items"        # only orders/items fetched
+        FULL = "full"          # order + items fetched
+        SNAPSHOT = "snapshot"  # stored SallaOrder was fetched after the event arrived
+
     event_id = models.CharField(max_length=150, unique=True)
     event_type = models.CharField(max_length=100)
-    payload = models.JSONField()
+    payload = CompressedJSONField()
     signature_valid = models.BooleanField(default=False)
     received_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RECEIVED, db_index=True)
+    retry_count = models.PositiveIntegerField(default=0)
+    # After a failure: the worker leaves the event (and later events of its order) until then.
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Extracted from payload.data at ingest so events can be searched by order.
+    order_id = models.BigIntegerField(null=True, blank=True)
+    # How the order data was obtained when the event was processed.
+    fetch_path = models.CharField(max_length=20, choices=FetchPath.choices, blank=True, default="")
+    # Request correlation ID; the charges and callbacks of this event log the same one.
+    correlation_id = models.CharField(max_length=64, blank=True, default="", db_index=True)
+
+    class Meta:
+        # Keyset pagination of the event browser, plain and per filter.
+        indexes = [
+            models.Index(fields=["received_at", "id"], name="webhook_received_idx"),
+            models.Index(fields=["event_type", "received_at", "id"], name="webhook_type_idx"),
+            models.Index(fields=["order_id", "received_at", "id"], name="webhook_order_idx"),
+            models.Index(fields=["signature_valid", "received_at", "id"], name="webhook_signature_idx"),
+        ]
 
     def __str__(self):
         return f"{self.event_type} ({self.event_id})"
 
 
+class ArchivedEventId(models.Model):
+    """
+    The event_id of every archived WebhookEvent, so a redelivery is still
+    caught as a duplicate after its row has moved to the archive.
+    """
+    event_id = models.CharField(max_length=150, unique=True)
+
+
 class SallaOrder(models.Model):
     order_id = models.BigIntegerField(unique=True)
-    full_payload = models.JSONField()
+    full_payload = CompressedJSONField()
     standard_status = models.CharField(max_length=100)
     custom_status = models.CharField(max_length=150, blank=True, default="")
     last_event = models.CharField(max_length=100)
+    # How current full_payload is: start of the Salla fetch (or arrival of the
+    # webhook whose body it is). Unlike updated_at, not moved by a late write.
+    fetched_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination of the dashboard order list, plain and filtered.
+        indexes = [
+            models.Index(fields=["updated_at", "id"], name="salla_order_updated_idx"),
+            models.Index(fields=["standard_status", "updated_at", "id"], name="salla_order_status_idx"),
+            models.Index(fields=["last_event", "updated_at", "id"], name="salla_order_event_idx"),
+        ]
+
 
 class IntegrationToken(models.Model):
     provider = models.CharField(max_length=50, default="SALLA")
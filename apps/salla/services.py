@@ -1,4 +1,55 @@
 
+def extract_order_id(data):
+    return data.get("id") or data.get("order_id") or data.get("checkout_id")
+
+
+def extract_event_order_id(event_type, data):
+    """Numeric order id for the WebhookEvent.order_id column, or None."""
+    if not event_type.startswith(("order.", "invoice.")):
+        return None
+    try:
+        return int(extract_order_id(data))
+    except (TypeError, ValueError):
+        return None
+
+
+# Events whose `data` is the order itself (invoice.* and payment events carry
+# something else and always need a fetch).
+ORDER_PAYLOAD_EVENTS = ["order.created", "order.updated", "order.status.updated"]
+
+
+def _item_is_complete(item):
+    # Option values must be non-empty lists, the shape extract_player_id()
+    # reads; anything else ("value": "12345") is fetched from orders/items.
+    options = item.get("options")
+    return (
+        bool(item.get("sku"))
+        and isinstance(options, list)
+        and all(isinstance(o, dict) and isinstance(o.get("value"), list) and o["value"] for o in options)
+    )
+
+
+def payload_completeness(event_type, data):
+    """
+    How much of the order the webhook body already carries:
+
+    "complete"       status and items with their option values: no fetch needed
+    "items_missing"  the order is there but items are absent or partial
+    "incomplete"     anything else: fetch the order and its items
+    """
+    if event_type not in ORDER_PAYLOAD_EVENTS:
+        return "incomplete"
+
+    status = data.get("status")
+    if not isinstance(status, dict) or not status.get("slug"):
+        return "incomplete"
+
+    items = data.get("items")
+    if isinstance(items, list) and items and all(isinstance(i, dict) and _item_is_complete(i) for i in items):
+        return "complete"
+    return "items_missing"
+
+
 def extract_player_id(item):
     opts = item.get("options", [])
     if len(opts) < 1:
@@ -0,0 +1,117 @@
+"""
+Synthetic Salla payloads shaped like real Admin API / webhook bodies.
+
+Used by the payload-compression benchmark and load tests; never by the
+request path.
+"""
+import random
+import uuid
+
+from django.utils import timezone
+
+GAME_NAMES = ["شحن جواهر فري فاير", "Mobile Legends Diamonds", "PUBG Mobile UC", "Roblox Robux", "Honor of Kings Tokens"]
+CITIES = ["الرياض", "جدة", "الدمام", "مكة المكرمة", "المدينة المنورة"]
+
+
+def _amount(value, currency="SAR"):
+    return {"amount": round(value, 2), "currency": currency}
+
+
+def sample_item(rng, sku=None, player_id=None, zone_id=None):
+    price = rng.choice([9.99, 19.5, 49, 99, 199])
+    quantity = rng.randint(1, 3)
+    options = [{
+        "id": rng.randint(10 ** 8, 10 ** 9),
+        "name": "Player ID",
+        "type": "text",
+        "value": [player_id or str(rng.randint(10 ** 7, 10 ** 10))],
+    }]
+    if zone_id is not None:
+        options.append({"id": rng.randint(10 ** 8, 10 ** 9), "name": "Zone ID", "type": "text", "value": [zone_id]})
+
+    return {
+        "id": rng.randint(10 ** 8, 10 ** 9),
+        "name": rng.choice(GAME_NAMES),
+        "sku": sku or str(rng.randint(1000, 9999)),
+        "quantity": quantity,
+        "currency": "SAR",
+        "weight": 0,
+        "amounts": {
+            "price_without_tax": _amount(price),
+            "total_discount": _amount(0),
+            "tax": {"percent": "15.00", "amount": _amount(price * 0.15)},
+            "total": _amount(price * quantity * 1.15),
+        },
+        "notes": "",
+        "options": options,
+        "images": [],
+        "codes": [],
+        "files": [],
+        "product": {
+            "id": rng.randint(10 ** 8, 10 ** 9),
+            "type": "digital",
+            "url": f"https://demo.salla.sa/p{rng.randint(10 ** 6, 10 ** 7)}",
+            "thumbnail": "https://cdn.salla.sa/images/product.png",
+        },
+    }
+
+
+def sample_order(order_id=None, items=2, status="paid", rng=None, item_kwargs=None):
+    """A Salla `orders/{id}` style order, including its items."""
+    rng = rng or random.Random()
+    order_id = order_id or rng.randint(10 ** 8, 10 ** 9)
+    order_items = [sample_item(rng, **(item_kwargs or {})) for _ in range(items)]
+    sub_total = sum(i["amounts"]["total"]["amount"] for i in order_items)
+    now = timezone.now()
+
+    return {
+        "id": order_id,
+        "reference_id": rng.randint(10 ** 6, 10 ** 7),
+        "date": {"date": now.strftime("%Y-%m-%d %H:%M:%S.000000"), "timezone_type": 3, "timezone": "Asia/Riyadh"},
+        "source": "store",
+        "source_device": "mobile",
+        "status": {"id": rng.randint(10 ** 8, 10 ** 9), "name": "تم التنفيذ", "slug": status, "customized": {"id": 1, "name": "مدفوع"}},
+        "payment_method": rng.choice(["mada", "credit_card", "apple_pay", "stc_pay"]),
+        "currency": "SAR",
+        "amounts": {
+            "sub_total": _amount(sub_total),
+            "shipping_cost": _amount(0),
+            "cash_on_delivery": _amount(0),
+            "tax": {"percent": "15.00", "amount": _amount(sub_total * 0.15)},
+            "discounts": [],
+            "total": _amount(sub_total * 1.15),
+        },
+        "can_cancel": False,
+        "can_reorder": True,
+        "is_pending_payment": False,
+        "customer": {
+            "id": rng.randint(10 ** 8, 10 ** 9),
+            "first_name": "محمد",
+            "last_name": "العتيبي",
+            "mobile": rng.randint(500000000, 599999999),
+            "mobile_code": "+966",
+            "email": f"customer{rng.randint(1, 10 ** 6)}@example.com",
+            "city": rng.choice(CITIES),
+            "country": "السعودية",
+            "currency": "SAR",
+            "location": "",
+        },
+        "items": order_items,
+        "urls": {
+            "customer": f"https://demo.salla.sa/order/{order_id}",
+            "admin": f"https://s.salla.sa/orders/order/{order_id}",
+        },
+        "store": {"id": 1234567, "name": "Game Top-up Store", "avatar": "https://cdn.salla.sa/store.png"},
+    }
+
+
+def sample_webhook(event="order.created", order=None, merchant=1234567):
+    """A webhook body wrapping ``order`` (or a fresh sample order)."""
+    order = order or sample_order()
+    return {
+        "event": event,
+        "event_id": str(uuid.uuid4()),
+        "merchant": merchant,
+        "created_at": timezone.now().strftime("%a %b %d %Y %H:%M:%S GMT+0300"),
+        "data": order,
+    }
@@ -1,3 +1,936 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.core.fields import CompressedValue
+from apps.core.ratelimit import acquire, drop_leases
+from apps.core.resilience import CircuitOpenError, UpstreamError, get_breaker
+from apps.core.testing import BudgetTestMixin, FakeResponse, FakeTransport, capture_logs, use_fake_transport
+from apps.dashboard import rollups
+from apps.dashboard.models import Rollup
+from apps.funnerlife.models import FunnerLifeService, FunnerlifeTransaction
+from apps.salla.archive import archive_events, find_archived_event
+from apps.salla import client as salla_client
+from apps.salla.client import (
+    fetch_order_details_from_salla, fetch_order_items, get_salla_access_token, invalidate_salla_token_cache,
+)
+from apps.salla.dedup import recent_webhooks
+from apps.salla.models import ArchivedEventId, IntegrationToken, SallaOrder, WebhookEvent
+from apps.salla.synthetic import sample_item, sample_order, sample_webhook
+from apps.salla.views import asalla_webhook, store_webhook_event
+from apps.salla.webhooks import handle_event, process_event
+
+SKUS = [f"{2000 + i}" for i in range(20)]
+
+# Per webhook, whatever the item count (including the archived event_id
+# check, the savepoint pair around the event insert and the dashboard rollup
+# writes: 2, +1 when the latency lands in a new sketch bucket). Outbound
+# calls: one FunnerLife charge per item, plus one orders/items fetch when the
+# body lacks the items.
+WEBHOOK_QUERY_BUDGET = 20
+WEBHOOK_FETCH_QUERY_BUDGET = 22  # + the Salla token read and a "salla" rate-limit lease
+REPEATED_WEBHOOK_QUERY_BUDGET = 15
+DUPLICATE_WEBHOOK_QUERY_BUDGET = 0  # a redelivery this process has handled
+ORDER_LIST_QUERY_BUDGET = 1
+
+
+# The ASGI webhook view, whatever ASYNC_VIEWS the test settings have.
+urlpatterns = [path("api/salla/webhook/", asalla_webhook)]
+
+
+def order_items(order_id, count):
+    rng = random.Random(order_id)
+    return [sample_item(rng, sku=SKUS[i]) for i in range(count)]
+
+
+def upstream():
+    """Fake Salla orders/items and FunnerLife /order endpoints."""
+
+    def items(method, url, kwargs):
+        order_id = int(kwargs["params"]["order_id"])
+        return FakeResponse(200, {"status": 200, "success": True, "data": order_items(order_id, order_id % 100)})
+
+    def charge(method, url, kwargs):
+        return FakeResponse(200, {"status": True, "msg": "Order diproses", "data": {"idtrx": kwargs["data"]["idtrx"]}})
+
+    return FakeTransport({"/orders/items": items, "/order": charge})
+
+
+def first_call_fails(route):
+    """``route``, except that its first call is answered with a 503."""
+    answers = [FakeResponse(503)]
+
+    def route_after_a_503(*args):
+        return answers.pop() if answers else route(*args)
+
+    return route_after_a_503
+
+
+class WebhookTestMixin:
+    """FunnerLife services for SKUS, a Salla token, and helpers to post order webhooks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        IntegrationToken.objects.create(
+            provider="SALLA", access_token="token", refresh_token="refresh",
+            expires_at=timezone.now() + timedelta(days=14),
+        )
+        FunnerLifeService.objects.bulk_create([
+            FunnerLifeService(service_id=sku, name=f"Service {sku}", category="Free Fire", price=10, status="Aktif")
+            for sku in SKUS
+        ])
+
+    def setUp(self):
+        invalidate_salla_token_cache()
+        recent_webhooks.clear()
+        # Lease rate-limit tokens (the bucket row is rolled back between tests)
+        # and create this hour's rollup rows outside the measured requests.
+        drop_leases("salla")
+        acquire("salla")
+        rollups.record(orders=0, latencies={"webhook": [1]})
+        self.next_order = 0
+
+    def post_webhook(self, item_count, with_items=True):
+        # The order id encodes the item count, so the fake orders/items agrees with it.
+        self.next_order += 1
+        order_id = self.next_order * 100 + item_count
+        order = sample_order(order_id=order_id, items=0, status="paid", rng=random.Random(order_id))
+        if with_items:
+            order["items"] = order_items(order_id, item_count)
+        else:
+            order.pop("items")
+
+        return self.post_body(json.dumps(sample_webhook(event="order.created", order=order)).encode())
+
+    def post_body(self, body):
+        headers = {}
+        secret = os.getenv("SALLA_WEBHOOK_SECRET")
+        if secret:
+            headers["x-salla-signature"] = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        response = self.client.post("/api/salla/webhook/", body, content_type="application/json", headers=headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+
+@override_settings(SALLA_WEBHOOK_MODE="inline")
+class WebhookBudgetTests(WebhookTestMixin, BudgetTestMixin, TestCase):
+    """Queries and upstream calls per webhook must not grow with the number of items."""
+
+    def test_webhook_with_items_in_payload(self):
+        for count in [1, 5, 20]:
+            with self.subTest(items=count), use_fake_transport(upstream()) as transport:
+                with self.assertMaxQueries(WEBHOOK_QUERY_BUDGET):
+                    result = self.post_webhook(count)
+
+                self.assertEqual(result["fetch_path"], "payload")
+                self.assertEqual(len(result["charges"]), count)
+                self.assertEqual(transport.count("/order"), count)
+                self.assertEqual(transport.count("/orders/items"), 0)
+
+    def test_webhook_fetching_items(self):
+        for count in [1, 5, 20]:
+            with self.subTest(items=count), use_fake_transport(upstream()) as transport:
+                with self.assertMaxQueries(WEBHOOK_FETCH_QUERY_BUDGET):
+                    result = self.post_webhook(count, with_items=False)
+
+                self.assertEqual(result["fetch_path"], "items")
+                self.assertEqual(len(result["charges"]), count)
+                self.assertEqual(transport.count("/order"), count)
+                self.assertEqual(transport.count("/orders/items"), 1)
+
+    def test_repeated_webhook_does_not_charge_again(self):
+        with use_fake_transport(upstream()) as transport:
+            self.post_webhook(5)
+            self.next_order -= 1  # same order again
+            with self.assertMaxQueries(REPEATED_WEBHOOK_QUERY_BUDGET):
+                result = self.post_webhook(5)
+
+        self.assertEqual(result["charges"], {})
+        self.assertEqual(transport.count("/order"), 5)
+        self.assertEqual(FunnerlifeTransaction.objects.count(), 5)
+
+    def test_redelivered_webhook(self):
+        with use_fake_transport(upstream()) as transport:
+            order = dict(sample_order(order_id=42, items=0), items=order_items(42, 3))
+            body = json.dumps(sample_webhook(event="order.created", order=order)).encode()
+            first = self.post_body(body)
+
+            with self.assertMaxQueries(DUPLICATE_WEBHOOK_QUERY_BUDGET):
+                again = self.post_body(body)
+            self.assertEqual(again, {"duplicate": True})
+
+            recent_webhooks.clear()  # another process: caught by the unique event_id
+            self.assertEqual(self.post_body(body), {"duplicate": True})
+
+        self.assertEqual(len(first["charges"]), 3)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(transport.count("/order"), 3)
+
+    def test_webhook_without_event_id_is_deduplicated(self):
+        webhook = sample_webhook(event="order.created", order=dict(sample_order(order_id=43, items=0), items=order_items(43, 1)))
+        webhook.pop("event_id", None)
+        body = json.dumps(webhook).encode()
+        with use_fake_transport(upstream()):
+            self.post_body(body)
+            recent_webhooks.clear()
+            self.assertEqual(self.post_body(body), {"duplicate": True})
+
+        self.assertTrue(WebhookEvent.objects.get().event_id.startswith("sha-"))
+
+    def test_webhook_wall_time(self):
+        with use_fake_transport(upstream()):
+            self.assertWallTime("salla.webhook_20_items", lambda: self.post_webhook(20))
+
+
+@override_settings(SALLA_WEBHOOK_MODE="inline")
+class WebhookPipelineTests(WebhookTestMixin, TestCase):
+    """What a webhook fetches, reuses and charges."""
+
+    def test_option_value_that_is_not_a_list_is_fetched(self):
+        order = dict(sample_order(order_id=101, items=0), items=order_items(101, 1))
+        order["items"][0]["options"][0]["value"] = "12345"
+        with use_fake_transport(upstream()) as transport:
+            result = self.post_body(json.dumps(sample_webhook(event="order.created", order=order)).encode())
+
+        self.assertEqual(result["fetch_path"], "items")
+        self.assertEqual(transport.count("/orders/items"), 1)
+        fetched_player_id = order_items(101, 1)[0]["options"][0]["value"][0]
+        self.assertEqual(FunnerlifeTransaction.objects.get().target, fetched_player_id)
+
+    def test_event_without_order_data_fetches_the_order(self):
+        # order.payment.updated bodies don't carry the order: orders/{id} + orders/items.
+        order = sample_order(order_id=303, items=0, status="paid")
+        transport = upstream()
+        transport.routes["/orders/303"] = lambda *args: FakeResponse(200, {"status": 200, "data": order})
+
+        with use_fake_transport(transport):
+            result = handle_event("order.payment.updated", {"id": 303}, received_at=timezone.now())
+
+        self.assertEqual(result["fetch_path"], "full")
+        self.assertEqual((transport.count("/orders/303"), transport.count("/orders/items")), (1, 1))
+        self.assertEqual(len(result["charges"]), 3)
+        stored = SallaOrder.objects.get(order_id=303)
+        self.assertEqual((stored.standard_status, len(stored.full_payload["items"])), ("paid", 3))
+
+    def test_complete_payload_of_an_unpaid_order(self):
+        order = dict(sample_order(order_id=304, items=0, status="pending_payment"), items=order_items(304, 2))
+        with use_fake_transport(upstream()) as transport:
+            result = handle_event("order.created", order, received_at=timezone.now())
+
+        self.assertEqual(result, {"saved": True, "fetch_path": "payload"})
+        self.assertEqual(transport.count(), 0)
+        self.assertEqual(SallaOrder.objects.get(order_id=304).standard_status, "pending_payment")
+
+    def test_snapshot_fetched_before_the_event_is_not_reused(self):
+        # An earlier event's fetch started before this event arrived but was
+        # saved after it: updated_at is newer, the data isn't.
+        now = timezone.now()
+        SallaOrder.objects.create(
+            order_id=300, full_payload={"items": []}, standard_status="pending_payment",
+            last_event="order.created", fetched_at=now - timedelta(seconds=60),
+        )
+        order = dict(sample_order(order_id=300, items=0, status="paid"), items=order_items(300, 2))
+
+        with use_fake_transport(upstream()) as transport:
+            result = handle_event("order.updated", order, received_at=now - timedelta(seconds=30))
+
+        self.assertEqual(result["fetch_path"], "payload")
+        self.assertEqual(len(result["charges"]), 2)
+        self.assertEqual(transport.count("/order"), 2)
+        stored = SallaOrder.objects.get(order_id=300)
+        self.assertEqual((stored.standard_status, stored.last_event), ("paid", "order.updated"))
+
+    def test_snapshot_fetched_after_the_event_is_reused(self):
+        now = timezone.now()
+        SallaOrder.objects.create(
+            order_id=301, full_payload={"items": []}, standard_status="completed",
+            last_event="order.created", fetched_at=now,
+        )
+        order = sample_order(order_id=301, items=0, status="paid")
+
+        with use_fake_transport(upstream()) as transport:
+            result = handle_event("order.status.updated", order, received_at=now - timedelta(seconds=30))
+
+        self.assertEqual(result, {"saved": True, "fetch_path": "snapshot"})
+        self.assertEqual(transport.count(), 0)
+        self.assertEqual(SallaOrder.objects.get(order_id=301).last_event, "order.status.updated")
+
+    def test_charges_through_an_open_circuit_are_retried(self):
+        breaker = get_breaker(urlsplit(settings.FUNNERLIFE_ORDER_URL).netloc)
+        self.addCleanup(breaker.record_success)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        order = dict(sample_order(order_id=302, items=0, status="paid"), items=order_items(302, 3))
+        event = WebhookEvent.objects.create(
+            event_id="evt-302", event_type="order.created", payload=sample_webhook(event="order.created", order=order),
+        )
+
+        with use_fake_transport(upstream()) as transport:
+            with self.assertRaises(CircuitOpenError):
+                process_event(event)
+            # Nothing was sent: no claims left behind, no attempt used up.
+            self.assertEqual(transport.count("/order"), 0)
+            self.assertFalse(FunnerlifeTransaction.objects.exists())
+            event.refresh_from_db()
+            self.assertEqual((event.status, event.retry_count), (WebhookEvent.Status.RECEIVED, 0))
+
+            breaker.record_success()
+            result = process_event(event)
+
+        self.assertEqual(len(result["charges"]), 3)
+        self.assertEqual(transport.count("/order"), 3)
+        self.assertEqual(FunnerlifeTransaction.objects.count(), 3)
+        self.assertEqual(Rollup.objects.get(period="day").charges, 3)
+
+
+@override_settings(SALLA_WEBHOOK_MODE="inline", ROOT_URLCONF=__name__)
+class AsyncWebhookTests(WebhookTestMixin, TestCase):
+    """asalla_webhook(): the same pipeline on the async ORM and the async transport."""
+
+    def body(self, order_id, with_items=True):
+        order = sample_order(order_id=order_id, items=0, status="paid", rng=random.Random(order_id))
+        if with_items:
+            order["items"] = order_items(order_id, order_id % 100)
+        else:
+            order.pop("items")
+        return json.dumps(sample_webhook(event="order.created", order=order)).encode()
+
+    async def apost(self, body):
+        response = await self.async_client.post("/api/salla/webhook/", body, content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    async def test_redelivered_webhook(self):
+        body = self.body(403)
+        with use_fake_transport(upstream()) as transport:
+            first = await self.apost(body)
+            self.assertEqual(await self.apost(body), {"duplicate": True})
+            recent_webhooks.clear()  # another process: caught by the unique event_id
+            self.assertEqual(await self.apost(body), {"duplicate": True})
+
+        self.assertEqual((first["fetch_path"], len(first["charges"])), ("payload", 3))
+        self.assertEqual(transport.count("/order"), 3)
+        self.assertEqual(await WebhookEvent.objects.acount(), 1)
+        self.assertEqual(await FunnerlifeTransaction.objects.acount(), 3)
+
+    async def test_failed_fetch_is_retried(self):
+        transport = upstream()
+        transport.routes["/orders/items"] = first_call_fails(transport.routes["/orders/items"])
+
+        with use_fake_transport(transport):
+            result = await self.apost(self.body(402, with_items=False))
+
+        self.assertEqual((result["fetch_path"], len(result["charges"])), ("items", 2))
+        self.assertEqual(transport.count("/orders/items"), 2)
+
+    async def test_upstream_error_fails_the_event_until_redelivered(self):
+        body = self.body(404, with_items=False)
+        failing = upstream()
+        failing.routes["/orders/items"] = lambda *args: FakeResponse(500)
+
+        with use_fake_transport(failing):
+            with self.assertRaises(UpstreamError):
+                await self.apost(body)
+        self.addCleanup(get_breaker(urlsplit(failing.calls[0][1]).netloc).record_success)
+        event = await WebhookEvent.objects.aget()
+        self.assertEqual((event.status, event.retry_count), (WebhookEvent.Status.FAILED, 1))
+        self.assertFalse(await FunnerlifeTransaction.objects.aexists())
+
+        # Salla delivers it again: the stored event is retried, not a duplicate.
+        with use_fake_transport(upstream()) as transport:
+            result = await self.apost(body)
+        self.assertEqual(len(result["charges"]), 4)
+        self.assertEqual(transport.count("/order"), 4)
+        await event.arefresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+
+
+@override_settings(SALLA_WEBHOOK_MODE="inline")
+class CorrelationLoggingTests(WebhookTestMixin, TestCase):
+    """The request's correlation ID is on the records logged by the fetch and charge pool threads."""
+
+    def test_pool_threads_log_under_the_request_id(self):
+        order = sample_order(order_id=305, items=0, status="paid")
+        transport = upstream()
+        # Each retry is logged from the pool thread its call runs on.
+        transport.routes["/orders/305"] = first_call_fails(lambda *args: FakeResponse(200, {"status": 200, "data": order}))
+        transport.routes["/order"] = first_call_fails(transport.routes["/order"])
+        body = json.dumps({"event": "order.payment.updated", "event_id": "evt-305", "data": {"id": 305}})
+
+        with use_fake_transport(transport), capture_logs() as lines:
+            response = self.client.post(
+                "/api/salla/webhook/", body, content_type="application/json",
+                headers={"X-Correlation-ID": "corr-305"},
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response["X-Correlation-ID"], "corr-305")
+
+        retried = {line["endpoint"] for line in lines if line["msg"].startswith(("salla.order", "funnerlife.charge"))}
+        self.assertEqual(retried, {"salla.order", "funnerlife.charge"})
+        self.assertEqual({line["correlation_id"] for line in lines}, {"corr-305"})
+
+
+class WorkerTests(WebhookTestMixin, TransactionTestCase):
+    """process_webhooks: coalescing, --once and retry backoff (the worker uses its own threads)."""
+
+    def setUp(self):
+        self.setUpTestData()
+        rollups.reset_cache()
+        super().setUp()
+        fake = use_fake_transport(upstream())
+        self.transport = fake.__enter__()
+        self.addCleanup(fake.__exit__, None, None, None)
+
+    def queue(self, order_id, event_type, seconds_ago):
+        order = dict(sample_order(order_id=order_id, items=0, status="paid"), items=order_items(order_id, 2))
+        event = WebhookEvent.objects.create(
+            event_id=f"evt-{order_id}-{event_type}", event_type=event_type, order_id=order_id,
+            payload=sample_webhook(event=event_type, order=order),
+        )
+        WebhookEvent.objects.filter(pk=event.pk).update(received_at=timezone.now() - timedelta(seconds=seconds_ago))
+        return event
+
+    def work(self, *args):
+        # One worker thread: the in-memory test DB fails concurrent writers with
+        # "table is locked" instead of waiting like a file database does.
+        call_command(
+            "process_webhooks", "--once", "--workers", "1", "--poll-interval", "0.05", *args,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def statuses(self, order_id):
+        return list(WebhookEvent.objects.filter(order_id=order_id).order_by("id").values_list("status", flat=True))
+
+    def test_queued_webhook_is_processed_by_the_worker(self):
+        with override_settings(SALLA_WEBHOOK_MODE="queue"):
+            self.assertEqual(self.post_webhook(3), {"queued": True})
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, WebhookEvent.Status.RECEIVED)
+        self.assertEqual(self.transport.count(), 0)
+
+        self.work("--coalesce-window", "0")
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+        self.assertEqual(self.transport.count("/order"), 3)
+
+    @override_settings(WEBHOOK_MAX_RETRIES=2)
+    def test_event_fails_after_its_last_retry(self):
+        order = sample_order(order_id=405, items=0, status="paid")
+        order.pop("items")
+        event = WebhookEvent.objects.create(
+            event_id="evt-405", event_type="order.created", order_id=405, retry_count=1,
+            payload=sample_webhook(event="order.created", order=order),
+        )
+        with use_fake_transport(FakeTransport({})):  # orders/items: 404
+            self.work("--coalesce-window", "0")
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.retry_count), (WebhookEvent.Status.FAILED, 2))
+        self.assertIsNotNone(event.processed_at)
+        self.assertTrue(event.last_error)
+
+    def test_burst_is_processed_once(self):
+        for i, event_type in enumerate(["order.created", "order.updated", "order.status.updated"]):
+            self.queue(400, event_type, 10 - i)
+        self.work()
+
+        self.assertEqual(self.statuses(400), [WebhookEvent.Status.PROCESSED] * 3)
+        self.assertEqual(self.transport.count("/order"), 2)
+        self.assertEqual(SallaOrder.objects.get(order_id=400).last_event, "order.status.updated")
+
+    def test_interleaved_orders_are_coalesced_per_order(self):
+        self.queue(410, "order.created", 10)
+        self.queue(411, "order.created", 9)
+        self.queue(410, "order.updated", 8)
+        self.queue(411, "order.status.updated", 7)
+        self.work()
+
+        self.assertEqual(self.transport.count("/order"), 4)
+        self.assertEqual(
+            dict(SallaOrder.objects.filter(order_id__in=[410, 411]).values_list("order_id", "last_event")),
+            {410: "order.updated", 411: "order.status.updated"},
+        )
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.Status.PROCESSED).count(), 4)
+
+    def test_failed_burst_is_retried_together(self):
+        for i, event_type in enumerate(["order.created", "order.updated"]):
+            order = sample_order(order_id=412, items=0, status="paid")
+            order.pop("items")
+            event = WebhookEvent.objects.create(
+                event_id=f"evt-412-{i}", event_type=event_type, order_id=412,
+                payload=sample_webhook(event=event_type, order=order),
+            )
+            WebhookEvent.objects.filter(pk=event.pk).update(received_at=timezone.now() - timedelta(seconds=10 - i))
+        with use_fake_transport(FakeTransport({})) as transport:  # orders/items: 404
+            self.work()
+
+        self.assertEqual(transport.count("/orders/items"), 1)
+        events = WebhookEvent.objects.filter(order_id=412)
+        self.assertEqual(
+            list(events.values_list("status", "retry_count")), [(WebhookEvent.Status.RECEIVED, 1)] * 2,
+        )
+        self.assertEqual(len({event.last_error for event in events}), 1)
+
+    def test_once_waits_for_a_settling_burst(self):
+        self.queue(401, "order.created", 0)
+        self.work("--coalesce-window", "0.3")
+        self.assertEqual(self.statuses(401), [WebhookEvent.Status.PROCESSED])
+
+    def test_busy_order_is_processed_after_max_wait(self):
+        self.queue(402, "order.created", 20)
+        self.queue(402, "order.updated", 0)
+        self.work("--coalesce-window", "60", "--coalesce-max-wait", "10")
+        self.assertEqual(self.statuses(402), [WebhookEvent.Status.PROCESSED] * 2)
+
+    def test_failed_events_back_off(self):
+        breaker = get_breaker(urlsplit(settings.FUNNERLIFE_ORDER_URL).netloc)
+        self.addCleanup(breaker.record_success)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        failed = self.queue(403, "order.created", 10)
+        self.work()
+
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.retry_count), (WebhookEvent.Status.RECEIVED, 0))
+        self.assertGreater(failed.next_attempt_at, timezone.now() + timedelta(seconds=settings.CIRCUIT_RESET_TIMEOUT - 5))
+
+        # Not due yet: skipped, and holds back the newer event of its order; other orders go ahead.
+        breaker.record_success()
+        self.queue(403, "order.updated", 5)
+        self.queue(404, "order.created", 10)
+        self.work()
+        self.assertEqual(self.statuses(403), [WebhookEvent.Status.RECEIVED] * 2)
+        self.assertEqual(self.statuses(404), [WebhookEvent.Status.PROCESSED])
+
+        WebhookEvent.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        self.work()
+        self.assertEqual(self.statuses(403), [WebhookEvent.Status.PROCESSED] * 2)
+        self.assertEqual(FunnerlifeTransaction.objects.filter(order__order_id=403).count(), 2)
+
+    def test_backing_off_order_does_not_fill_the_batch(self):
+        self.queue(406, "order.created", 20)
+        WebhookEvent.objects.filter(order_id=406).update(retry_count=1, next_attempt_at=timezone.now() + timedelta(minutes=5))
+        # More waiting events of that order than a batch holds, all older than the other order's.
+        for i in range(5):
+            WebhookEvent.objects.create(
+                event_id=f"evt-406-{i}", event_type="order.updated", order_id=406,
+                payload=sample_webhook(event="order.updated", order=sample_order(order_id=406, items=0)),
+            )
+        self.queue(407, "order.created", 10)
+
+        self.work("--batch-size", "3", "--coalesce-window", "0")
+        self.assertEqual(self.statuses(407), [WebhookEvent.Status.PROCESSED])
+        self.assertEqual(self.statuses(406), [WebhookEvent.Status.RECEIVED] * 6)
+
+
+class OrderFetchTests(WebhookTestMixin, TestCase):
+    """fetch_order_details_from_salla(): orders/{id} and orders/items side by side, under one deadline."""
+
+    def routes(self, order_id):
+        return {
+            f"/orders/{order_id}": lambda *args: FakeResponse(200, {"status": 200, "data": sample_order(order_id=order_id, items=0)}),
+            "/orders/items": lambda *args: FakeResponse(200, {"status": 200, "data": order_items(order_id, 2)}),
+        }
+
+    def test_order_and_items_are_fetched_in_parallel(self):
+        routes = self.routes(501)
+        both = threading.Barrier(2, timeout=2)  # passes only when both requests are in flight at once
+
+        def together(route):
+            def wait_for_the_other(*args):
+                both.wait()
+                return route(*args)
+            return wait_for_the_other
+
+        with use_fake_transport(FakeTransport({path: together(route) for path, route in routes.items()})):
+            order = fetch_order_details_from_salla(501)
+
+        self.assertEqual((order["id"], order["items"]), (501, order_items(501, 2)))
+
+    def test_error_from_either_fetch(self):
+        for failing in ["/orders/502", "/orders/items"]:
+            with self.subTest(failing=failing):
+                routes = self.routes(502)
+                routes[failing] = lambda *args: FakeResponse(404, {"status": 404, "success": False})
+                with use_fake_transport(FakeTransport(routes)):
+                    with self.assertRaises(UpstreamError) as raised:
+                        fetch_order_details_from_salla(502)
+                self.assertEqual(raised.exception.status_code, 404)
+
+    @override_settings(SALLA_FETCH_DEADLINE=0.1)
+    def test_deadline(self):
+        release = threading.Event()
+        routes = self.routes(503)
+        order = routes["/orders/503"]
+
+        def slow_order(*args):
+            release.wait(5)
+            return order(*args)
+
+        routes["/orders/503"] = slow_order
+        # One pool thread: the order fetch holds it, the items fetch is still queued at the deadline.
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        with mock.patch.object(salla_client, "_fetch_pool", pool), use_fake_transport(FakeTransport(routes)) as transport:
+            with self.assertRaisesMessage(UpstreamError, "Timed out fetching order 503"):
+                fetch_order_details_from_salla(503)
+            release.set()
+            pool.shutdown(wait=True)
+
+        # The running fetch finished in the background; the queued one was cancelled.
+        self.assertEqual((transport.count("/orders/503"), transport.count("/orders/items")), (1, 0))
+
+
+class SallaTokenTests(TransactionTestCase):
+    """The access token is served from memory and refreshed once per process."""
+
+    def setUp(self):
+        invalidate_salla_token_cache()
+        self.addCleanup(invalidate_salla_token_cache)
+
+    def store_token(self, expires_in):
+        return IntegrationToken.objects.create(
+            provider="SALLA", access_token="old", refresh_token="refresh",
+            expires_at=timezone.now() + timedelta(seconds=expires_in),
+        )
+
+    def token_endpoint(self):
+        def refresh(method, url, kwargs):
+            time.sleep(0.05)  # long enough for every caller to queue up behind the refresh
+            return FakeResponse(200, {"access_token": "new", "refresh_token": "refresh-2", "expires_in": 3600})
+
+        return FakeTransport({urlsplit(settings.SALLA_TOKEN_URL).path: refresh})
+
+    def test_cached_token_needs_no_query(self):
+        self.store_token(expires_in=3600)
+        self.assertEqual(get_salla_access_token(), "old")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_salla_access_token(), "old")
+
+    def test_concurrent_callers_share_one_refresh(self):
+        self.store_token(expires_in=60)  # inside SALLA_TOKEN_REFRESH_MARGIN
+        tokens = []
+
+        def caller():
+            try:
+                tokens.append(get_salla_access_token())
+            finally:
+                connection.close()
+
+        with use_fake_transport(self.token_endpoint()) as transport:
+            threads = [threading.Thread(target=caller) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(tokens, ["new"] * 8)
+        self.assertEqual(transport.count(), 1)
+        stored = IntegrationToken.objects.get()
+        self.assertEqual((stored.access_token, stored.refresh_token), ("new", "refresh-2"))
+
+    def test_unauthorized_response_drops_the_cached_token(self):
+        token = self.store_token(expires_in=3600)
+        get_salla_access_token()
+        IntegrationToken.objects.filter(pk=token.pk).update(access_token="rotated")
+        self.assertEqual(get_salla_access_token(), "old")
+
+        with use_fake_transport(FakeTransport({"/orders/items": lambda *args: FakeResponse(401)})):
+            with self.assertRaises(UpstreamError):
+                fetch_order_items(1)
+        self.assertEqual(get_salla_access_token(), "rotated")
+
+
+class OrderListBudgetTests(BudgetTestMixin, TestCase):
+    """The order list reads one page, however many orders are stored."""
+
+    ORDERS = 50_000
+
+    @classmethod
+    def setUpTestData(cls):
+        statuses = ["paid", "completed", "canceled"]
+        SallaOrder.objects.bulk_create(
+            [
+                SallaOrder(order_id=i, full_payload={}, standard_status=statuses[i % 3], last_event="order.created")
+                for i in range(1, cls.ORDERS + 1)
+            ],
+            batch_size=5000,
+        )
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+
+    def get(self, query=""):
+        response = self.api.get(f"/api/salla/orders/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_pages(self):
+        with self.assertMaxQueries(ORDER_LIST_QUERY_BUDGET):
+            first = self.get("?limit=50")
+        self.assertEqual(len(first["orders"]), 50)
+
+        with self.assertMaxQueries(ORDER_LIST_QUERY_BUDGET):
+            second = self.get(f"?limit=50&status=paid&cursor={first['next_cursor']}")
+        self.assertTrue(all(o["standard_status"] == "paid" for o in second["orders"]))
+
+    def test_wall_time(self):
+        self.assertWallTime("salla.order_list_page_50k", lambda: self.get("?limit=50&status=paid"))
+
+
+class OrderListTests(TestCase):
+    """Walking the keyset pages returns every order once, newest first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        SallaOrder.objects.bulk_create([
+            SallaOrder(order_id=i, full_payload={"items": []}, standard_status="paid" if i % 2 else "completed")
+            for i in range(1, 31)
+        ])
+        # Ties on updated_at are broken by id.
+        now = timezone.now()
+        SallaOrder.objects.filter(order_id__lte=20).update(updated_at=now - timedelta(minutes=1))
+        SallaOrder.objects.filter(order_id__gt=20).update(updated_at=now)
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        cache.clear()  # the cached count=true total
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+
+    def get(self, query=""):
+        response = self.api.get(f"/api/salla/orders/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def walk(self, query):
+        order_ids, cursor = [], None
+        while True:
+            page = self.get(f"{query}&cursor={cursor}" if cursor else query)
+            order_ids += [order["order_id"] for order in page["orders"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                return order_ids
+
+    def test_pages_cover_every_order_once(self):
+        self.assertEqual(self.walk("?limit=7"), list(range(30, 20, -1)) + list(range(20, 0, -1)))
+        self.assertEqual(self.walk("?limit=4&status=paid"), list(range(29, 0, -2)))
+
+    def test_new_orders_do_not_shift_later_pages(self):
+        first = self.get("?limit=10")
+        SallaOrder.objects.create(order_id=31, full_payload={}, standard_status="paid")
+        second = self.get(f"?limit=10&cursor={first['next_cursor']}")
+        self.assertEqual([order["order_id"] for order in second["orders"]], list(range(20, 10, -1)))
+
+    def test_payload_is_not_read(self):
+        with CaptureQueriesContext(connection) as captured:
+            body = self.get("?limit=5&count=true")
+        self.assertEqual(body["count"], 30)
+        self.assertNotIn("full_payload", body["orders"][0])
+        self.assertFalse(any("full_payload" in query["sql"] for query in captured.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.api.get("/api/salla/orders/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressedPayloadTests(TestCase):
+    """Payloads are stored compressed and decoded only when read."""
+
+    payload = {"items": [{"sku": SKUS[i], "name": "Diamonds", "quantity": 1} for i in range(10)]}
+
+    def stored(self, order_id):
+        return SallaOrder.objects.filter(order_id=order_id).values_list("full_payload", flat=True).get()
+
+    def test_round_trip(self):
+        SallaOrder.objects.create(order_id=1, full_payload=self.payload)
+        stored = self.stored(1)
+        self.assertIsInstance(stored.raw, bytes)
+        self.assertLess(len(stored.raw), len(json.dumps(self.payload)))
+        self.assertEqual(SallaOrder.objects.get(order_id=1).full_payload, self.payload)
+
+    def test_unread_payload_is_saved_unchanged(self):
+        SallaOrder.objects.create(order_id=2, full_payload=self.payload)
+        before = self.stored(2).raw
+
+        order = SallaOrder.objects.get(order_id=2)
+        self.assertIsInstance(order.__dict__["full_payload"], CompressedValue)
+        order.standard_status = "completed"
+        order.save()
+        self.assertIsInstance(order.__dict__["full_payload"], CompressedValue)
+        self.assertEqual(self.stored(2).raw, before)
+
+    def test_legacy_json_text(self):
+        order = SallaOrder.objects.create(order_id=3, full_payload={})
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {SallaOrder._meta.db_table} SET full_payload = %s WHERE id = %s",
+                [json.dumps(self.payload), order.pk],
+            )
+        self.assertTrue(self.stored(3).is_legacy)
+        self.assertEqual(SallaOrder.objects.get(order_id=3).full_payload, self.payload)
+
+        # The data migration rewrites it compressed.
+        migration = importlib.import_module("apps.salla.migrations.0004_compress_payloads")
+        migration.compress_legacy_rows(SallaOrder, "full_payload", batch_size=2)
+        self.assertFalse(self.stored(3).is_legacy)
+        self.assertEqual(SallaOrder.objects.get(order_id=3).full_payload, self.payload)
+
+    def test_admin_shows_the_decoded_payload(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        event = WebhookEvent.objects.create(event_id="evt-admin", event_type="order.created", payload=self.payload)
+        order = SallaOrder.objects.create(order_id=4, full_payload=self.payload)
+
+        for url in [f"/admin/salla/webhookevent/{event.pk}/change/", f"/admin/salla/sallaorder/{order.pk}/change/"]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, "&quot;sku&quot;: &quot;2000&quot;")
+        self.assertContains(self.client.get("/admin/salla/webhookevent/"), "evt-admin")
+
+
+class ArchiveTests(TestCase):
+    """Old finished events move to segment files and stay readable from there."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(WEBHOOK_ARCHIVE_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.directory = directory
+
+    def event(self, event_id, status, days_ago):
+        event = WebhookEvent.objects.create(
+            event_id=event_id, event_type="order.created", status=status, order_id=500,
+            payload=sample_webhook(event="order.created", order=sample_order(order_id=500)),
+        )
+        WebhookEvent.objects.filter(pk=event.pk).update(received_at=timezone.now() - timedelta(days=days_ago))
+        return event
+
+    def test_archive_and_lookup(self):
+        Status = WebhookEvent.Status
+        old = [self.event(f"evt-old-{i}", Status.PROCESSED if i % 2 else Status.FAILED, 40) for i in range(5)]
+        self.event("evt-waiting", Status.RECEIVED, 40)
+        self.event("evt-recent", Status.PROCESSED, 1)
+
+        self.assertEqual(archive_events(30, segment_size=2), 5)
+        self.assertEqual(
+            sorted(WebhookEvent.objects.values_list("event_id", flat=True)), ["evt-recent", "evt-waiting"],
+        )
+
+        segments = sorted(os.listdir(self.directory))
+        self.assertEqual(len([name for name in segments if name.endswith(".jsonl.gz")]), 3)
+        self.assertEqual(len([name for name in segments if name.endswith(".idx")]), 3)
+        self.assertFalse([name for name in segments if name.endswith(".tmp")])
+        # Each segment reads as plain JSONL.
+        lines = []
+        for name in segments:
+            if name.endswith(".jsonl.gz"):
+                with gzip.open(os.path.join(self.directory, name), "rt") as f:
+                    lines += [json.loads(line)["event_id"] for line in f]
+        self.assertEqual(sorted(lines), sorted(event.event_id for event in old))
+
+        for event in old:
+            record = find_archived_event(event.event_id)
+            self.assertEqual(record["payload"], event.payload)
+            self.assertEqual((record["status"], record["order_id"]), (event.status, 500))
+        self.assertIsNone(find_archived_event("evt-unknown"))
+
+    def test_archived_event_is_still_a_duplicate(self):
+        event = self.event("evt-late", WebhookEvent.Status.PROCESSED, 40)
+        archive_events(30)
+
+        stored, response = store_webhook_event(
+            {"event_id": "evt-late", "event_type": "order.created", "payload": event.payload, "_digest": "d"}
+        )
+        self.assertIsNone(stored)
+        self.assertEqual(json.loads(response.content), {"duplicate": True})
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        # Archiving again (e.g. after a crash between the segment and the delete) keeps one tombstone.
+        self.event("evt-late", WebhookEvent.Status.PROCESSED, 40)
+        self.assertEqual(archive_events(30), 1)
+        self.assertEqual(ArchivedEventId.objects.filter(event_id="evt-late").count(), 1)
+
+    def test_event_details_fall_back_to_the_archive(self):
+        self.event("evt-archived", WebhookEvent.Status.PROCESSED, 40)
+        archive_events(30)
+        api = APIClient()
+        api.force_authenticate(user=self.admin)
+
+        body = api.get("/api/salla/events/evt-archived/").json()
+        self.assertEqual((body["event_id"], body["archived"]), ("evt-archived", True))
+        self.assertEqual(api.get("/api/salla/events/evt-unknown/").status_code, 404)
+
+
+class EventListTests(TestCase):
+    """The event browser filters on indexed columns and never returns payloads."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        Status = WebhookEvent.Status
+        for i, (event_type, status, order_id) in enumerate([
+            ("order.created", Status.PROCESSED, 600),
+            ("order.updated", Status.PROCESSED, 600),
+            ("order.created", Status.FAILED, 601),
+            ("app.store.authorize", Status.PROCESSED, None),
+        ]):
+            event = WebhookEvent.objects.create(
+                event_id=f"evt-{i}", event_type=event_type, status=status, order_id=order_id, payload={"secret": 1},
+            )
+            WebhookEvent.objects.filter(pk=event.pk).update(received_at=now - timedelta(hours=i))
+        cls.admin = User.objects.create_user("admin", is_staff=True)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+
+    def event_ids(self, query):
+        response = self.api.get(f"/api/salla/events/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        events = response.json()["events"]
+        self.assertFalse(any("payload" in event for event in events))
+        return [event["event_id"] for event in events]
+
+    def test_filters(self):
+        self.assertEqual(self.event_ids(""), ["evt-0", "evt-1", "evt-2", "evt-3"])
+        self.assertEqual(self.event_ids("?order_id=600"), ["evt-0", "evt-1"])
+        self.assertEqual(self.event_ids("?event_type=order.created&status=FAILED"), ["evt-2"])
+        since = (timezone.now() - timedelta(hours=1, minutes=30)).isoformat()
+        self.assertEqual(self.event_ids(f"?from={since.replace('+', '%2B')}"), ["evt-0", "evt-1"])
+
+    def test_invalid_filters(self):
+        for query in ["?order_id=abc", "?from=yesterday", "?cursor=nope"]:
+            with self.subTest(query=query):
+                self.assertEqual(self.api.get(f"/api/salla/events/{query}").status_code, 400)
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import path
-from .views import salla_webhook, list_orders , get_order_details
+from .views import salla_webhook, asalla_webhook, list_orders , get_order_details, list_events, get_event_details
 urlpatterns = [
-    path("webhook/", salla_webhook),
+    path("webhook/", asalla_webhook if settings.ASYNC_VIEWS else salla_webhook),
+    path("events/", list_events),
+    path("events/<str:event_id>/", get_event_details),
     path("orders/", list_orders),
     path("orders/<int:order_id>/", get_order_details),
 ]
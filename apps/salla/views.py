@@ -1,52 +1,114 @@
 import json
 import hmac
 import hashlib
+import logging
 import os
-from datetime import datetime
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .models import WebhookEvent, SallaOrder, IntegrationToken
+from .models import ArchivedEventId, WebhookEvent, SallaOrder
 from .client import fetch_order_details_from_salla
+from .webhooks import process_event, aprocess_event, event_type_label
+from .archive import get_event_record
+from .dedup import body_digest, content_event_id, recent_webhooks
+from .services import extract_event_order_id
 
-from apps.funnerlife.client import charge_funnerlife
-from apps.funnerlife.models import FunnerlifeTransaction, FunnerLifeService
-from apps.salla.services import extract_player_id, extract_zone_id, build_target
+from apps.core.logs import get_correlation_id
+from apps.core.metrics import WEBHOOK_DUPLICATES, WEBHOOK_EVENTS
+from apps.core.pagination import keyset_page, page_size
+from apps.core.resilience import UpstreamError
 
-
-ORDER_EVENTS = [
-    "order.created",
-    "order.updated",
-    "order.status.updated",
-    "order.payment.updated",
-    "invoice.created",
-]
+logger = logging.getLogger(__name__)
 
 
 @csrf_exempt
 def salla_webhook(request):
-    # GET: return list of recent webhook events
+    # GET: return list of recent webhook events (no payloads; see list_events)
     if request.method == "GET":
-        events = WebhookEvent.objects.order_by("-received_at")[:100]
-        return JsonResponse({
-            "count": events.count(),
-            "events": [
-                {
-                    "event_id": e.event_id,
-                    "event_type": e.event_type,
-                    "signature_valid": e.signature_valid,
-                    "received_at": e.received_at.isoformat(),
-                }
-                for e in events
-            ]
-        }, status=200)
+        events = list(
+            WebhookEvent.objects.order_by("-received_at", "-id")
+            .values("event_id", "event_type", "signature_valid", "received_at")[:100]
+        )
+        for e in events:
+            e["received_at"] = e["received_at"].isoformat()
+        return JsonResponse({"count": len(events), "events": events}, status=200)
 
     # POST: process webhook
+    event_fields, response = read_webhook(request)
+    if response:
+        return response
+
+    # === SAVE WEBHOOK EVENT ===
+    event, response = store_webhook_event(event_fields)
+    if response:
+        return response
+
+    # === QUEUE MODE: ACK NOW, `process_webhooks` WORKER DOES THE REST ===
+    if queued_webhook(event):
+        remember_webhook(event_fields)
+        return JsonResponse({"queued": True})
+
+    result = process_event(event, max_retries=1)
+    remember_webhook(event_fields)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+async def asalla_webhook(request):
+    """
+    salla_webhook() for ASGI (ASYNC_VIEWS=True): Salla/FunnerLife calls are
+    awaited instead of holding a worker thread each.
+    """
+    if request.method == "GET":
+        return await sync_to_async(salla_webhook)(request)
+
+    event_fields, response = read_webhook(request)
+    if response:
+        return response
+
+    event, response = await sync_to_async(store_webhook_event)(event_fields)
+    if response:
+        return response
+
+    if queued_webhook(event):
+        remember_webhook(event_fields)
+        return JsonResponse({"queued": True})
+
+    result = await aprocess_event(event, max_retries=1)
+    remember_webhook(event_fields)
+    return JsonResponse(result)
+
+
+def queued_webhook(event):
+    """
+    Whether the event is left to the worker. Install events stay inline so
+    the token is usable immediately.
+    """
+    return settings.SALLA_WEBHOOK_MODE == "queue" and event.event_type != "app.store.authorize"
+
+
+def duplicate_webhook(stage, event_id=None):
+    WEBHOOK_DUPLICATES.inc(stage=stage)
+    logger.info("Salla webhook duplicate ignored", extra={"event_id": event_id, "stage": stage})
+    return JsonResponse({"duplicate": True})
+
+
+def read_webhook(request):
+    """
+    Verify and parse a webhook POST; returns (WebhookEvent fields, response).
+    ``response`` is set when the request ends here: 401 for a wrong
+    signature, 200 for a webhook this process has already handled.
+    """
     body = request.body or b""
 
     # === HMAC SIGNATURE VALIDATION ===
@@ -58,7 +120,13 @@ def salla_webhook(request):
         computed = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
         valid_signature = hmac.compare_digest(signature, computed)
         if not valid_signature:
-            return HttpResponse(status=401)
+            logger.warning("Salla webhook rejected: bad signature")
+            return None, HttpResponse(status=401)
+
+    # === DUPLICATE CHECK (before any parsing) ===
+    digest = body_digest(body)
+    if digest in recent_webhooks:
+        return None, duplicate_webhook("memory")
 
     # === PARSE PAYLOAD ===
     try:
@@ -66,124 +134,176 @@ def salla_webhook(request):
     except:
         payload = {}
 
-    event_type = payload.get("event") or "unknown"
-    event_id = payload.get("event_id") or f"auto-{timezone.now().timestamp()}"
-    data = payload.get("data", {})
+    event_id = str(payload.get("event_id") or content_event_id(digest))
+    if event_id in recent_webhooks:
+        return None, duplicate_webhook("memory", event_id)
 
-    # === SAVE WEBHOOK EVENT ===
-    WebhookEvent.objects.create(
-        event_id=event_id,
-        event_type=event_type,
-        payload=payload,
-        signature_valid=valid_signature,
+    event_type = payload.get("event") or "unknown"
+    fields = {
+        "event_id": event_id,
+        "event_type": event_type,
+        "payload": payload,
+        "signature_valid": valid_signature,
+        "order_id": extract_event_order_id(event_type, payload.get("data") or {}),
+        "correlation_id": get_correlation_id() or "",
+    }
+    WEBHOOK_EVENTS.inc(event_type=event_type_label(event_type))
+    logger.info(
+        "Salla webhook received",
+        extra={"event_id": fields["event_id"], "event_type": event_type, "order_id": fields["order_id"]},
     )
+    fields["_digest"] = digest
+    return fields, None
 
-    # === HANDLE INSTALL AUTH EVENT ===
-    if event_type == "app.store.authorize":
-        expires_unix = data.get("expires")
-        expires_at = datetime.fromtimestamp(expires_unix) if expires_unix else None
-
-        IntegrationToken.objects.update_or_create(
-            provider="SALLA",
-            defaults={
-                "access_token": data.get("access_token"),
-                "refresh_token": data.get("refresh_token"),
-                "expires_at": expires_at,
-            }
-        )
-        return JsonResponse({"token_saved": True})
-
-    # === IGNORE NON-ORDER EVENTS ===
-    if event_type not in ORDER_EVENTS:
-        return JsonResponse({"ignored": True})
-
-    # === EXTRACT ORDER ID ===
-    order_id = data.get("id") or data.get("order_id") or data.get("checkout_id")
-    if not order_id:
-        return JsonResponse({"no_order_id": True})
-
-    # === FETCH FULL ORDER DETAILS ===
-    full_order = fetch_order_details_from_salla(order_id)
-    status_slug = full_order.get("status", {}).get("slug", "")
-
-    # === SAVE ORDER SNAPSHOT ===
-    salla_order, _ = SallaOrder.objects.update_or_create(
-        order_id=order_id,
-        defaults={
-            "full_payload": full_order,
-            "standard_status": status_slug,
-            "last_event": event_type,
-        }
-    )
 
-    # === FUNNERLIFE CHARGE TRIGGER =====
-    if status_slug in ["paid", "processing", "under_review"]:
-        items = full_order.get("items", [])
+def store_webhook_event(fields):
+    """
+    Create the WebhookEvent; returns (event, response).
+
+    A redelivered event_id is caught by the unique index: ``response`` is the
+    duplicate 200, unless the stored event never got processed (it failed, or
+    inline processing broke off), in which case the redelivery retries it.
+    An event_id that has been archived is always a duplicate.
+    """
+    fields = {k: v for k, v in fields.items() if not k.startswith("_")}
+    if ArchivedEventId.objects.filter(event_id=fields["event_id"]).exists():
+        return None, duplicate_webhook("archive", fields["event_id"])
+    try:
+        with transaction.atomic():
+            return WebhookEvent.objects.create(**fields), None
+    except IntegrityError:
+        event = WebhookEvent.objects.filter(event_id=fields["event_id"]).first()
+        if event is None:
+            raise
+
+    if event.status == WebhookEvent.Status.PROCESSED or (
+        settings.SALLA_WEBHOOK_MODE == "queue" and event.status == WebhookEvent.Status.RECEIVED
+    ):
+        return None, duplicate_webhook("db", event.event_id)
+
+    logger.info("Salla webhook redelivered, retrying it", extra={"event_id": event.event_id, "status": event.status})
+    event.status = WebhookEvent.Status.RECEIVED
+    event.processed_at = None
+    event.save(update_fields=["status", "processed_at"])
+    return event, None
+
 
-        for item in items:
-            sku = item.get("sku")
-            if not sku:
-                continue
+def remember_webhook(fields):
+    """Later deliveries of this webhook are answered from memory."""
+    recent_webhooks.add(fields["event_id"], fields["_digest"])
 
-            # Find matching FunnerLife service (by service_id == sku)
-            try:
-                funner_service = FunnerLifeService.objects.get(service_id=sku)
-            except FunnerLifeService.DoesNotExist:
-                continue
 
-            # Idempotency: avoid double charge
-            if FunnerlifeTransaction.objects.filter(
-                    order_id=order_id,
-                    sku=sku
-            ).exists():
-                continue
+EVENT_LIST_FIELDS = ["event_id", "event_type", "order_id", "signature_valid", "status", "retry_count", "fetch_path", "correlation_id", "received_at", "processed_at"]
 
-            # Extract Player ID
-            player_id = extract_player_id(item)
 
-            # Extract Zone ID only IF there is options[1]
-            zone_id = None
-            try:
-                zone_id = extract_zone_id(item)
-            except:
-                pass  # acceptable for games without zone
+@api_view(["GET"])
+def list_events(request):
+    """
+    Newest-first webhook events, one keyset page at a time, without payloads.
+
+    Query params: event_type, signature_valid (true/false), status, order_id,
+    fetch_path, correlation_id, from / to (ISO datetimes on received_at), limit, cursor.
+    """
+    qs = WebhookEvent.objects.all()
+    params = request.GET
+
+    if params.get("event_type"):
+        qs = qs.filter(event_type=params["event_type"])
+    if params.get("status"):
+        qs = qs.filter(status=params["status"])
+    if params.get("fetch_path"):
+        qs = qs.filter(fetch_path=params["fetch_path"])
+    if params.get("correlation_id"):
+        qs = qs.filter(correlation_id=params["correlation_id"])
+    if params.get("signature_valid") in ("true", "false"):
+        qs = qs.filter(signature_valid=params["signature_valid"] == "true")
+    if params.get("order_id"):
+        try:
+            qs = qs.filter(order_id=int(params["order_id"]))
+        except ValueError:
+            return Response({"error": "order_id must be an integer"}, status=400)
+
+    for param, lookup in [("from", "received_at__gte"), ("to", "received_at__lt")]:
+        if params.get(param):
+            value = parse_datetime(params[param])
+            if value is None:
+                return Response({"error": f"{param} must be an ISO datetime"}, status=400)
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            qs = qs.filter(**{lookup: value})
 
-            # Build target
-            target = build_target(player_id, zone_id, {"category": funner_service.category})
+    try:
+        rows, next_cursor = keyset_page(
+            qs.values("id", *EVENT_LIST_FIELDS),
+            "received_at",
+            cursor=params.get("cursor"),
+            size=page_size(params),
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
-            # Perform charge
-            result = charge_funnerlife(item, {"category": funner_service.category})
+    for row in rows:
+        del row["id"]
 
-            # Store transaction
-            FunnerlifeTransaction.objects.create(
-                idtrx=result["idtrx"],
-                order=salla_order,
-                sku=sku,
-                target=target,
-                response=result["response_payload"],
-            )
+    return Response({"events": rows, "next_cursor": next_cursor})
 
-    return JsonResponse({"saved": True})
+
+# Dashboard: one webhook event with its payload (falls back to the archive)
+@api_view(["GET"])
+def get_event_details(request, event_id):
+    record = get_event_record(event_id)
+    if record is None:
+        return Response({"error": "Event not found"}, status=404)
+    return Response(record)
+
+
+ORDER_LIST_FIELDS = ["order_id", "standard_status", "custom_status", "last_event", "updated_at"]
+ORDER_COUNT_CACHE_SECONDS = 60
 
 
 # Dashboard: list saved orders
 @api_view(["GET"])
 def list_orders(request):
-    qs = SallaOrder.objects.order_by("-updated_at")
+    """
+    Newest-first orders, one keyset page at a time.
 
-    return Response({
-        "count": qs.count(),
-        "orders": [
-            {
-                "order_id": o.order_id,
-                "standard_status": o.standard_status,
-                "custom_status": o.custom_status,
-                "last_event": o.last_event,
-                "updated_at": o.updated_at,
-            }
-            for o in qs
-        ]
-    })
+    Query params: status, last_event (filters), limit, cursor (from the
+    previous page's next_cursor), count=true to include the (cached) total.
+    """
+    qs = SallaOrder.objects.all()
+
+    status_ = request.GET.get("status")
+    if status_:
+        qs = qs.filter(standard_status=status_)
+
+    last_event = request.GET.get("last_event")
+    if last_event:
+        qs = qs.filter(last_event=last_event)
+
+    try:
+        rows, next_cursor = keyset_page(
+            qs.values("id", *ORDER_LIST_FIELDS),
+            "updated_at",
+            cursor=request.GET.get("cursor"),
+            size=page_size(request.GET),
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    for row in rows:
+        del row["id"]
+
+    response = {"orders": rows, "next_cursor": next_cursor}
+
+    if request.GET.get("count") == "true":
+        cache_key = f"salla:orders:count:{status_ or ''}:{last_event or ''}"
+        count = cache.get(cache_key)
+        if count is None:
+            count = qs.count()
+            cache.set(cache_key, count, ORDER_COUNT_CACHE_SECONDS)
+        response["count"] = count
+
+    return Response(response)
 
 
 # Dashboard: order details
@@ -201,7 +321,10 @@ def get_order_details(request, order_id):
     refresh = request.GET.get("refresh") == "true"
 
     if refresh:
-        full = fetch_order_details_from_salla(order_id)
+        try:
+            full = fetch_order_details_from_salla(order_id)
+        except UpstreamError as e:
+            return Response({"error": str(e)}, status=502)
         if full:
             order.full_payload = full
             order.standard_status = full.get("status", {}).get("slug", "")
@@ -0,0 +1,501 @@
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import WebhookEvent, SallaOrder, IntegrationToken
+from .client import (
+    fetch_order_details_from_salla, fetch_items_from_salla, invalidate_salla_token_cache,
+    afetch_order_details_from_salla, afetch_items_from_salla,
+)
+from .services import extract_order_id, extract_player_id, extract_zone_id, build_target, payload_completeness
+
+from apps.core.logs import correlation
+from apps.core.metrics import CHARGES, WEBHOOK_DELAY_SECONDS, WEBHOOK_PROCESSING_SECONDS
+from apps.core.resilience import CircuitOpenError
+from apps.dashboard import rollups
+from apps.funnerlife.client import charge_funnerlife, acharge_funnerlife
+from apps.funnerlife.executor import get_charge_executor
+from apps.funnerlife.models import FunnerlifeTransaction
+from apps.funnerlife.services import get_services_by_sku, get_charged_skus, claim_charges, transition
+
+logger = logging.getLogger(__name__)
+
+
+ORDER_EVENTS = [
+    "order.created",
+    "order.updated",
+    "order.status.updated",
+    "order.payment.updated",
+    "invoice.created",
+]
+
+CHARGEABLE_STATUSES = ["paid", "processing", "under_review"]
+
+
+def event_type_label(event_type):
+    """Event type as a metrics label; unknown types share one series."""
+    return event_type if event_type in ORDER_EVENTS or event_type == "app.store.authorize" else "other"
+
+
+def handle_event(event_type, data, received_at=None):
+    """
+    Run the integration pipeline for one webhook payload and return the response body.
+
+    ``received_at`` is when the event arrived; a stored snapshot fetched from
+    Salla after that is already fresher than anything this event can tell us.
+    """
+
+    # === HANDLE INSTALL AUTH EVENT ===
+    if event_type == "app.store.authorize":
+        return save_install_token(data)
+
+    # === IGNORE NON-ORDER EVENTS / NO ORDER ID ===
+    result = skipped_event(event_type, data)
+    if result is not None:
+        return result
+    order_id = extract_order_id(data)
+
+    # === GET ORDER DETAILS (payload, snapshot or Salla API) ===
+    salla_order = fresh_snapshot(order_id, received_at).first()
+
+    if salla_order is not None:
+        fetch_path, full_order = WebhookEvent.FetchPath.SNAPSHOT, salla_order.full_payload
+        if salla_order.last_event != event_type:
+            SallaOrder.objects.filter(pk=salla_order.pk).update(**snapshot_event_update(event_type))
+    else:
+        fetch_path = choose_fetch_path(event_type, data)
+        fetched_at = fetch_started_at(fetch_path, received_at)
+        if fetch_path == WebhookEvent.FetchPath.PAYLOAD:
+            full_order = data
+        elif fetch_path == WebhookEvent.FetchPath.ITEMS:
+            full_order = dict(data, items=fetch_items_from_salla(order_id))
+        else:
+            full_order = fetch_order_details_from_salla(order_id)
+
+        # === SAVE ORDER SNAPSHOT ===
+        salla_order, created = SallaOrder.objects.update_or_create(
+            order_id=order_id, defaults=snapshot_defaults(full_order, event_type, fetched_at),
+        )
+        if created:
+            rollups.record(orders=1)
+
+    # === FUNNERLIFE CHARGE TRIGGER =====
+    if salla_order.standard_status in CHARGEABLE_STATUSES:
+        charges = charge_order_items(salla_order, full_order.get("items", []))
+        return {"saved": True, "fetch_path": fetch_path, "charges": charges}
+
+    return {"saved": True, "fetch_path": fetch_path}
+
+
+async def ahandle_event(event_type, data, received_at=None):
+    """
+    handle_event() for async views: Salla and FunnerLife calls are awaited on
+    the event loop, DB steps go through the async ORM. The decisions are the
+    same helpers handle_event() uses.
+    """
+    if event_type == "app.store.authorize":
+        return await sync_to_async(save_install_token)(data)
+
+    result = skipped_event(event_type, data)
+    if result is not None:
+        return result
+    order_id = extract_order_id(data)
+
+    salla_order = await fresh_snapshot(order_id, received_at).afirst()
+
+    if salla_order is not None:
+        fetch_path, full_order = WebhookEvent.FetchPath.SNAPSHOT, salla_order.full_payload
+        if salla_order.last_event != event_type:
+            await SallaOrder.objects.filter(pk=salla_order.pk).aupdate(**snapshot_event_update(event_type))
+    else:
+        fetch_path = choose_fetch_path(event_type, data)
+        fetched_at = fetch_started_at(fetch_path, received_at)
+        if fetch_path == WebhookEvent.FetchPath.PAYLOAD:
+            full_order = data
+        elif fetch_path == WebhookEvent.FetchPath.ITEMS:
+            full_order = dict(data, items=await afetch_items_from_salla(order_id))
+        else:
+            full_order = await afetch_order_details_from_salla(order_id)
+
+        salla_order, created = await SallaOrder.objects.aupdate_or_create(
+            order_id=order_id, defaults=snapshot_defaults(full_order, event_type, fetched_at),
+        )
+        if created:
+            await sync_to_async(rollups.record)(orders=1)
+
+    if salla_order.standard_status in CHARGEABLE_STATUSES:
+        charges = await acharge_order_items(salla_order, full_order.get("items", []))
+        return {"saved": True, "fetch_path": fetch_path, "charges": charges}
+
+    return {"saved": True, "fetch_path": fetch_path}
+
+
+def skipped_event(event_type, data):
+    """The response for an event that never reaches the order pipeline, else None."""
+    if event_type not in ORDER_EVENTS:
+        return {"ignored": True}
+    if not extract_order_id(data):
+        return {"no_order_id": True}
+    return None
+
+
+def fresh_snapshot(order_id, received_at):
+    """The stored order if it was fetched after the event arrived (a queryset: .first() / .afirst())."""
+    if received_at is None:
+        return SallaOrder.objects.none()
+    return SallaOrder.objects.filter(order_id=order_id, fetched_at__gt=received_at)
+
+
+def snapshot_event_update(event_type):
+    """Fields to UPDATE when a reused snapshot gets a newer event."""
+    return {"last_event": event_type, "updated_at": timezone.now()}
+
+
+def snapshot_defaults(full_order, event_type, fetched_at):
+    """update_or_create() defaults for the order snapshot of ``full_order``."""
+    return {
+        "full_payload": full_order,
+        "standard_status": full_order.get("status", {}).get("slug", ""),
+        "last_event": event_type,
+        "fetched_at": fetched_at,
+    }
+
+
+def save_install_token(data):
+    expires_unix = data.get("expires")
+    expires_at = datetime.fromtimestamp(expires_unix) if expires_unix else None
+
+    IntegrationToken.objects.update_or_create(
+        provider="SALLA",
+        defaults={
+            "access_token": data.get("access_token"),
+            "refresh_token": data.get("refresh_token"),
+            "expires_at": expires_at,
+        }
+    )
+    invalidate_salla_token_cache()
+    logger.info("Salla access token saved from app.store.authorize")
+    return {"token_saved": True}
+
+
+def choose_fetch_path(event_type, data):
+    """What must be fetched from Salla, given what the webhook body carries."""
+    completeness = payload_completeness(event_type, data)
+    if completeness == "complete":
+        return WebhookEvent.FetchPath.PAYLOAD
+    if completeness == "items_missing":
+        return WebhookEvent.FetchPath.ITEMS
+    return WebhookEvent.FetchPath.FULL
+
+
+def fetch_started_at(fetch_path, received_at):
+    """
+    How current the order data about to be obtained is: the webhook body is
+    Salla's state when the event was sent, a fetch is at least as new as its
+    start. Taken before the fetch, so an event arriving while it is in flight
+    never treats the result as newer than itself.
+    """
+    if fetch_path == WebhookEvent.FetchPath.PAYLOAD and received_at is not None:
+        return received_at
+    return timezone.now()
+
+
+def charge_order_items(salla_order, items):
+    """
+    Charge every FunnerLife item of the order; returns {sku: outcome}.
+
+    Lookups, claims and result writes run on this thread; only the FunnerLife
+    calls go to the charge executor and run in parallel. A failing item is
+    reported in its outcome and never stops the others.
+    """
+    outcomes, trxs, pending = claim_order_items(salla_order, items)
+    if not trxs:
+        return outcomes
+
+    # Perform charges in parallel
+    results = get_charge_executor().run("funnerlife", [
+        (charge_funnerlife, pending[trx.sku], {"idtrx": trx.idtrx})
+        for trx in trxs
+    ])
+    store_charge_results(trxs, results, outcomes)
+    return outcomes
+
+
+async def acharge_order_items(salla_order, items):
+    """charge_order_items() with the FunnerLife calls awaited on the event loop."""
+    outcomes, trxs, pending = await sync_to_async(claim_order_items)(salla_order, items)
+    if not trxs:
+        return outcomes
+
+    results = await get_charge_executor().arun("funnerlife", [
+        (acharge_funnerlife, pending[trx.sku], {"idtrx": trx.idtrx})
+        for trx in trxs
+    ])
+    await sync_to_async(store_charge_results)(trxs, results, outcomes)
+    return outcomes
+
+
+def claim_order_items(salla_order, items):
+    """
+    Find the order's chargeable items and claim them.
+
+    Returns ``(outcomes, trxs, pending)``: outcomes for items that won't be
+    charged, the claimed transactions, and the charge_funnerlife() arguments
+    per sku.
+    """
+    items = [item for item in items if item.get("sku")]
+    if not items:
+        return {}, [], {}
+
+    # Two lookups for the whole order, regardless of item count.
+    services = get_services_by_sku(item["sku"] for item in items)
+    charged = get_charged_skus(salla_order) if services else set()
+
+    outcomes = {}
+    pending = {}
+    targets = {}
+    for item in items:
+        sku = item["sku"]
+
+        # Find matching FunnerLife service (by service_id == sku)
+        funner_service = services.get(sku)
+        if funner_service is None:
+            continue
+
+        # Idempotency: avoid double charge
+        if sku in charged or sku in pending:
+            continue
+
+        try:
+            # Extract Player ID
+            player_id = extract_player_id(item)
+
+            # Extract Zone ID only IF there is options[1]
+            zone_id = None
+            try:
+                zone_id = extract_zone_id(item)
+            except:
+                pass  # acceptable for games without zone
+
+            # Build target
+            targets[sku] = build_target(player_id, zone_id, {"category": funner_service.category})
+        except Exception as e:
+            outcomes[sku] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+
+        pending[sku] = (item, {"category": funner_service.category})
+
+    # Claim (order, sku) before calling FunnerLife; a lost claim = already charged
+    claims = claim_charges(salla_order, targets)
+    for sku in pending:
+        if sku not in claims:
+            outcomes[sku] = {"skipped": "already claimed"}
+
+    return outcomes, list(claims.values()), pending
+
+
+def store_charge_results(trxs, results, outcomes):
+    """
+    Store charge responses on the claimed transactions and fill ``outcomes``.
+
+    A failed call keeps its claim (and PENDING): it may have reached
+    FunnerLife. A call that was never sent (circuit open, rate limited,
+    connection refused) gives its claim back, and the first such error is
+    raised once the rest is stored, so the event is retried and charges it.
+    """
+    rejected = []
+    unsent = []
+    for trx, (result, error) in zip(trxs, results):
+        log = {"sku": trx.sku, "idtrx": trx.idtrx}
+        if error is None:
+            trx.response = result["response_payload"]
+            outcomes[trx.sku] = {"idtrx": trx.idtrx, "http_status": result["http_status"]}
+            accepted = result["http_status"] == 200 and (trx.response or {}).get("status") is True
+            CHARGES.inc(result="accepted" if accepted else "rejected")
+            if not accepted:
+                rejected.append(trx)
+            logger.log(
+                logging.INFO if accepted else logging.WARNING,
+                "FunnerLife charge %s", "accepted" if accepted else "rejected",
+                extra={**log, "http_status": result["http_status"], "upstream_msg": (trx.response or {}).get("msg")},
+            )
+        elif not getattr(error, "sent", True):
+            CHARGES.inc(result="not_sent")
+            logger.warning("FunnerLife charge not sent, will be retried: %s", error, extra=log)
+            unsent.append((trx, error))
+        else:
+            CHARGES.inc(result="error")
+            logger.warning("FunnerLife charge failed: %s", error, extra=log)
+            trx.response = {"error": f"{type(error).__name__}: {error}"}
+            outcomes[trx.sku] = {"idtrx": trx.idtrx, "error": trx.response["error"]}
+    released = {trx.pk for trx, _ in unsent}
+    FunnerlifeTransaction.objects.bulk_update([trx for trx in trxs if trx.pk not in released], ["response"])
+    # No callback follows a rejected charge. Status is never bulk-written: a
+    # callback may already have moved it.
+    transition(rejected, FunnerlifeTransaction.Status.FAILED)
+
+    if unsent:
+        FunnerlifeTransaction.objects.filter(pk__in=released).delete()
+        for trx, _ in unsent:
+            rollups.record(trx.created_at, charges=-1)
+        raise unsent[0][1]
+
+
+def process_event(event, max_retries=None):
+    """
+    Process a stored WebhookEvent and record the outcome on it.
+
+    A failure bumps ``retry_count``; the event stays RECEIVED (so the worker
+    picks it up again) until ``max_retries`` attempts have been used, then it
+    is marked FAILED. The exception is re-raised for the caller.
+    """
+    return process_events([event], max_retries=max_retries)
+
+
+def process_events(events, max_retries=None):
+    """
+    Process a burst of stored events for one order as a single unit.
+
+    Only the newest event runs through the pipeline (one Salla fetch, one
+    charge evaluation, ``last_event`` = newest type); every event in the
+    burst gets the same outcome recorded on it. Events must be in delivery
+    order. Failure handling is the same as process_event().
+    """
+    latest = events[-1]
+    started = time.perf_counter()
+
+    # In the worker this picks the webhook request's ID back up.
+    with correlation(latest.correlation_id), rollups.batched():
+        try:
+            result = handle_event(*event_args(latest))
+        except Exception as e:
+            record_failure(events, e, max_retries, started)
+            raise
+
+        return record_success(events, result, started)
+
+
+async def aprocess_event(event, max_retries=None):
+    return await aprocess_events([event], max_retries=max_retries)
+
+
+async def aprocess_events(events, max_retries=None):
+    """process_events() around ahandle_event()."""
+    latest = events[-1]
+    started = time.perf_counter()
+
+    with correlation(latest.correlation_id):
+        async with rollups.abatched():
+            try:
+                result = await ahandle_event(*event_args(latest))
+            except Exception as e:
+                await sync_to_async(record_failure)(events, e, max_retries, started)
+                raise
+
+            return await sync_to_async(record_success)(events, result, started)
+
+
+def event_args(event):
+    """handle_event() / ahandle_event() arguments for a stored event."""
+    return event.event_type, (event.payload or {}).get("data") or {}, event.received_at
+
+
+def observe_processing(events, outcome, fetch_path, started=None, now=None):
+    """Pipeline time of the burst and arrival-to-outcome delay of each event."""
+    if started is not None:
+        WEBHOOK_PROCESSING_SECONDS.observe(
+            time.perf_counter() - started, fetch_path=fetch_path or "none", outcome=outcome,
+        )
+    now = now or timezone.now()
+    for event in events:
+        if event.received_at:
+            WEBHOOK_DELAY_SECONDS.observe((now - event.received_at).total_seconds(), outcome=outcome)
+
+
+def retry_delay(retry_count, error):
+    """Seconds before the worker tries a failed event again."""
+    if isinstance(error, CircuitOpenError):
+        return settings.CIRCUIT_RESET_TIMEOUT
+    delay = min(settings.WEBHOOK_RETRY_BACKOFF_MAX, settings.WEBHOOK_RETRY_BACKOFF_BASE * 2 ** max(retry_count - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)  # failed together, retried apart
+
+
+def record_failure(events, error, max_retries=None, started=None):
+    if max_retries is None:
+        max_retries = settings.WEBHOOK_MAX_RETRIES
+
+    now = timezone.now()
+    for event in events:
+        # Nothing was attempted while the upstream's circuit is open, so it
+        # doesn't use up one of the event's attempts.
+        if not isinstance(error, CircuitOpenError):
+            event.retry_count += 1
+        event.last_error = f"{type(error).__name__}: {error}"
+        if event.retry_count >= max_retries:
+            event.status = WebhookEvent.Status.FAILED
+            event.processed_at = now
+        else:
+            event.next_attempt_at = now + timedelta(seconds=retry_delay(event.retry_count, error))
+        event.save(update_fields=["retry_count", "last_error", "status", "processed_at", "next_attempt_at"])
+
+    # Events that will be retried get their delay observed when they finish.
+    failed = [event for event in events if event.status == WebhookEvent.Status.FAILED]
+    logger.warning(
+        "Salla webhook %s: %s", "failed" if failed else "will be retried", error,
+        extra={
+            "event_ids": [event.event_id for event in events],
+            "order_id": events[-1].order_id,
+            "retry_count": events[-1].retry_count,
+        },
+    )
+    observe_processing(failed, "failed" if failed else "retry", "", started)
+    rollups.record(webhooks_failed=len(failed))
+
+
+def record_success(events, result, started=None):
+    if len(events) > 1:
+        result["coalesced"] = len(events)
+
+    # Per-item charge errors don't fail the event (retrying can't fix a
+    # missing Player ID, and claimed items are never re-charged) but are
+    # kept on it for the dashboard.
+    item_errors = [
+        f"{sku}: {outcome['error']}"
+        for sku, outcome in result.get("charges", {}).items()
+        if "error" in outcome
+    ]
+    now = timezone.now()
+    for event in events:
+        event.last_error = "\n".join(item_errors)
+        event.fetch_path = result.get("fetch_path", "")
+        event.status = WebhookEvent.Status.PROCESSED
+        event.processed_at = now
+    WebhookEvent.objects.bulk_update(events, ["status", "processed_at", "last_error", "fetch_path"])
+    observe_processing(events, "processed", result.get("fetch_path"), started, now)
+    rollups.record(
+        now, webhooks_processed=len(events),
+        latencies={"webhook": [rollups.milliseconds(now - e.received_at) for e in events if e.received_at]},
+    )
+    logger.info(
+        "Salla webhook processed",
+        extra={
+            "event_ids": [event.event_id for event in events],
+            "order_id": events[-1].order_id,
+            "fetch_path": result.get("fetch_path"),
+            "charges": len(result.get("charges", {})),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1) if started else None,
+        },
+    )
+    return result
+
+
+def event_order_key(event):
+    """Key used to keep events of the same order in delivery order."""
+    if event.order_id and event.event_type in ORDER_EVENTS:
+        return f"order:{event.order_id}"
+    return f"event:{event.pk}"
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,8 +9,120 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SALLA_WEBHOOK_SECRET = os.getenv("SALLA_WEBHOOK_SECRET")
 
+# "inline": process webhooks inside the request (default).
+# "queue": store + ack immediately; `manage.py process_webhooks` drains the queue.
+SALLA_WEBHOOK_MODE = os.getenv("SALLA_WEBHOOK_MODE", "inline")
+WEBHOOK_WORKER_CONCURRENCY = int(os.getenv("WEBHOOK_WORKER_CONCURRENCY", "4"))
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+# Queue mode: an order's events are processed together once it has been quiet this long,
+# or once its oldest waiting event is WEBHOOK_COALESCE_MAX_WAIT old.
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "3"))
+WEBHOOK_COALESCE_MAX_WAIT = float(os.getenv("WEBHOOK_COALESCE_MAX_WAIT", "30"))
+# A failed event waits BASE * 2**(attempt - 1) seconds (capped at MAX, jittered)
+# before the worker retries it; while a circuit is open, CIRCUIT_RESET_TIMEOUT.
+WEBHOOK_RETRY_BACKOFF_BASE = float(os.getenv("WEBHOOK_RETRY_BACKOFF_BASE", "5"))
+WEBHOOK_RETRY_BACKOFF_MAX = float(os.getenv("WEBHOOK_RETRY_BACKOFF_MAX", "300"))
+# Event IDs / body digests of handled webhooks remembered per process, so a
+# redelivery is answered before parsing (the unique event_id still guards the rest).
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUP_CACHE_SIZE", "10000"))
+
+# Serve the Salla webhook and FunnerLife callback with async views. Turn on when
+# running under ASGI (config/asgi.py); under WSGI the sync views are better.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False").lower() == "true"
+
 ADMIN_KONTAK = os.getenv("ADMIN_KONTAK", "6000000000")
 
+FUNNERLIFE_API_KEY = os.getenv("FUNNERLIFE_API_KEY")
+FUNNERLIFE_CALLBACK_URL = os.getenv("FUNNERLIFE_CALLBACK_URL")
+
+# Upstream endpoints; overridden to point at local stubs by `manage.py loadtest`.
+SALLA_API_BASE = os.getenv("SALLA_API_BASE", "https://api.salla.dev/admin/v2/")
+SALLA_TOKEN_URL = os.getenv("SALLA_TOKEN_URL", "https://accounts.salla.sa/oauth2/token")
+FUNNERLIFE_ORDER_URL = os.getenv("FUNNERLIFE_ORDER_URL", "https://api.funnerlife.id/order")
+
+# Items of an order are charged in parallel: at most CHARGE_MAX_CONCURRENCY calls
+# per process overall, and at most the per-provider value against one upstream.
+CHARGE_MAX_CONCURRENCY = int(os.getenv("CHARGE_MAX_CONCURRENCY", "8"))
+CHARGE_PROVIDER_CONCURRENCY = {
+    "funnerlife": int(os.getenv("FUNNERLIFE_MAX_CONCURRENCY", "4")),
+}
+
+# FunnerLife catalog: served from the DB, refreshed in the background when older
+# than CATALOG_MAX_AGE_DAYS (or by `manage.py sync_funnerlife_services`).
+CATALOG_MAX_AGE_DAYS = int(os.getenv("CATALOG_MAX_AGE_DAYS", "5"))
+CATALOG_STALE_CHECK_INTERVAL = int(os.getenv("CATALOG_STALE_CHECK_INTERVAL", "60"))
+CATALOG_RETRY_INTERVAL = int(os.getenv("CATALOG_RETRY_INTERVAL", "300"))
+
+# Large JSON payloads (WebhookEvent.payload, SallaOrder.full_payload) are stored
+# compressed. "zstd" uses the `zstandard` package from requirements.txt (zlib without it);
+# COMPRESSED_JSON_ZSTD_DICT points at a dictionary from `manage.py train_payload_dictionary`.
+COMPRESSED_JSON_CODEC = os.getenv("COMPRESSED_JSON_CODEC", "zstd")
+COMPRESSED_JSON_LEVEL = int(os.getenv("COMPRESSED_JSON_LEVEL", "6"))
+COMPRESSED_JSON_MIN_SIZE = int(os.getenv("COMPRESSED_JSON_MIN_SIZE", "128"))
+COMPRESSED_JSON_ZSTD_DICT = os.getenv("COMPRESSED_JSON_ZSTD_DICT")
+
+# Finished webhook events older than WEBHOOK_RETENTION_DAYS are moved to
+# compressed segment files by `manage.py archive_webhook_events`.
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "30"))
+WEBHOOK_ARCHIVE_DIR = os.getenv("WEBHOOK_ARCHIVE_DIR", str(BASE_DIR / "archive" / "webhooks"))
+
+# Dashboard rollups (apps/dashboard): relative accuracy of the latency percentiles
+# (after changing it, run `manage.py rebuild_dashboard_rollups`).
+DASHBOARD_SKETCH_ACCURACY = float(os.getenv("DASHBOARD_SKETCH_ACCURACY", "0.05"))
+
+# Shared outbound HTTP transport (apps/core/http.py)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))  # hosts kept in the pool
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))  # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", "200"))  # async views (aiohttp), all hosts
+
+# Order + items are fetched in parallel; both must finish within this many seconds.
+SALLA_FETCH_DEADLINE = float(os.getenv("SALLA_FETCH_DEADLINE", "15"))
+SALLA_FETCH_WORKERS = int(os.getenv("SALLA_FETCH_WORKERS", "8"))
+
+# Outbound retries and circuit breakers (apps/core/resilience.py). Per endpoint:
+# attempts, and a budget in seconds that attempts + backoff must fit in.
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.2"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "5"))
+RETRY_POLICIES = {
+    "salla.order": {"attempts": 3, "budget": SALLA_FETCH_DEADLINE},
+    "salla.items": {"attempts": 3, "budget": SALLA_FETCH_DEADLINE},
+    "salla.token": {"attempts": 2, "budget": 20},
+    "funnerlife.charge": {"attempts": 3, "budget": 60},  # same idtrx on every attempt
+    "funnerlife.services": {"attempts": 3, "budget": 60},
+}
+# A host's circuit opens after this many consecutive failures and stays open this many seconds.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Client-side rate limits (apps/core/ratelimit.py), shared by all processes via the DB.
+# Background calls (retries, replays) can't use the last RATE_LIMIT_LIVE_RESERVE of a bucket.
+RATE_LIMITS = {
+    "salla": {
+        "capacity": float(os.getenv("SALLA_RATE_LIMIT_BURST", "60")),
+        "per_second": float(os.getenv("SALLA_RATE_LIMIT_PER_SECOND", "1")),
+    },
+}
+RATE_LIMIT_LIVE_RESERVE = float(os.getenv("RATE_LIMIT_LIVE_RESERVE", "0.2"))
+# Tokens a process takes from the shared bucket per DB write; unused ones go
+# back after RATE_LIMIT_LEASE_SECONDS.
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "5"))
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", "2"))
+RATE_LIMIT_MAX_WAIT = {  # seconds a call waits for a token before failing
+    "live": float(os.getenv("RATE_LIMIT_MAX_WAIT_LIVE", "10")),
+    "background": float(os.getenv("RATE_LIMIT_MAX_WAIT_BACKGROUND", "300")),
+}
+
+# GET /metrics (Prometheus text format) requires "Authorization: Bearer <METRICS_TOKEN>";
+# when unset it is only served with DEBUG on (404 otherwise).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Access token is cached in memory, re-read from the DB at most every
+# SALLA_TOKEN_CACHE_TTL seconds and refreshed this many seconds before expiry.
+SALLA_TOKEN_CACHE_TTL = int(os.getenv("SALLA_TOKEN_CACHE_TTL", "60"))
+SALLA_TOKEN_REFRESH_MARGIN = int(os.getenv("SALLA_TOKEN_REFRESH_MARGIN", "300"))
+
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY') or os.getenv('SECRET_KEY')
 
 DEBUG = os.getenv('DJANGO_DEBUG', 'True').lower() == 'true'
@@ -48,6 +161,8 @@ REST_FRAMEWORK = {
     ],
 }
 MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',  # first, so it times the whole stack
+    'apps.core.middleware.CorrelationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +174,27 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'config.urls'
 
+# JSON lines on stderr, written by a background thread (apps/core/logs.py).
+# `manage.py test` only logs what LOG_LEVEL asks for (default: nothing below CRITICAL).
+TESTING = sys.argv[1:2] == ["test"]
+LOG_LEVEL = os.getenv("LOG_LEVEL", "CRITICAL" if TESTING else "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "json": {
+            "class": "apps.core.logs.BufferedJSONHandler",
+            "stream": "ext://sys.stderr",
+            "level": LOG_LEVEL if TESTING else "NOTSET",  # django.* loggers too
+            "capacity": int(os.getenv("LOG_BUFFER_SIZE", "10000")),  # records; more are dropped
+        },
+    },
+    "root": {"handlers": ["json"], "level": "WARNING"},
+    "loggers": {
+        "apps": {"level": LOG_LEVEL},
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -82,7 +218,9 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv("SQLITE_PATH") or BASE_DIR / 'db.sqlite3',
+        # IMMEDIATE avoids "database is locked" when many threads write at once.
+        'OPTIONS': {"transaction_mode": os.getenv("SQLITE_TRANSACTION_MODE")} if os.getenv("SQLITE_TRANSACTION_MODE") else {},
     }
 }
 
@@ -13,4 +13,5 @@ urlpatterns = [
     # API for integrations
     path("api/funnerlife/", include("apps.funnerlife.urls")),
     path("api/salla/", include("apps.salla.urls")),
+    path("api/dashboard/", include("apps.dashboard.urls")),
 ]